@@ -0,0 +1,168 @@
+# health.fetcher.py
+import asyncio
+import warnings
+from collections import OrderedDict
+from io import BytesIO
+from typing import Dict, Tuple
+
+import httpx
+from PIL import Image
+
+from common import config
+from common.metrics import FETCH_EVENTS
+from .uploads import SNIFF_BYTES, NotAnImage, UploadTooLarge, sniff_image
+
+# content types some servers send for images; anything else that is not image/* is refused
+GENERIC_TYPES = ("application/octet-stream", "binary/octet-stream", "application/binary")
+# the image header (dimensions) must be readable within this prefix, or the check is left to the decoder
+HEADER_BYTES = 256 * 1024
+# sniff_image extension -> Pillow formats tried when reading the header (HEIC has no Pillow reader)
+PIL_FORMATS = {
+    ".png": ["PNG"], ".jpg": ["JPEG"], ".gif": ["GIF"], ".webp": ["WEBP"],
+    ".bmp": ["BMP"], ".tiff": ["TIFF"], ".avif": ["AVIF"],
+}
+
+
+class ImageFetcher:
+    """
+    Downloads of remote images for /detect. The body is streamed and checked as it arrives, so a
+    bad URL costs at most a few kilobytes:
+    - Content-Type (when sent) must be image/* or a generic binary type,
+    - Content-Length and the bytes actually read are capped at `max_bytes`,
+    - the first bytes must be a known image format (sniff_image),
+    - the dimensions in the image header must stay within `max_pixels`, checked as soon as the
+      header has arrived.
+    Connections are kept alive per host by the shared httpx client. Bodies served with an ETag
+    or Last-Modified are kept (up to `cache_bytes`, LRU) and revalidated with a conditional GET,
+    so a repeated URL costs a 304 instead of the image.
+    """
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        max_bytes: int = config.FETCH_MAX_BYTES,
+        max_pixels: int = config.FETCH_MAX_PIXELS,
+        cache_bytes: int = config.FETCH_CACHE_BYTES,
+        timeout: float = config.FETCH_TOTAL_TIMEOUT,
+    ):
+        self.client = client
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.cache_bytes = cache_bytes
+        self.timeout = timeout
+        # url -> (validators, body), oldest first
+        self._cache: "OrderedDict[str, Tuple[Dict[str, str], bytes]]" = OrderedDict()
+        self._cached_bytes = 0
+
+    async def fetch(self, url: str) -> bytes:
+        """
+        The image at `url`. Raises UploadTooLarge / NotAnImage (both ValueError) for refused
+        bodies, httpx.HTTPError for HTTP failures and TimeoutError past `timeout` seconds in all.
+        """
+        try:
+            return await asyncio.wait_for(self._fetch(url), self.timeout or None)
+        except asyncio.TimeoutError:
+            FETCH_EVENTS.inc(result="timeout")
+            raise TimeoutError(f"Fetching {url} took longer than {self.timeout}s")
+
+    async def _fetch(self, url: str) -> bytes:
+        cached = self._cache.get(url)
+        headers = {"Accept": "image/*"}
+        if cached is not None:
+            validators = cached[0]
+            if "etag" in validators:
+                headers["If-None-Match"] = validators["etag"]
+            if "last-modified" in validators:
+                headers["If-Modified-Since"] = validators["last-modified"]
+
+        async with self.client.stream("GET", url, headers=headers) as resp:
+            if resp.status_code == 304 and cached is not None:
+                await resp.aread()  # empty; reading it hands the connection back to the pool
+                self._cache.move_to_end(url)
+                FETCH_EVENTS.inc(result="not_modified")
+                return cached[1]
+            resp.raise_for_status()
+            try:
+                body = await self._read(resp)
+            except ValueError as e:
+                FETCH_EVENTS.inc(result="too_large" if isinstance(e, UploadTooLarge) else "not_an_image")
+                raise
+
+        FETCH_EVENTS.inc(result="fetched")
+        self._remember(url, resp.headers, body)
+        return body
+
+    async def _read(self, resp: httpx.Response) -> bytes:
+        content_type = resp.headers.get("content-type", "").split(";")[0].strip().lower()
+        if content_type and not content_type.startswith("image/") and content_type not in GENERIC_TYPES:
+            raise NotAnImage(f"URL does not point to an image (Content-Type: {content_type})")
+        declared = resp.headers.get("content-length")
+        if declared and declared.isdigit() and int(declared) > self.max_bytes:
+            raise UploadTooLarge(f"Image exceeds {self.max_bytes} bytes")
+
+        buffer = bytearray()
+        image_format = None
+        header_checked = False
+        async for chunk in resp.aiter_bytes():
+            if len(buffer) + len(chunk) > self.max_bytes:
+                raise UploadTooLarge(f"Image exceeds {self.max_bytes} bytes")
+            buffer += chunk
+            # only the head is copied for the checks, at most HEADER_BYTES per chunk until they are done
+            if image_format is None and len(buffer) >= SNIFF_BYTES:
+                image_format = self._sniff(bytes(buffer[:SNIFF_BYTES]))
+            if image_format is not None and not header_checked:
+                header_checked = self._check_header(bytes(buffer[:HEADER_BYTES]), image_format)
+        body = bytes(buffer)
+        if image_format is None:
+            self._sniff(body)
+        return body
+
+    @staticmethod
+    def _sniff(head: bytes) -> str:
+        ext = sniff_image(head[:SNIFF_BYTES])
+        if ext is None:
+            raise NotAnImage("URL does not point to a supported image")
+        return ext
+
+    def _check_header(self, head: bytes, ext: str) -> bool:
+        """
+        Check the dimensions once the image header is in `head`; True when done (checked, or not
+        readable within HEADER_BYTES: then the decoder's own limits apply). Image.open only parses
+        the header, nothing is decoded or allocated.
+        """
+        formats = PIL_FORMATS.get(ext)
+        if not formats or not self.max_pixels:
+            return True
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", Image.DecompressionBombWarning)  # checked below
+                with Image.open(BytesIO(head), formats=formats) as img:
+                    width, height = img.size
+        except Image.DecompressionBombError:
+            raise UploadTooLarge(f"Image has more than {self.max_pixels} pixels")
+        except Exception:
+            return len(head) >= HEADER_BYTES
+        if width * height > self.max_pixels:
+            raise UploadTooLarge(f"Image is {width}x{height}, more than {self.max_pixels} pixels")
+        return True
+
+    def _remember(self, url: str, headers: httpx.Headers, body: bytes) -> None:
+        validators = {k: headers[k] for k in ("etag", "last-modified") if k in headers}
+        if (
+            not validators
+            or len(body) > self.cache_bytes // 4
+            or "no-store" in headers.get("cache-control", "").lower()
+        ):
+            self._forget(url)
+            return
+        self._forget(url)
+        self._cache[url] = (validators, body)
+        self._cached_bytes += len(body)
+        while self._cached_bytes > self.cache_bytes:
+            _, (_, oldest) = self._cache.popitem(last=False)
+            self._cached_bytes -= len(oldest)
+
+    def _forget(self, url: str) -> None:
+        entry = self._cache.pop(url, None)
+        if entry is not None:
+            self._cached_bytes -= len(entry[1])
@@ -0,0 +1,194 @@
+# health.history.py
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from common import config
+
+AGGREGATES = ("label", "severity")
+
+
+class SqliteHistoryStore:
+    """
+    Every diagnosis served, in a local SQLite database (WAL mode) shared by the uvicorn workers on
+    the host, so a diagnosis can be reopened without running the pipeline again.
+
+    Reads are answered from indexes: by id (unique), per user / field newest first (keyset
+    pagination on (created_at, seq)), and counts per severity or per detection label over a time
+    range. Labels live in a side table (one row per distinct label of a diagnosis) whose indexes
+    cover the label counts.
+
+    A photo resubmitted by the same owner and answered from the cache (same annotated object) is
+    recorded once: add() returns the existing id, so retries do not inflate the history or stats.
+    """
+
+    blocking = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(
+            "CREATE TABLE IF NOT EXISTS diagnoses ("
+            " seq INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, user_id TEXT, field_id TEXT,"
+            " created_at REAL NOT NULL, image_hash TEXT NOT NULL, file_key TEXT, model TEXT NOT NULL,"
+            " prediction TEXT, severity TEXT, labels TEXT NOT NULL, detections TEXT NOT NULL,"
+            " analysis_vn TEXT NOT NULL, timings TEXT);"
+            "CREATE INDEX IF NOT EXISTS diagnoses_user_created ON diagnoses (user_id, created_at);"
+            "CREATE INDEX IF NOT EXISTS diagnoses_field_created ON diagnoses (field_id, created_at);"
+            "CREATE INDEX IF NOT EXISTS diagnoses_created_severity ON diagnoses (created_at, severity);"
+            "CREATE INDEX IF NOT EXISTS diagnoses_image_owner ON diagnoses (image_hash, user_id, field_id);"
+            "CREATE TABLE IF NOT EXISTS diagnosis_labels ("
+            " seq INTEGER NOT NULL, label TEXT NOT NULL, user_id TEXT, field_id TEXT, created_at REAL NOT NULL,"
+            " PRIMARY KEY (seq, label)) WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS labels_created ON diagnosis_labels (created_at, label);"
+            "CREATE INDEX IF NOT EXISTS labels_user_created ON diagnosis_labels (user_id, created_at, label);"
+            "CREATE INDEX IF NOT EXISTS labels_field_created ON diagnosis_labels (field_id, created_at, label);"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=10)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def add(self, record: Dict[str, Any]) -> str:
+        """
+        Store a diagnosis ({user_id, field_id, image_hash, file_key, model, detections,
+        analysis_vn, timings}) and return its id, or the id of the same diagnosis (image, owner,
+        model and annotated object) already recorded.
+        """
+        conn = self._conn()
+        diagnosis_id = uuid.uuid4().hex
+        now = record.get("created_at") or time.time()
+        analysis_vn = record.get("analysis_vn") or {}
+        detections = record.get("detections") or []
+        labels = sorted({d["label"] for d in detections if d.get("label")})
+        owner = (record.get("user_id"), record.get("field_id"))
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            existing = conn.execute(
+                "SELECT id FROM diagnoses WHERE image_hash = ? AND user_id IS ? AND field_id IS ? AND model = ? AND file_key IS ?",
+                (record["image_hash"], *owner, record["model"], record.get("file_key")),
+            ).fetchone()
+            if existing is not None:
+                conn.execute("COMMIT")
+                return existing[0]
+            seq = conn.execute(
+                "INSERT INTO diagnoses (id, user_id, field_id, created_at, image_hash, file_key, model, prediction,"
+                " severity, labels, detections, analysis_vn, timings) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    diagnosis_id, *owner, now, record["image_hash"], record.get("file_key"), record["model"],
+                    analysis_vn.get("prediction"), analysis_vn.get("severity_level") or None,
+                    json.dumps(labels, ensure_ascii=False), json.dumps(detections, ensure_ascii=False),
+                    json.dumps(analysis_vn, ensure_ascii=False), json.dumps(record.get("timings")),
+                ),
+            ).lastrowid
+            conn.executemany(
+                "INSERT INTO diagnosis_labels (seq, label, user_id, field_id, created_at) VALUES (?, ?, ?, ?, ?)",
+                [(seq, label, *owner, now) for label in labels],
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return diagnosis_id
+
+    def get(self, diagnosis_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            "SELECT id, user_id, field_id, created_at, image_hash, file_key, model, detections, analysis_vn, timings"
+            " FROM diagnoses WHERE id = ?",
+            (diagnosis_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            "diagnosis_id": row[0], "user_id": row[1], "field_id": row[2], "created_at": row[3],
+            "image_hash": row[4], "file_key": row[5], "model": row[6], "detections": json.loads(row[7]),
+            "analysis_vn": json.loads(row[8]), "timings": json.loads(row[9]) if row[9] else None,
+        }
+
+    def list(
+        self, user_id: Optional[str] = None, field_id: Optional[str] = None, limit: int = 20, cursor: Optional[str] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        One page of a user's or a field's diagnoses, newest first, and the cursor of the next page
+        (None on the last one). At least one of user_id and field_id is required.
+        """
+        where, params = _owner_clause(user_id, field_id)
+        if not where:
+            raise ValueError("user_id or field_id is required")
+        sql = f"SELECT seq, id, user_id, field_id, created_at, file_key, prediction, severity, labels FROM diagnoses WHERE {where}"
+        if cursor:
+            sql += " AND (created_at, seq) < (?, ?)"
+            params.extend(_parse_cursor(cursor))
+        sql += " ORDER BY created_at DESC, seq DESC LIMIT ?"
+        params.append(limit + 1)
+        rows = self._conn().execute(sql, params).fetchall()
+
+        items = [
+            {
+                "diagnosis_id": row[1], "user_id": row[2], "field_id": row[3], "created_at": row[4], "file_key": row[5],
+                "prediction": row[6], "severity_level": row[7], "labels": json.loads(row[8]),
+            }
+            for row in rows[:limit]
+        ]
+        next_cursor = f"{rows[limit - 1][4]!r}:{rows[limit - 1][0]}" if len(rows) > limit else None
+        return items, next_cursor
+
+    def aggregate(
+        self, by: str, since: float, until: float, user_id: Optional[str] = None, field_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        {"total": diagnoses in [since, until), "counts": [(key, diagnoses), ...] most frequent first},
+        per detection label or per severity level, optionally for one user or field.
+        """
+        if by not in AGGREGATES:
+            raise ValueError(f"Cannot aggregate by {by!r}, expected one of {', '.join(AGGREGATES)}")
+        where, params = _owner_clause(user_id, field_id)
+        where = f"{where} AND created_at >= ? AND created_at < ?" if where else "created_at >= ? AND created_at < ?"
+        params.extend((since, until))
+        conn = self._conn()
+        (total,) = conn.execute(f"SELECT COUNT(*) FROM diagnoses WHERE {where}", params).fetchone()
+        if by == "label":
+            sql = f"SELECT label, COUNT(*) FROM diagnosis_labels WHERE {where} GROUP BY label"
+        else:
+            sql = f"SELECT severity, COUNT(*) FROM diagnoses WHERE {where} GROUP BY severity"
+        counts = sorted(conn.execute(sql, params).fetchall(), key=lambda kv: (-kv[1], kv[0] or ""))
+        return {"total": total, "counts": counts}
+
+
+def _owner_clause(user_id: Optional[str], field_id: Optional[str]) -> Tuple[str, List[Any]]:
+    clauses, params = [], []
+    for column, value in (("user_id", user_id), ("field_id", field_id)):
+        if value is not None:
+            clauses.append(f"{column} = ?")
+            params.append(value)
+    return " AND ".join(clauses), params
+
+
+def _parse_cursor(cursor: str) -> Tuple[float, int]:
+    created_at, _, seq = cursor.partition(":")
+    try:
+        return float(created_at), int(seq)
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+
+def build_history_store() -> Optional[SqliteHistoryStore]:
+    """
+    The store described by the HISTORY_* settings, or None when history is off.
+    """
+    if not config.HISTORY:
+        return None
+    return SqliteHistoryStore(config.HISTORY_DB_PATH)
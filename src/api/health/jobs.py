@@ -0,0 +1,426 @@
+# health.jobs.py
+import asyncio
+import json
+import logging as log
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from common import config
+from common.executor import run_io
+
+ACTIVE = ("queued", "running")
+FINISHED = ("done", "failed")
+# pipeline stages, in order (see HealthService)
+STAGES = ("downloaded", "analyzed", "annotated", "uploaded")
+LEASE_EXPIRED = "Job was abandoned by its worker too many times"
+
+
+class QueueFull(Exception):
+    pass
+
+
+class MemoryJobStore:
+    """
+    Jobs and queue in process memory. Only the uvicorn worker that accepted a job can report on it,
+    so use SqliteJobStore when running more than one worker.
+    """
+
+    blocking = False
+
+    def __init__(self, capacity: int = 100, ttl: int = 3600, lease: int = 60, max_attempts: int = 3):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._queue: deque = deque()
+
+    def submit(self, payload: Dict[str, Any]) -> str:
+        self._purge()
+        active = sum(1 for job in self._jobs.values() if job["status"] in ACTIVE)
+        if active >= self.capacity:
+            raise QueueFull(f"Job queue is full ({self.capacity})")
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        self._jobs[job_id] = {
+            "job_id": job_id, "status": "queued", "stage": None, "payload": payload,
+            "result": None, "error": None, "created_at": now, "updated_at": now,
+            "worker": None, "claimed_at": None, "attempts": 0,
+        }
+        self._queue.append(job_id)
+        return job_id
+
+    def claim(self, worker: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        self._reclaim()
+        while self._queue:
+            job = self._jobs.get(self._queue.popleft())
+            if job is not None and job["status"] == "queued":
+                now = time.time()
+                job.update(status="running", worker=worker, claimed_at=now, updated_at=now, attempts=job["attempts"] + 1)
+                return job["job_id"], job["payload"]
+        return None
+
+    def renew(self, job_ids: List[str], worker: str) -> List[str]:
+        now = time.time()
+        held = []
+        for job_id in job_ids:
+            job = self._jobs.get(job_id)
+            if job is not None and job["status"] == "running" and job["worker"] == worker:
+                job["claimed_at"] = now
+                held.append(job_id)
+        return held
+
+    def release(self, job_ids: List[str], worker: str) -> None:
+        for job_id in job_ids:
+            job = self._jobs.get(job_id)
+            if job is not None and job["status"] == "running" and job["worker"] == worker:
+                self._requeue(job)
+
+    def update(self, job_id: str, worker: str, **fields) -> bool:
+        job = self._jobs.get(job_id)
+        if job is None or job["status"] != "running" or job["worker"] != worker:
+            return False
+        job.update(fields)
+        job["updated_at"] = time.time()
+        return True
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+    def _requeue(self, job: Dict[str, Any]) -> None:
+        job.update(status="queued", stage=None, worker=None, claimed_at=None, updated_at=time.time())
+        self._queue.append(job["job_id"])
+
+    def _reclaim(self) -> None:
+        cutoff = time.time() - self.lease
+        for job in self._jobs.values():
+            if job["status"] == "running" and job["claimed_at"] < cutoff:
+                if job["attempts"] >= self.max_attempts:
+                    job.update(status="failed", error=LEASE_EXPIRED, worker=None, updated_at=time.time())
+                else:
+                    self._requeue(job)
+
+    def _purge(self) -> None:
+        self._reclaim()
+        cutoff = time.time() - self.ttl
+        expired = [k for k, job in self._jobs.items() if job["status"] in FINISHED and job["updated_at"] < cutoff]
+        for k in expired:
+            del self._jobs[k]
+
+
+class SqliteJobStore:
+    """
+    Jobs in a local SQLite database (WAL mode), so every uvicorn worker on the host shares one
+    queue: any worker can accept, run or report on any job.
+
+    A claimed job is leased to its worker, which renews the lease while the job runs. A job
+    whose lease has expired (worker crashed or killed) is put back in the queue by the next
+    claim or submit, or failed after `max_attempts` claims.
+    """
+
+    blocking = True
+
+    def __init__(self, path: str, capacity: int = 100, ttl: int = 3600, lease: int = 60, max_attempts: int = 3):
+        self.path = path
+        self.capacity = capacity
+        self.ttl = ttl
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, status TEXT NOT NULL, stage TEXT, payload TEXT NOT NULL,"
+            " result TEXT, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL,"
+            " worker TEXT, claimed_at REAL, attempts INTEGER NOT NULL DEFAULT 0)"
+        )
+        # databases created before leases
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for column, decl in (("worker", "TEXT"), ("claimed_at", "REAL"), ("attempts", "INTEGER NOT NULL DEFAULT 0")):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {decl}")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=10)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def submit(self, payload: Dict[str, Any]) -> str:
+        conn = self._conn()
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?", (*FINISHED, now - self.ttl))
+            self._reclaim(conn, now)
+            (active,) = conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", ACTIVE).fetchone()
+            if active >= self.capacity:
+                raise QueueFull(f"Job queue is full ({self.capacity})")
+            conn.execute(
+                "INSERT INTO jobs (id, status, payload, created_at, updated_at) VALUES (?, 'queued', ?, ?, ?)",
+                (job_id, json.dumps(payload), now, now),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return job_id
+
+    def _reclaim(self, conn: sqlite3.Connection, now: float) -> None:
+        # running jobs whose lease has expired: back in the queue, or failed once out of attempts
+        conn.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END,"
+            " error = CASE WHEN attempts >= ? THEN ? ELSE error END,"
+            " stage = NULL, worker = NULL, claimed_at = NULL, updated_at = ?"
+            " WHERE status = 'running' AND COALESCE(claimed_at, updated_at) < ?",
+            (self.max_attempts, self.max_attempts, LEASE_EXPIRED, now, now - self.lease),
+        )
+
+    def claim(self, worker: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._reclaim(conn, now)
+            row = conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, claimed_at = ?, attempts = attempts + 1, updated_at = ?"
+                " WHERE id = (SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1)"
+                " RETURNING id, payload",
+                (worker, now, now),
+            ).fetchone()
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def renew(self, job_ids: List[str], worker: str) -> List[str]:
+        """
+        Extend `worker`'s leases on `job_ids`; returns the ids it still holds.
+        """
+        rows = self._conn().execute(
+            f"UPDATE jobs SET claimed_at = ? WHERE status = 'running' AND worker = ? AND id IN ({', '.join('?' * len(job_ids))})"
+            " RETURNING id",
+            (time.time(), worker, *job_ids),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def release(self, job_ids: List[str], worker: str) -> None:
+        """
+        Put `worker`'s running jobs back in the queue (shutdown).
+        """
+        self._conn().execute(
+            "UPDATE jobs SET status = 'queued', stage = NULL, worker = NULL, claimed_at = NULL, updated_at = ?"
+            f" WHERE status = 'running' AND worker = ? AND id IN ({', '.join('?' * len(job_ids))})",
+            (time.time(), worker, *job_ids),
+        )
+
+    def update(self, job_id: str, worker: str, **fields) -> bool:
+        """
+        Update a job `worker` is running; False if its lease was lost (reclaimed by another worker).
+        """
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"], ensure_ascii=False)
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        cursor = self._conn().execute(
+            f"UPDATE jobs SET {columns} WHERE id = ? AND worker = ? AND status = 'running'",
+            (*fields.values(), job_id, worker),
+        )
+        return cursor.rowcount > 0
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            "SELECT id, status, stage, payload, result, error, created_at, updated_at FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row[0], "status": row[1], "stage": row[2], "payload": json.loads(row[3]),
+            "result": json.loads(row[4]) if row[4] else None, "error": row[5],
+            "created_at": row[6], "updated_at": row[7],
+        }
+
+
+class JobRunner:
+    """
+    Pool of asyncio workers that claim jobs from the store and run them through HealthService,
+    recording each pipeline stage as it completes. The leases of the jobs being run are renewed
+    every `lease / 3` seconds; stop() puts them back in the queue. A job whose lease was lost
+    (found by a renewal or a rejected update) is dropped: its new owner runs it.
+    """
+
+    def __init__(self, store, service, workers: int = 4, poll_interval: float = 0.5, lease: float = config.JOB_LEASE_SECONDS):
+        self.store = store
+        self.service = service
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._tasks = []
+        # job id -> set when the lease on it is lost
+        self._running: Dict[str, asyncio.Event] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+
+    async def _call(self, method: str, *args, **kwargs):
+        fn = getattr(self.store, method)
+        if self.store.blocking:
+            return await run_io(fn, *args, **kwargs)
+        return fn(*args, **kwargs)
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+
+    async def stop(self) -> None:
+        """
+        Cancel the workers and put the jobs they were running back in the queue.
+        """
+        in_flight = list(self._running)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if in_flight:
+            try:
+                await self._call("release", in_flight, self.worker_id)
+            except Exception as exc:
+                # the leases expire and the jobs are re-queued by the next claim
+                log.error("failed to release %d running jobs: %s", len(in_flight), exc)
+
+    async def submit(self, payload: Dict[str, Any]) -> str:
+        self.start()
+        job_id = await self._call("submit", payload)
+        self._wakeup.set()
+        return job_id
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self._call("get", job_id)
+
+    async def watch(self, job_id: str, interval: float = 0.25) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Yield the job every time its status or stage changes, until it finishes. The store only
+        keeps the latest stage, so stages passed between two polls are replayed in order.
+        """
+        last_status, last_stage = None, -1
+        while True:
+            job = await self.get(job_id)
+            if job is None:
+                return
+            stage = STAGES.index(job["stage"]) if job["stage"] in STAGES else -1
+            for skipped in range(last_stage + 1, stage):
+                yield dict(job, status="running", stage=STAGES[skipped], result=None, error=None)
+            if (job["status"], stage) != (last_status, last_stage):
+                last_status, last_stage = job["status"], stage
+                yield job
+            if job["status"] in FINISHED:
+                return
+            await asyncio.sleep(interval)
+
+    async def _work(self) -> None:
+        while True:
+            # cleared before claiming so a submit racing with an empty claim is not missed
+            self._wakeup.clear()
+            claimed = await self._call("claim", self.worker_id)
+            if claimed is None:
+                # other workers' submissions (shared store) are picked up by polling
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            job_id, payload = claimed
+            lost = self._running[job_id] = asyncio.Event()
+            try:
+                await self._run(job_id, payload, lost)
+            finally:
+                self._running.pop(job_id, None)
+
+    async def _run(self, job_id: str, payload: Dict[str, Any], lost: asyncio.Event) -> None:
+        async def progress(stage: str) -> None:
+            # runs inside the shared pipeline: never raise into it
+            try:
+                if not await self._call("update", job_id, self.worker_id, stage=stage):
+                    lost.set()
+            except Exception as exc:
+                log.warning("job %s: failed to record stage %s: %s", job_id, stage, exc)
+
+        detect = asyncio.create_task(self.service.detect_item(payload, progress))
+        lease_lost = asyncio.create_task(lost.wait())
+        try:
+            await asyncio.wait((detect, lease_lost), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            detect.cancel()
+            lease_lost.cancel()
+        if lost.is_set():
+            if detect.done() and not detect.cancelled():
+                detect.exception()
+            log.warning("job %s: lease lost, left to its new worker", job_id)
+            return
+
+        try:
+            presigned, analysis_vn, diagnosis_id = detect.result()
+            update = {"status": "done", "result": {"presigned_url": presigned, "analysis_vn": analysis_vn, "diagnosis_id": diagnosis_id}}
+        except Exception as exc:
+            update = {"status": "failed", "error": str(exc) or type(exc).__name__}
+        try:
+            if not await self._call("update", job_id, self.worker_id, **update):
+                log.warning("job %s: lease lost, result dropped", job_id)
+        except Exception as exc:
+            # keep the worker alive; the lease is no longer renewed, so the job is re-queued
+            log.error("job %s: failed to record result: %s", job_id, exc)
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            if not self._running:
+                continue
+            running = dict(self._running)
+            try:
+                held = set(await self._call("renew", list(running), self.worker_id))
+            except Exception as exc:
+                log.warning("failed to renew job leases: %s", exc)
+                continue
+            for job_id, lost in running.items():
+                if job_id not in held:
+                    lost.set()
+
+
+def build_job_store():
+    """
+    Build the store described by the JOB_* settings.
+    """
+    backend = config.JOB_BACKEND.lower()
+    if backend == "memory":
+        return MemoryJobStore(
+            capacity=config.JOB_QUEUE_CAPACITY, ttl=config.JOB_RESULT_TTL,
+            lease=config.JOB_LEASE_SECONDS, max_attempts=config.JOB_MAX_ATTEMPTS,
+        )
+    if backend == "sqlite":
+        return SqliteJobStore(
+            config.JOB_DB_PATH, capacity=config.JOB_QUEUE_CAPACITY, ttl=config.JOB_RESULT_TTL,
+            lease=config.JOB_LEASE_SECONDS, max_attempts=config.JOB_MAX_ATTEMPTS,
+        )
+    raise ValueError(f"Unknown JOB_BACKEND: {config.JOB_BACKEND}")
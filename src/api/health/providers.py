@@ -0,0 +1,78 @@
+"""
+Per-process singletons of the health API. Nothing is built when the router is imported: the app
+lifespan (main.py) calls start() in every uvicorn worker, and HealthService builds its storage
+and model clients on first use, or ahead of traffic through warm() (/ready, WARM_ON_START).
+The job runner starts with the process, so every worker claims jobs from a shared queue
+(JOB_BACKEND=sqlite) whether or not it accepted any.
+"""
+import asyncio
+import logging as log
+from typing import Dict, Optional
+
+from common import config
+from .history import build_history_store
+from .jobs import JobRunner, build_job_store
+from .service import HealthService
+
+_service: Optional[HealthService] = None
+_jobs: Optional[JobRunner] = None
+_warmup: Optional[asyncio.Task] = None
+
+
+def start(service: Optional[HealthService] = None) -> None:
+    """
+    Create this process's service and start its job runner (benchmarks pass their own service).
+    Called from the running event loop.
+    """
+    global _service, _jobs, _warmup
+    _service = service if service is not None else HealthService(history=build_history_store())
+    _jobs = JobRunner(build_job_store(), _service, workers=config.JOB_WORKERS)
+    _jobs.start()
+    _warmup = None
+
+
+def health_service() -> HealthService:
+    if _service is None:
+        start()
+    return _service
+
+
+def job_runner() -> JobRunner:
+    if _jobs is None:
+        start()
+    return _jobs
+
+
+async def warm() -> Dict[str, float]:
+    """
+    HealthService.warm(), once per process: concurrent callers share one run, and a failed
+    run is retried by the next caller.
+    """
+    global _warmup
+    if _warmup is None:
+        _warmup = asyncio.create_task(health_service().warm())
+    task = _warmup
+    try:
+        return await asyncio.shield(task)
+    except Exception:
+        if _warmup is task:
+            _warmup = None
+        raise
+
+
+async def warm_in_background() -> None:
+    try:
+        log.info("warm-up done (ms): %s", await warm())
+    except Exception as e:
+        log.warning("warm-up failed, /ready will retry: %s", e)
+
+
+async def stop() -> None:
+    global _service, _jobs, _warmup
+    if _warmup is not None and not _warmup.done():
+        _warmup.cancel()
+    if _jobs is not None:
+        await _jobs.stop()
+    if _service is not None:
+        await _service.aclose()
+    _service, _jobs, _warmup = None, None, None
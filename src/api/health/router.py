@@ -1,38 +1,288 @@
 # health.router.py
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, status
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
+import json
+import logging as log
+import time
 from typing import Optional
 
-from .schema import DetectRequest, DetectResponse, Detection
-from .service import HealthService
-import os
+import httpx
 
-import shutil
-import uuid
+from .schema import (
+    DetectRequest, DetectResponse, Detection, DetectBatchRequest, DetectBatchItemResult,
+    JobSubmitResponse, JobStatusResponse, DiagnosisPage, DiagnosisSummary, DiagnosisRecord, DiagnosisCount, DiagnosisStats,
+)
+from .providers import health_service, job_runner, warm
+from .service import HealthService, owner_of
+from .uploads import upload_store, iter_multipart_file, UploadTooLarge, NotAnImage
+from .jobs import QueueFull
+from common import config
+from common.ai_model.pool import ModelUnavailable
+from common.response import IMMUTABLE, file_response
+from provider.local_storage import LocalStorage
+import os
 
 router = APIRouter(prefix="/api/health", tags=["health"])
 
-# create a singleton HealthService instance (or use DI in your app startup)
-health_service = HealthService()
+# request bodies are parsed by hand (see _receive_upload); describe them for the OpenAPI docs
+UPLOAD_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                    "required": ["file"],
+                }
+            }
+        },
+    }
+}
+
 
-PUBLIC_DIR = os.path.join(os.path.dirname(__file__), "file")
+async def _receive_upload(request: Request) -> str:
+    """
+    Stream the multipart `file` field into the upload store and return its upload id.
+    Oversized bodies are rejected from Content-Length before anything is read.
+    """
+    declared = request.headers.get("content-length")
+    # allow some room for the multipart envelope around the file
+    if declared and declared.isdigit() and int(declared) > config.UPLOAD_MAX_BYTES + 64 * 1024:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"File exceeds {config.UPLOAD_MAX_BYTES} bytes")
+    try:
+        upload_id, _ = await upload_store.save_stream(iter_multipart_file(request), config.UPLOAD_MAX_BYTES)
+        return upload_id
+    except UploadTooLarge as exc:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(exc))
+    except NotAnImage as exc:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=str(exc))
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+
+def _fetch_error(exc: Exception) -> HTTPException:
+    """
+    The response for an image_url that could not be used: refused body (413 / 415), the image
+    host failing (502) or being too slow (504).
+    """
+    if isinstance(exc, UploadTooLarge):
+        return HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(exc))
+    if isinstance(exc, NotAnImage):
+        return HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=str(exc))
+    if isinstance(exc, (TimeoutError, httpx.TimeoutException)):
+        return HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=f"Image download timed out: {exc}")
+    return HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Image download failed: {exc}")
 
 @router.post("/detect", response_model=DetectResponse)
 async def detect_endpoint(payload: DetectRequest = None):
-    if payload is None or not payload.image_url:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="image_url is required")
+    if payload is None or not (payload.image_url or payload.upload_id):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="image_url or upload_id is required")
 
     try:
-        print("Received detection request for URL:", payload.image_url)
-        presigned, analysis_vn = health_service.detect_from_url(payload.image_url)
+        if payload.upload_id:
+            log.info("detect request for upload %s", payload.upload_id)
+            presigned, analysis_vn, diagnosis_id = await health_service().detect_from_upload(payload.upload_id, owner=owner_of(payload.model_dump()))
+        else:
+            log.info("detect request for url %s", payload.image_url)
+            presigned, analysis_vn, diagnosis_id = await health_service().detect_from_url(payload.image_url, owner=owner_of(payload.model_dump()))
 
-        return DetectResponse(presigned_url=presigned, analysis_vn=analysis_vn)
+        return DetectResponse(presigned_url=presigned, analysis_vn=analysis_vn, diagnosis_id=diagnosis_id)
     except HTTPException:
         raise
+    except ModelUnavailable as exc:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(exc))
+    except (UploadTooLarge, NotAnImage, httpx.HTTPError, TimeoutError) as exc:
+        raise _fetch_error(exc)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except FileNotFoundError as exc:
+        raise HTTPException(status_code=404, detail=str(exc))
     except Exception as exc:
         # log exception server-side in production
         raise HTTPException(status_code=500, detail=f"Detection failed: {exc}")
 
+@router.post("/detect/upload", response_model=DetectResponse, openapi_extra=UPLOAD_BODY)
+async def upload_and_detect_endpoint(request: Request):
+    """
+    Upload and detect in one request: the file is streamed into the upload store and its bytes
+    are fed to the pipeline from there, with no download hop. `user_id` / `field_id` for the
+    history go in the query string.
+    """
+    upload_id = await _receive_upload(request)
+    try:
+        owner = owner_of(request.query_params)
+        presigned, analysis_vn, diagnosis_id = await health_service().detect_from_upload(upload_id, owner=owner)
+        return DetectResponse(presigned_url=presigned, analysis_vn=analysis_vn, diagnosis_id=diagnosis_id)
+    except HTTPException:
+        raise
+    except ModelUnavailable as exc:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(exc))
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=f"Detection failed: {exc}")
+
+@router.post("/detect/stream", response_class=StreamingResponse)
+async def detect_stream_endpoint(payload: DetectRequest):
+    """
+    Server-sent events: `detections`, one `analysis` per analysis_vn field, `annotated`, then `done`
+    (or `error`), each sent as soon as it is available instead of after the last model token.
+    """
+    if not (payload.image_url or payload.upload_id):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="image_url or upload_id is required")
+    try:
+        image_bytes = await health_service().load_item(payload.model_dump())
+    except (UploadTooLarge, NotAnImage, httpx.HTTPError, TimeoutError) as exc:
+        raise _fetch_error(exc)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except FileNotFoundError as exc:
+        raise HTTPException(status_code=404, detail=str(exc))
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=f"Detection failed: {exc}")
+
+    async def events():
+        try:
+            async for event, data in health_service().detect_stream(image_bytes, owner_of(payload.model_dump())):
+                yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        except Exception as exc:
+            yield f"event: error\ndata: {json.dumps({'detail': f'Detection failed: {exc}'}, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@router.post("/detect/batch", response_class=StreamingResponse)
+async def detect_batch_endpoint(payload: DetectBatchRequest):
+    """
+    Stream one DetectBatchItemResult per line (NDJSON) in completion order.
+    """
+    if len(payload.items) > config.BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {config.BATCH_MAX_ITEMS} items per batch",
+        )
+    concurrency = min(payload.concurrency or config.BATCH_CONCURRENCY, config.BATCH_CONCURRENCY)
+    items = [item.model_dump() for item in payload.items]
+
+    async def lines():
+        async for index, result, error in health_service().detect_many(items, concurrency):
+            if result is not None:
+                presigned, analysis_vn, diagnosis_id = result
+                line = DetectBatchItemResult(index=index, result=DetectResponse(presigned_url=presigned, analysis_vn=analysis_vn, diagnosis_id=diagnosis_id))
+            else:
+                line = DetectBatchItemResult(index=index, error=error)
+            yield line.model_dump_json() + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+def _job_response(job) -> JobStatusResponse:
+    return JobStatusResponse(
+        job_id=job["job_id"],
+        status=job["status"],
+        stage=job["stage"],
+        result=DetectResponse(**job["result"]) if job["result"] else None,
+        error=job["error"],
+        created_at=job["created_at"],
+        updated_at=job["updated_at"],
+    )
+
+@router.post("/jobs", response_model=JobSubmitResponse, status_code=status.HTTP_202_ACCEPTED)
+async def submit_job(payload: DetectRequest):
+    """
+    Queue a detection and return immediately; poll /jobs/{id} or follow /jobs/{id}/events.
+    """
+    if not (payload.image_url or payload.upload_id):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="image_url or upload_id is required")
+    try:
+        job_id = await job_runner().submit(payload.model_dump())
+    except QueueFull as exc:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(exc), headers={"Retry-After": "5"})
+    return JobSubmitResponse(job_id=job_id, status="queued")
+
+@router.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job(job_id: str):
+    job = await job_runner().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_response(job)
+
+@router.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """
+    Server-sent events: one `stage` event per pipeline stage, then `done` or `failed` with the job.
+    """
+    if await job_runner().get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        async for job in job_runner().watch(job_id):
+            event = job["status"] if job["status"] in ("done", "failed") else "stage"
+            yield f"event: {event}\ndata: {_job_response(job).model_dump_json()}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+def _history_service() -> HealthService:
+    service = health_service()
+    if service.history is None:
+        raise HTTPException(status_code=404, detail="Diagnosis history is disabled")
+    return service
+
+@router.get("/history", response_model=DiagnosisPage)
+async def list_history(
+    user_id: Optional[str] = None,
+    field_id: Optional[str] = None,
+    limit: int = Query(config.HISTORY_PAGE_SIZE, ge=1, le=config.HISTORY_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+):
+    """
+    A user's and/or a field's diagnoses, newest first; follow `next_cursor` for older ones.
+    """
+    if user_id is None and field_id is None:
+        raise HTTPException(status_code=400, detail="user_id or field_id is required")
+    service = _history_service()
+    try:
+        items, next_cursor = await service.list_diagnoses(user_id, field_id, limit, cursor)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return DiagnosisPage(items=[DiagnosisSummary(**item) for item in items], next_cursor=next_cursor)
+
+@router.get("/history/stats", response_model=DiagnosisStats)
+async def history_stats(
+    by: str = Query("label", pattern="^(label|severity)$"),
+    since: Optional[float] = Query(None, description="Unix time; default 30 days before `until`"),
+    until: Optional[float] = Query(None, description="Unix time, exclusive; default now"),
+    user_id: Optional[str] = None,
+    field_id: Optional[str] = None,
+):
+    """
+    Diagnoses per detection label or per severity level over [since, until), optionally for one user or field.
+    """
+    until = until if until is not None else time.time()
+    since = since if since is not None else until - 30 * 24 * 3600
+    stats = await _history_service().diagnosis_stats(by, since, until, user_id, field_id)
+    counts = [DiagnosisCount(key=key, count=count) for key, count in stats["counts"]]
+    return DiagnosisStats(by=by, since=since, until=until, total=stats["total"], counts=counts)
+
+@router.get("/history/{diagnosis_id}", response_model=DiagnosisRecord)
+async def get_history(diagnosis_id: str):
+    """
+    A stored diagnosis, without running the pipeline again; the presigned URL is issued fresh.
+    """
+    record = await _history_service().get_diagnosis(diagnosis_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Diagnosis not found")
+    return DiagnosisRecord(**record)
+
+@router.get("/ready", include_in_schema=False)
+async def ready_endpoint():
+    """
+    Readiness probe: 200 once this worker's clients are built and its pools warm, 503 until then.
+    The first call does the warm-up (unless WARM_ON_START already did), later calls return at once.
+    """
+    try:
+        warmup_ms = await warm()
+    except Exception as e:
+        log.warning("not ready: %s", e)
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"ready": False, "error": str(e)})
+    return {"ready": True, "warmup_ms": warmup_ms}
+
 @router.get("/", include_in_schema=False)
 async def health_index():
     # adjust path to your project structure
@@ -41,26 +291,36 @@ async def health_index():
         raise HTTPException(status_code=404, detail="index.html not found")
     return FileResponse(file_path, media_type="text/html")
 
-@router.post("/upload")
-async def upload_image(file: UploadFile = File(...)):
+@router.post("/upload", openapi_extra=UPLOAD_BODY)
+async def upload_image(request: Request):
     try:
-        ext = os.path.splitext(file.filename)[1] or ".png"
-        filename = f"{uuid.uuid4().hex}{ext}"
-        dest_path = os.path.join(PUBLIC_DIR, filename)
-
-        with open(dest_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        filename = await _receive_upload(request)
 
         # Construct a URL (assuming you mount StaticFiles at /public)
-        url = f"/api/health/public/{filename}"
-        return {"image_url": url}
+        url = upload_store.public_url(filename)
+        return {"image_url": url, "upload_id": filename}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Upload failed: {e}")
     
 
-@router.get("/public/{filename}", include_in_schema=False)
-async def serve_image(filename: str):
-    file_path = os.path.join(PUBLIC_DIR, filename)
-    if not os.path.exists(file_path):
+@router.get("/public/{filename:path}", include_in_schema=False)
+async def serve_image(filename: str, request: Request):
+    """
+    Uploads (`{upload_id}`) and, with STORAGE_BACKEND=local, annotated images (`{size}/{file_key}`).
+    """
+    try:
+        if "/" not in filename:
+            return file_response(request, upload_store.path_for(filename), upload_store.content_type(filename))
+
+        storage = health_service().storage
+        if not isinstance(storage, LocalStorage):
+            raise HTTPException(status_code=404, detail="File not found")
+        path = storage.path_for(filename)
+        if not storage.verify(filename, request.query_params.get("expires"), request.query_params.get("signature")):
+            raise HTTPException(status_code=403, detail="Invalid or expired signature")
+        cache_control = "private, max-age=3600" if storage.secret else None
+        return file_response(request, path, storage.content_type(filename), cache_control or IMMUTABLE)
+    except ValueError:
         raise HTTPException(status_code=404, detail="File not found")
-    return FileResponse(file_path, media_type="image/png")
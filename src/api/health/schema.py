@@ -1,15 +1,233 @@
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, Field, ValidationError
+from typing import Any, Dict, List, Optional, Tuple
 
 class Detection(BaseModel):
-    label: str
-    confidence: Optional[float] = None
-    box_2d: List[float] = Field(..., description="[ymin, xmin, ymax, xmax] normalized 0..1000")
+    label: str = Field(..., description="Tên bệnh/sâu/hại, ví dụ: whiteflies, rice_leaf_blast")
+    confidence: Optional[float] = Field(None, description="Độ tin cậy 0..1")
+    box_2d: List[float] = Field(..., min_length=4, max_length=4, description="[ymin, xmin, ymax, xmax] normalized 0..1000")
+
+
+# analysis_vn: what the model must return, also sent to Gemini as the response schema
+class PossibleCause(BaseModel):
+    cause: str = Field("", description="Mô tả nguyên nhân")
+    confidence: float = Field(0.0, description="Độ tin cậy 0..1")
+    evidence: str = Field("", description="Bằng chứng/quan sát ngắn, ví dụ: vết vàng theo gân")
+
+
+class RecommendedAction(BaseModel):
+    name: str = Field("", description="Mô tả ngắn gọn khoảng 10 từ, ví dụ: Phun thuốc sinh học Azadirachtin 3ml/l")
+    timing: str = Field("", description="Khi nào thực hiện, ví dụ: Ngay lập tức, Trong 3-5 ngày")
+    description: Optional[str] = Field(None, description="Chi tiết: lưu ý an toàn, độ pha, điều kiện")
+    targetValue: int = Field(1, description="Số lần thực hiện trong một tuần")
+    numOfWeeks: int = Field(1, description="Số tuần cần thực hiện")
+
+
+class AnalysisVN(BaseModel):
+    prediction: str = Field("", description="Dự đoán ngắn gọn, ví dụ: Cây bị rệp trắng")
+    severity_level: str = Field("", description="Một trong: Thấp, Trung bình, Cao, Rất cao")
+    possible_causes: List[PossibleCause] = Field(default_factory=list)
+    recommended_actions: List[RecommendedAction] = Field(default_factory=list, description="Các bước hành động theo thứ tự")
+    chemical_recommendations: List[str] = Field(default_factory=list, description="Hoạt chất hoặc thương hiệu thuốc hóa học")
+    biological_recommendations: List[str] = Field(default_factory=list, description="Biện pháp sinh học/thuốc hữu cơ")
+    monitoring_plan: str = Field("", description="Kế hoạch theo dõi")
+    preventive_measures: List[str] = Field(default_factory=list, description="Biện pháp phòng ngừa ngắn gọn")
+    additional_notes: str = ""
+
+
+class Diagnosis(BaseModel):
+    detections: List[Detection] = Field(default_factory=list)
+    analysis_vn: AnalysisVN = Field(default_factory=AnalysisVN)
+
+
+def _validate_lenient(model, value: Any) -> Optional[BaseModel]:
+    """
+    Validate `value`, dropping the fields that fail (they fall back to their defaults).
+    None if it cannot be salvaged (not an object, or a required field is unusable).
+    """
+    if not isinstance(value, dict):
+        return None
+    data = dict(value)
+    for _ in range(len(data) + 1):
+        try:
+            return model.model_validate(data)
+        except ValidationError as exc:
+            bad = {err["loc"][0] for err in exc.errors() if err["loc"] and err["loc"][0] in data}
+            if not bad:
+                return None
+            for key in bad:
+                del data[key]
+    return None
+
+
+def validate_diagnosis(detections: Any, analysis: Any) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Normalize raw model output: malformed detections are dropped (confidences given in
+    percent are scaled to 0..1), analysis_vn fields of the wrong type fall back to defaults.
+    """
+    valid: List[Dict[str, Any]] = []
+    for raw in detections if isinstance(detections, list) else []:
+        detection = _validate_lenient(Detection, raw)
+        if detection is None or len(detection.box_2d) != 4:
+            continue
+        if detection.confidence is not None and detection.confidence > 1:
+            detection.confidence /= 100.0
+        valid.append(detection.model_dump())
+    if isinstance(analysis, dict):
+        # salvage list items one by one rather than dropping a whole list for one bad entry
+        analysis = dict(analysis)
+        for key, item_model in (("possible_causes", PossibleCause), ("recommended_actions", RecommendedAction)):
+            if isinstance(analysis.get(key), list):
+                items = (_validate_lenient(item_model, item) for item in analysis[key])
+                analysis[key] = [item for item in items if item is not None]
+    analysis_vn = _validate_lenient(AnalysisVN, analysis) or AnalysisVN()
+    return valid, analysis_vn.model_dump()
+
+
+def validate_analysis_field(name: str, value: Any) -> Optional[Any]:
+    """
+    One analysis_vn field as validate_diagnosis returns it (its default if invalid), for fields
+    streamed one at a time; None for a field AnalysisVN does not have.
+    """
+    if name not in AnalysisVN.model_fields:
+        return None
+    return validate_diagnosis(None, {name: value})[1][name]
+
+
+# pre-screen reason code -> (what is wrong, what to do about it)
+PRESCREEN_MESSAGES = {
+    "too_small": ("Ảnh có độ phân giải quá thấp", "Chụp lại gần hơn hoặc ở độ phân giải cao hơn"),
+    "blurry": ("Ảnh bị mờ, không rõ chi tiết", "Giữ máy cố định, lấy nét vào vùng lá bệnh rồi chụp lại"),
+    "too_dark": ("Ảnh quá tối", "Chụp lại ở nơi đủ ánh sáng, tránh bóng râm dày"),
+    "too_bright": ("Ảnh bị cháy sáng", "Tránh chụp ngược sáng hoặc dưới nắng gắt trực tiếp"),
+    "no_plant": ("Không thấy lá hoặc cây trồng trong ảnh", "Chụp cận cảnh lá, thân hoặc quả có dấu hiệu bệnh"),
+}
+
+
+def rejected_analysis(verdict: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    analysis_vn for an image the pre-screen turned away (see common/ai_model/prescreen.py):
+    the usual fields, with one retake instruction per reason, plus `image_quality` holding the
+    machine-readable reasons and measurements.
+    """
+    reasons, actions = [], []
+    for reason in verdict["reasons"]:
+        problem, fix = PRESCREEN_MESSAGES.get(reason["code"], ("Ảnh không đạt yêu cầu", "Chụp lại ảnh"))
+        reasons.append({**reason, "message": problem})
+        actions.append(RecommendedAction(name=fix, timing="Ngay lập tức", description=problem))
+    analysis = AnalysisVN(
+        prediction="Ảnh không đạt yêu cầu để chẩn đoán",
+        recommended_actions=actions,
+        additional_notes="; ".join(r["message"] for r in reasons),
+    ).model_dump()
+    analysis["image_quality"] = {"passed": False, "reasons": reasons, "stats": verdict["stats"]}
+    return analysis
 
 
 class DetectRequest(BaseModel):
-    image_url: str = Field(..., description="URL of the image to analyze")
+    image_url: Optional[str] = Field(None, description="URL of the image to analyze")
+    upload_id: Optional[str] = Field(None, description="Id returned by /api/health/upload (read locally, no download)")
+    user_id: Optional[str] = Field(None, max_length=128, description="Owner of the diagnosis, for /history")
+    field_id: Optional[str] = Field(None, max_length=128, description="Field the photo was taken in, for /history")
     
 class DetectResponse(BaseModel):
     presigned_url: Optional[str] = Field(None, description="Presigned URL to the annotated image")
     analysis_vn: Optional[dict] = Field(None, description="Analysis results from the model")
+    diagnosis_id: Optional[str] = Field(None, description="Id to reopen this diagnosis at /history/{id} (null when history is off)")
+
+
+class BatchItem(BaseModel):
+    image_url: Optional[str] = Field(None, description="URL of the image to analyze")
+    upload_id: Optional[str] = Field(None, description="Id returned by /api/health/upload")
+    user_id: Optional[str] = Field(None, max_length=128)
+    field_id: Optional[str] = Field(None, max_length=128)
+
+
+class DetectBatchRequest(BaseModel):
+    items: List[BatchItem] = Field(..., min_length=1, description="Images to analyze, each by URL or upload id")
+    concurrency: Optional[int] = Field(None, ge=1, description="Max detections in flight for this batch")
+
+
+class DetectBatchItemResult(BaseModel):
+    index: int = Field(..., description="Position of the item in the request")
+    result: Optional[DetectResponse] = None
+    error: Optional[str] = None
+
+
+class JobSubmitResponse(BaseModel):
+    job_id: str
+    status: str = Field(..., description="queued | running | done | failed")
+
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    status: str = Field(..., description="queued | running | done | failed")
+    stage: Optional[str] = Field(None, description="Last pipeline stage: downloaded, analyzed, annotated, uploaded")
+    result: Optional[DetectResponse] = None
+    error: Optional[str] = None
+    created_at: float
+    updated_at: float
+
+
+class DiagnosisSummary(BaseModel):
+    diagnosis_id: str
+    created_at: float
+    user_id: Optional[str] = None
+    field_id: Optional[str] = None
+    prediction: Optional[str] = None
+    severity_level: Optional[str] = None
+    labels: List[str] = Field(default_factory=list, description="Distinct detection labels")
+    thumbnail_url: Optional[str] = Field(None, description="Presigned URL to the small annotated image, issued on read")
+
+
+class DiagnosisPage(BaseModel):
+    items: List[DiagnosisSummary]
+    next_cursor: Optional[str] = Field(None, description="Pass as `cursor` for the next page; null on the last page")
+
+
+class DiagnosisRecord(BaseModel):
+    diagnosis_id: str
+    created_at: float
+    user_id: Optional[str] = None
+    field_id: Optional[str] = None
+    image_hash: str = Field(..., description="sha256 of the analyzed image")
+    model: str
+    presigned_url: Optional[str] = Field(None, description="Presigned URL to the annotated image, issued on read")
+    detections: List[dict] = Field(default_factory=list)
+    analysis_vn: dict
+    timings: Optional[dict] = Field(None, description="Pipeline stage durations in ms when the diagnosis was served")
+
+
+class DiagnosisCount(BaseModel):
+    key: Optional[str] = Field(None, description="Label or severity level (null: no severity given)")
+    count: int = Field(..., description="Diagnoses with this label / severity")
+
+
+class DiagnosisStats(BaseModel):
+    by: str = Field(..., description="label | severity")
+    since: float
+    until: float
+    total: int = Field(..., description="Diagnoses in [since, until)")
+    counts: List[DiagnosisCount]
+
+
+def _strict_schema(node: Any) -> Any:
+    """
+    JSON schema for the model: every non-nullable property required (so the model always
+    writes it), without titles, defaults and descriptions. The schema is sent with every call
+    and is never cached, so the guidance the descriptions carry lives in SCHEMA_PROMPT instead.
+    """
+    if isinstance(node, list):
+        return [_strict_schema(item) for item in node]
+    if not isinstance(node, dict):
+        return node
+    out = {k: _strict_schema(v) for k, v in node.items() if k not in ("title", "default", "description", "properties")}
+    props = node.get("properties")
+    if isinstance(props, dict):
+        # field names are kept as they are, RecommendedAction has one called "description"
+        out["properties"] = {name: _strict_schema(prop) for name, prop in props.items()}
+        out["required"] = [name for name, prop in props.items() if "anyOf" not in prop]
+    return out
+
+
+def model_response_schema() -> Dict[str, Any]:
+    return _strict_schema(Diagnosis.model_json_schema())
@@ -1,24 +1,33 @@
 # health.service.py
+import asyncio
+from io import BytesIO
+import logging as log
 import os
+import threading
+import time
 
-from typing import List, Tuple, Optional, Dict, Any
+from typing import List, Tuple, Optional, Dict, Any, AsyncIterator, Awaitable, Callable
 
-import requests
+import httpx
+from PIL import Image
 
-from provider.minIO import minio_service  # adjust import according to your project
+from provider.storage import StorageInterface, build_storage
 
-from .schema import Detection  # relative import
-from common.utils import parse_detections , annotate_image 
+from .schema import model_response_schema, rejected_analysis, validate_analysis_field, validate_diagnosis  # relative import
+from .uploads import upload_store
+from .fetcher import ImageFetcher
+from common import config
+from common.utils import parse_detections , render_annotations
+from common.json_stream import IncrementalJsonParser
+from common.cache import build_diagnosis_cache, make_cache_key
+from common.executor import run_cpu, run_io
+from common.metrics import timed, count_bytes, stage_timings, PRESCREEN_EVENTS, STAGE_SECONDS
 
-from common.ai_model.implements.gemini import geminiModel
+from common.ai_model.preprocess import encode_model_image, load_model_image
 
 
-API_KEY = os.getenv("GEMINI_API_KEY") or os.getenv("GENAI_API_KEY")
-if not API_KEY:
-    raise RuntimeError("Please set GEMINI_API_KEY or GENAI_API_KEY in your environment")
-
-
-PROMPT = (
+# prose description of the JSON shape, used when the response schema is disabled
+LEGACY_PROMPT = (
     "Bạn là chuyên gia nông học và sâu bệnh cây trồng. "
     "Dựa vào ảnh được gửi kèm, hãy phân tích và trả về DUY NHẤT một đối tượng JSON (KHÔNG kèm bất kỳ văn bản giải thích nào ngoài JSON). "
     "Các đề xuất hành động phải phù hợp ở Việt Nam, sử dụng tên thân thuộc, ưu tiên thuốc sinh học và biện pháp hữu cơ."
@@ -73,59 +82,594 @@ PROMPT = (
     "KHÔNG được thêm text, chú thích hay giải thích ngoài JSON này. TẤT CẢ phần phân tích phải bằng tiếng Việt."
 )
 
+# with a declared response schema the shape (and field meanings) come from api/health/schema.py
+SCHEMA_PROMPT = (
+    "Bạn là chuyên gia nông học và sâu bệnh cây trồng. "
+    "Phân tích ảnh được gửi kèm và trả lời đúng theo JSON schema đã khai báo; TẤT CẢ phần phân tích bằng tiếng Việt. "
+    "Các đề xuất hành động phải phù hợp ở Việt Nam, sử dụng tên thân thuộc, ưu tiên thuốc sinh học và biện pháp hữu cơ.\n"
+    "- detections: mỗi vùng có dấu hiệu bệnh/sâu/hại; box_2d là [ymin, xmin, ymax, xmax] chuẩn hóa 0..1000; confidence 0..1.\n"
+    "- severity_level là một trong: Thấp, Trung bình, Cao, Rất cao. possible_causes: nguyên nhân, độ tin cậy 0..1, bằng chứng quan sát được.\n"
+    "- recommended_actions theo thứ tự thực hiện: name khoảng 10 từ (ví dụ: Phun thuốc sinh học Azadirachtin 3ml/l), "
+    "timing (ví dụ: Ngay lập tức), description gồm độ pha và lưu ý an toàn, targetValue là số lần mỗi tuần, numOfWeeks là số tuần.\n"
+    "- Nếu không phát hiện dấu hiệu nào: detections rỗng, prediction là \"Không phát hiện bệnh rõ rệt\", các danh sách rỗng.\n"
+    "- Viết ngắn gọn: mỗi chuỗi 1-2 câu, tối đa 3 nguyên nhân và 5 hành động."
+)
+
+PROMPT = SCHEMA_PROMPT if config.MODEL_RESPONSE_SCHEMA else LEGACY_PROMPT
+
+
+def build_model(model_name: str = "gemini-2.5-flash"):
+    """
+    The Gemini model pool. google.genai is imported here, on first use, not with this module.
+    """
+    if not (os.getenv("GEMINI_API_KEYS") or os.getenv("GEMINI_API_KEY") or os.getenv("GENAI_API_KEY")):
+        raise RuntimeError("Please set GEMINI_API_KEYS, GEMINI_API_KEY or GENAI_API_KEY in your environment")
+    from common.ai_model.implements.gemini import build_gemini_model
+
+    return build_gemini_model(model_name, response_schema=model_response_schema() if config.MODEL_RESPONSE_SCHEMA else None)
+
+
+# async callback told about pipeline stages: downloaded, analyzed, annotated, uploaded
+ProgressFn = Callable[[str], Awaitable[None]]
+# who a diagnosis belongs to, for the history: {"user_id": ..., "field_id": ...} (either may be None)
+Owner = Dict[str, Optional[str]]
+# (presigned URL of the annotated image, analysis_vn, history id)
+DetectResult = Tuple[Optional[str], Dict[str, Any], Optional[str]]
+
+
+def owner_of(item: Dict[str, Any]) -> Owner:
+    return {"user_id": item.get("user_id"), "field_id": item.get("field_id")}
+
+
+async def _report(progress: Optional[ProgressFn], stage: str) -> None:
+    if progress is not None:
+        await progress(stage)
+
+
+class _EventStream:
+    """
+    Events of one streaming model call, kept so every request following that call (the one that
+    started it and any identical request arriving meanwhile) replays them from the start.
+    `flight` is the cache computation producing them; the stream ends when it does.
+    """
+
+    def __init__(self):
+        self.events: List[Tuple[str, Any]] = []
+        self.closed = False
+        self.flight: Optional[asyncio.Future] = None
+        self._signal = asyncio.Event()
+
+    def publish(self, event: str, data: Any) -> None:
+        self.events.append((event, data))
+        self._wake()
+
+    def close(self) -> None:
+        self.closed = True
+        self._wake()
+
+    def _wake(self) -> None:
+        self._signal.set()
+        self._signal = asyncio.Event()
+
+    async def follow(self) -> AsyncIterator[Tuple[str, Any]]:
+        i = 0
+        while True:
+            while i < len(self.events):
+                yield self.events[i]
+                i += 1
+            if self.closed:
+                return
+            await self._signal.wait()
+
+
+def inspect_image(image_bytes: bytes, screen: bool, hashes: bool) -> Dict[str, Any]:
+    """
+    Everything that runs before the model call, on one decode (CPU executor):
+    {"image": load_model_image result, "verdict": pre-screen or None, "hashes": near-duplicate hashes or None}.
+    Rejected images are not hashed: they never go into the near-duplicate index.
+    The pre-screen and the hashes need numpy, imported here rather than with this module.
+    """
+    with timed("decode"):
+        img, original_size = load_model_image(image_bytes)
+    verdict = None
+    if screen:
+        from common.ai_model.prescreen import screen_image
+
+        with timed("prescreen"):
+            verdict = screen_image(img, original_size)
+    image_hash = None
+    if hashes and (verdict is None or verdict["passed"]):
+        from common.near_dup import image_hashes
+
+        with timed("phash"):
+            image_hash = image_hashes(img)
+    return {"image": img, "verdict": verdict, "hashes": image_hash}
+
 
 class HealthService:
     """
     Lightweight service for disease detection using a multimodal LLM (Gemini).
+    The whole pipeline is async: network calls are awaited, Pillow work runs on the CPU
+    executor and storage calls on the I/O executor, so the event loop is never blocked.
+    Storage, model and cache not passed in are built on first use (or by warm()).
+    With a `history` store every diagnosis served is recorded there (see api/health/history.py).
     """
 
-    def __init__(self, minio=minio_service, model_name: str = "gemini-2.5-flash"):
-        self.minio = minio
+    def __init__(self, storage: Optional[StorageInterface] = None, model_name: str = "gemini-2.5-flash", model=None, cache=None, uploads=upload_store, near_dups=None, history=None):
+        self._storage = storage
+        self._model = model
+        self._cache = cache
+        self._build_lock = threading.Lock()
+        self.uploads = uploads
+        self.history = history
+        self.model_name = getattr(model, "model", model_name)
+        self._near_dups = near_dups
+        # bounds in-flight model calls + processing per worker
+        self.slots = asyncio.Semaphore(config.DETECT_CONCURRENCY)
+        self._http: Optional[httpx.AsyncClient] = None
+        self._fetcher: Optional[ImageFetcher] = None
+        # cache key -> streaming model call in flight (see detect_stream)
+        self._streams: Dict[str, _EventStream] = {}
+
+    @property
+    def storage(self) -> StorageInterface:
+        if self._storage is None:
+            with self._build_lock:
+                if self._storage is None:
+                    self._storage = build_storage()
+        return self._storage
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._build_lock:
+                if self._model is None:
+                    self._model = build_model(self.model_name)
+        return self._model
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            storage = self.storage
+            with self._build_lock:
+                if self._cache is None:
+                    self._cache = build_diagnosis_cache(storage)
+        return self._cache
 
-    def detect_from_url(self, image_url: str) -> Tuple[str, Dict[str, Any]]:
+    @property
+    def near_dups(self):
+        """
+        The near-duplicate index. common.near_dup (numpy) is imported here, on first use.
+        """
+        if self._near_dups is None:
+            with self._build_lock:
+                if self._near_dups is None:
+                    from common.near_dup import NearDuplicateIndex
+
+                    self._near_dups = NearDuplicateIndex(
+                        max_entries=config.NEAR_DUP_MAX_ENTRIES,
+                        ttl=config.NEAR_DUP_TTL,
+                        max_distance=config.NEAR_DUP_DISTANCE,
+                        max_dhash_distance=config.NEAR_DUP_DHASH_DISTANCE,
+                    )
+        return self._near_dups
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                timeout=httpx.Timeout(config.HTTP_READ_TIMEOUT, connect=config.HTTP_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=config.FETCH_MAX_CONNECTIONS,
+                    max_keepalive_connections=config.FETCH_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=config.FETCH_KEEPALIVE_EXPIRY,
+                ),
+                follow_redirects=True,
+            )
+        return self._http
+
+    @property
+    def fetcher(self) -> ImageFetcher:
+        if self._fetcher is None:
+            self._fetcher = ImageFetcher(self.http)
+        return self._fetcher
+
+    async def warm(self) -> Dict[str, float]:
+        """
+        Build the clients and pay the first-use costs a request would otherwise pay: storage
+        reachability (and its first pooled connection), the model client (google.genai import),
+        the cache, one tiny image through the model encoder and the rendition encoders (Pillow
+        plugins, encode threads), the pre-screen and near-duplicate hashing (numpy import) and the
+        download client (TLS context). Returns milliseconds per step; raises on failure.
+        """
+        timings: Dict[str, float] = {}
+
+        async def step(name: str, run: Callable[..., Awaitable[Any]], fn: Callable[[], Any]) -> None:
+            t0 = time.perf_counter()
+            await run(fn)
+            timings[name] = round((time.perf_counter() - t0) * 1000, 1)
+
+        def render() -> None:
+            img = Image.new("RGB", (64, 64), (40, 140, 40))
+            encode_model_image(img)
+            for _ in self.storage.renditions.render(img):
+                pass
+
+        def inspect() -> None:
+            sample = BytesIO()
+            Image.new("RGB", (64, 64), (40, 140, 40)).save(sample, "PNG")
+            inspect_image(sample.getvalue(), True, self.near_dups.enabled)
+
+        await step("storage", run_io, lambda: self.storage.check())
+        await step("model", run_io, lambda: self.model)
+        await step("cache", run_io, lambda: self.cache)
+        await step("encoders", run_cpu, render)
+        await step("inspect", run_cpu, inspect)
+        await step("fetcher", run_io, lambda: self.fetcher)
+        return timings
+
+    async def aclose(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+            self._fetcher = None
+
+    async def download(self, image_url: str) -> bytes:
+        with timed("download"):
+            image_bytes = await self.fetcher.fetch(image_url)
+        count_bytes("download", "in", len(image_bytes))
+        return image_bytes
+
+    async def read_upload(self, upload_id: str) -> bytes:
+        with timed("read_upload"):
+            image_bytes = await run_io(self.uploads.read, upload_id)
+        count_bytes("read_upload", "in", len(image_bytes))
+        return image_bytes
+
+    async def load_item(self, item: Dict[str, Optional[str]]) -> bytes:
+        """
+        Image bytes for a request item holding either `upload_id` or `image_url`.
+        """
+        if item.get("upload_id"):
+            return await self.read_upload(item["upload_id"])
+        if item.get("image_url"):
+            return await self.download(item["image_url"])
+        raise ValueError("image_url or upload_id is required")
+
+    async def detect_from_url(self, image_url: str, progress: Optional[ProgressFn] = None, owner: Optional[Owner] = None) -> DetectResult:
         """
         Download an image, run detection, annotate, upload annotated image, return presigned URL and detection list.
         """
-        r = requests.get(image_url, timeout=20)
-        r.raise_for_status()
-        image_bytes = r.content
-        return self._detect_and_store(image_bytes)
+        image_bytes = await self.download(image_url)
+        await _report(progress, "downloaded")
+        return await self._detect_and_store(image_bytes, progress, owner)
 
-    def detect_from_bytes(self, image_bytes: bytes) -> Tuple[str, Dict[str, Any]]:
+    async def detect_from_bytes(self, image_bytes: bytes, progress: Optional[ProgressFn] = None, owner: Optional[Owner] = None) -> DetectResult:
         """
         Run detection on raw image bytes.
         """
-        return self._detect_and_store(image_bytes)
+        return await self._detect_and_store(image_bytes, progress, owner)
+
+    async def detect_from_upload(self, upload_id: str, progress: Optional[ProgressFn] = None, owner: Optional[Owner] = None) -> DetectResult:
+        """
+        Run detection on a file previously stored by /api/health/upload, read straight from the
+        local upload store (no HTTP round trip to our own public URL).
+        """
+        image_bytes = await self.read_upload(upload_id)
+        await _report(progress, "downloaded")
+        return await self._detect_and_store(image_bytes, progress, owner)
+
+    async def detect_item(self, item: Dict[str, Optional[str]], progress: Optional[ProgressFn] = None) -> DetectResult:
+        """
+        Detect from a request item holding either `upload_id` or `image_url` (and optionally
+        `user_id` / `field_id` for the history).
+        """
+        image_bytes = await self.load_item(item)
+        await _report(progress, "downloaded")
+        return await self._detect_and_store(image_bytes, progress, owner_of(item))
+
+    async def detect_many(
+        self, items: List[Dict[str, Optional[str]]], concurrency: int
+    ) -> AsyncIterator[Tuple[int, Optional[DetectResult], Optional[str]]]:
+        """
+        Run several detections with at most `concurrency` in flight and yield
+        (index, result, error) as each one finishes. A failing item only produces an error entry.
+        """
+        gate = asyncio.Semaphore(concurrency)
+
+        async def one(index: int, item: Dict[str, Optional[str]]):
+            async with gate:
+                try:
+                    return index, await self.detect_item(item), None
+                except Exception as exc:
+                    return index, None, str(exc) or type(exc).__name__
+
+        tasks = [asyncio.create_task(one(i, item)) for i, item in enumerate(items)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # client went away or the consumer stopped early: do not leave work running
+            for task in tasks:
+                task.cancel()
+
+
+    async def _detect_and_store(self, image_bytes: bytes, progress: Optional[ProgressFn] = None, owner: Optional[Owner] = None) -> DetectResult:
+        """
+        Cached pipeline: identical image bytes (for the same model and prompt) reuse the stored
+        analysis and annotated object; only the presigned URL is issued fresh.
+        """
+        key = make_cache_key(image_bytes, self.model_name, PROMPT)
+        with stage_timings() as timings:
+            entry = await self.cache.get_or_compute(key, lambda: self._run_or_reuse(key, image_bytes, progress))
+            # images turned away by the pre-screen have no annotated object
+            presigned = await self._presign(entry["file_key"]) if entry["file_key"] else None
+        diagnosis_id = await self._record(key, entry, owner, timings)
+        return presigned, entry["analysis_vn"], diagnosis_id
 
+    async def _record(self, key: str, entry: Dict[str, Any], owner: Optional[Owner], timings: Dict[str, float]) -> Optional[str]:
+        """
+        Add a served diagnosis to the history; its id, or None (history off, or the write failed:
+        the diagnosis itself is still answered).
+        """
+        if self.history is None:
+            return None
+        record = {
+            **(owner or {}),
+            "image_hash": key.split("-", 1)[0],
+            "file_key": entry["file_key"],
+            "model": self.model_name,
+            "detections": entry.get("detections", []),
+            "analysis_vn": entry["analysis_vn"],
+            "timings": {stage: round(seconds * 1000, 1) for stage, seconds in timings.items()},
+        }
+        try:
+            with timed("history"):
+                return await run_io(self.history.add, record)
+        except Exception as e:
+            log.error("Failed to record diagnosis in history: %s", e)
+            return None
+
+    async def get_diagnosis(self, diagnosis_id: str) -> Optional[Dict[str, Any]]:
+        """
+        A recorded diagnosis with a freshly issued presigned URL, or None.
+        """
+        record = await run_io(self.history.get, diagnosis_id)
+        if record is not None:
+            record["presigned_url"] = await self._presign(record["file_key"]) if record["file_key"] else None
+        return record
 
-    def _detect_and_store(self, image_bytes: bytes) -> Tuple[str, Dict[str, Any]]:
+    async def list_diagnoses(
+        self, user_id: Optional[str], field_id: Optional[str], limit: int, cursor: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
         """
-        Full pipeline: call model, annotate, upload to minio, return presigned url and typed detections.
+        One page of history (see SqliteHistoryStore.list), each item with a fresh thumbnail URL.
         """
-        raw_dets, analysis_vn  = geminiModel.generate_json_response(image_bytes, PROMPT)
-        
-        # convert to typed models
-        typed = []
-        for d in raw_dets:
+        items, next_cursor = await run_io(self.history.list, user_id, field_id, limit, cursor)
+        keys = [item["file_key"] for item in items if item["file_key"]]
+        urls: Dict[str, str] = {}
+        if keys:
             try:
-                label = str(d.get("label") or "unknown")
-                conf = d.get("confidence")
-                if conf is not None:
-                    conf = float(conf)
-                    if conf > 1:
-                        conf = conf / 100.0
-                box = [float(x) for x in d.get("box_2d")[:4]]
-                typed.append(Detection(label=label, confidence=conf, box_2d=box))
+                with timed("presign"):
+                    urls = await run_io(lambda: {k: self.storage.get_presigned_url(k, size="small") for k in keys})
             except Exception:
-                # skip malformed detection
-                continue
+                raise RuntimeError("Failed to get presigned URL from storage")
+        for item in items:
+            item["thumbnail_url"] = urls[item["file_key"]] if item["file_key"] else None
+        return items, next_cursor
 
-        annotated_png = annotate_image(image_bytes, raw_dets)
-        file_key = self.minio.generate_file_key("annotated.png")
+    async def diagnosis_stats(
+        self, by: str, since: float, until: float, user_id: Optional[str] = None, field_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        return await run_io(self.history.aggregate, by, since, until, user_id, field_id)
+
+    async def _run_or_reuse(self, key: str, image_bytes: bytes, progress: Optional[ProgressFn] = None) -> Dict[str, Any]:
+        """
+        Exact-cache miss: answer without the model if the pre-screen rejects the image or a recent
+        near-duplicate was diagnosed, else run the pipeline.
+        """
+        inspected = await self._inspect(image_bytes)
+        entry = await self._shortcut(image_bytes, inspected, progress)
+        if entry is None:
+            model_image = await self._preprocess(inspected.pop("image"))
+            entry = await self._run_pipeline(image_bytes, model_image, progress)
+            if inspected["hashes"] is not None:
+                self.near_dups.add(key, inspected["hashes"], entry)
+        return entry
+
+    async def _inspect(self, image_bytes: bytes) -> Dict[str, Any]:
+        inspected = await run_cpu(inspect_image, image_bytes, bool(config.PRESCREEN), self.near_dups.enabled)
+        verdict = inspected["verdict"]
+        if verdict is not None:
+            for result in [r["code"] for r in verdict["reasons"]] or ["passed"]:
+                PRESCREEN_EVENTS.inc(result=result)
+        return inspected
+
+    async def _shortcut(self, image_bytes: bytes, inspected: Dict[str, Any], progress: Optional[ProgressFn] = None) -> Optional[Dict[str, Any]]:
+        """
+        Cache entry that needs no model call (pre-screen rejection or near-duplicate), or None.
+        """
+        verdict = inspected["verdict"]
+        if verdict is not None and not verdict["passed"]:
+            await _report(progress, "analyzed")
+            return {"file_key": None, "analysis_vn": rejected_analysis(verdict), "detections": []}
+        earlier = self.near_dups.lookup(inspected["hashes"]) if inspected["hashes"] is not None else None
+        if earlier is not None:
+            return await self._reuse(image_bytes, earlier, progress)
+        return None
+
+    async def _reuse(self, image_bytes: bytes, earlier: Dict[str, Any], progress: Optional[ProgressFn] = None) -> Dict[str, Any]:
+        """
+        Cache entry for a near-duplicate of `earlier`: same analysis and boxes, and either the same
+        annotated object or (NEAR_DUP_REANNOTATE=1) the boxes drawn on this photo.
+        Boxes are normalized 0..1000, so they carry over as long as the framing barely changed.
+        """
+        await _report(progress, "analyzed")
+        detections = earlier.get("detections", [])
+        if config.NEAR_DUP_REANNOTATE:
+            file_key = await self._annotate_and_upload(image_bytes, detections, progress)
+        else:
+            file_key = earlier["file_key"]
+            await _report(progress, "annotated")
+            await _report(progress, "uploaded")
+        return {"file_key": file_key, "analysis_vn": earlier["analysis_vn"], "detections": detections, "near_duplicate_of": earlier["file_key"]}
+
+    async def _presign(self, file_key: str) -> str:
+        try:
+            with timed("presign"):
+                return await run_io(self.storage.get_presigned_url, file_key, size="medium", expires_in=24 * 3600)
+        except Exception:
+            raise RuntimeError("Failed to get presigned URL from storage")
+
+    async def _run_pipeline(self, image_bytes: bytes, model_image: Tuple[bytes, str], progress: Optional[ProgressFn] = None) -> Dict[str, Any]:
+        """
+        Full pipeline: call model, annotate, upload to storage, return the cache entry (file key + analysis).
+        The model gets `model_image`, a normalized, downsampled copy; annotation still uses the original.
+        """
+        model_bytes, mime_type = model_image
+        async with self.slots:
+            with timed("model"):
+                raw_dets, analysis_vn = await self.model.agenerate_json_response(model_bytes, PROMPT, mime_type)
+            raw_dets, analysis_vn = validate_diagnosis(raw_dets, analysis_vn)
+            await _report(progress, "analyzed")
+            file_key = await self._annotate_and_upload(image_bytes, raw_dets, progress)
+        return {"file_key": file_key, "analysis_vn": analysis_vn, "detections": raw_dets}
+
+    async def _preprocess(self, img) -> Tuple[bytes, str]:
+        with timed("preprocess"):
+            model_bytes, mime_type = await run_cpu(encode_model_image, img)
+        count_bytes("model", "out", len(model_bytes))
+        return model_bytes, mime_type
+
+    async def _annotate_and_upload(self, image_bytes: bytes, raw_dets: List[dict], progress: Optional[ProgressFn] = None) -> str:
+        # the annotated image is handed over in memory, no PNG encode/decode in between
+        with timed("annotate"):
+            annotated = await run_cpu(render_annotations, image_bytes, raw_dets)
+        await _report(progress, "annotated")
+        file_key = self.storage.generate_file_key("annotated.png")
 
         try:
-            self.minio.upload_resize_image(file_key, annotated_png)
-            presigned = self.minio.get_presigned_url(file_key,size="medium", expires_in=24 * 3600)
+            with timed("upload"):
+                await run_io(self.storage.upload_resize_image, file_key, annotated)
         except Exception:
-            raise RuntimeError("Failed to upload or get presigned URL from MinIO")
-        return presigned, analysis_vn
+            raise RuntimeError("Failed to upload annotated image to storage")
+        await _report(progress, "uploaded")
+        return file_key
+
+    async def detect_stream(self, image_bytes: bytes, owner: Optional[Owner] = None) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Streaming pipeline. Yields (event, data) as results become available:
+        `detections` (list) as soon as the model closes that array, one `analysis` ({key, value})
+        per completed analysis_vn field, `annotated` ({presigned_url}) once the annotated image is
+        uploaded (annotation starts right after `detections`, while the model is still writing),
+        and finally `done` ({presigned_url, analysis_vn, diagnosis_id}). Images rejected by the
+        pre-screen get no `annotated` event and a null presigned_url.
+
+        The model call is the cache's single-flight computation for the image: identical requests
+        in flight (streamed or not) share one call, and streamed ones replay its events. A cached,
+        near-duplicate or rejected image is replayed from its cache entry. The history records the
+        total time only: stage timings would have to cross the consumer's awaits.
+        """
+        t0 = time.perf_counter()
+        key = make_cache_key(image_bytes, self.model_name, PROMPT)
+        stream = self._streams.get(key)
+        if stream is None:
+            stream = _EventStream()
+            self._streams[key] = stream
+            stream.flight = asyncio.ensure_future(self.cache.get_or_compute(key, lambda: self._stream_pipeline(key, image_bytes, stream)))
+            stream.flight.add_done_callback(lambda _: self._end_stream(key, stream))
+
+        presigned: Optional[str] = None
+        async for event, data in stream.follow():
+            if event == "annotated":
+                presigned = data["presigned_url"]
+            yield event, data
+        # done by now; shielded so a consumer going away never cancels it
+        entry = await asyncio.shield(stream.flight)
+        if not stream.events:
+            presigned = await self._presign(entry["file_key"]) if entry["file_key"] else None
+            yield "detections", entry.get("detections", [])
+            for name, value in entry["analysis_vn"].items():
+                yield "analysis", {"key": name, "value": value}
+            if presigned is not None:
+                yield "annotated", {"presigned_url": presigned}
+        diagnosis_id = await self._record(key, entry, owner, {"stream": time.perf_counter() - t0})
+        yield "done", {"presigned_url": presigned, "analysis_vn": entry["analysis_vn"], "diagnosis_id": diagnosis_id}
+
+    def _end_stream(self, key: str, stream: _EventStream) -> None:
+        if self._streams.get(key) is stream:
+            del self._streams[key]
+        stream.close()
+        # retrieved here so a failure nobody is left to await is not logged as "never retrieved"
+        if not stream.flight.cancelled():
+            stream.flight.exception()
+
+    async def _stream_pipeline(self, key: str, image_bytes: bytes, stream: _EventStream) -> Dict[str, Any]:
+        """
+        Exact-cache miss of detect_stream: _run_or_reuse with a streaming model call that publishes
+        its events to `stream`. Shortcut entries publish nothing (they are replayed whole).
+        Each analysis field is validated before it is published and the fields the model left
+        out follow at the end, so the events carry the same analysis_vn as the cache entry.
+        A model slot is held for the model call only.
+        """
+        inspected = await self._inspect(image_bytes)
+        entry = await self._shortcut(image_bytes, inspected)
+        if entry is not None:
+            return entry
+
+        model_bytes, mime_type = await self._preprocess(inspected.pop("image"))
+        parser = IncrementalJsonParser(expand=("analysis_vn",))
+        chunks: List[str] = []
+        raw_dets: Optional[List[dict]] = None
+        analysis_vn: Dict[str, Any] = {}
+        published = set()
+        annotate: Optional[asyncio.Task] = None
+        announced = False
+
+        async def annotate_and_presign(dets: List[dict]) -> Tuple[str, str]:
+            file_key = await self._annotate_and_upload(image_bytes, dets)
+            return file_key, await self._presign(file_key)
+
+        try:
+            async with self.slots:
+                t_model = time.perf_counter()
+                async for text in self.model.astream_json_response(model_bytes, PROMPT, mime_type):
+                    chunks.append(text)
+                    for path, value in parser.feed(text):
+                        if path == ("detections",) and raw_dets is None:
+                            raw_dets, _ = validate_diagnosis(value, None)
+                            annotate = asyncio.create_task(annotate_and_presign(raw_dets))
+                            stream.publish("detections", raw_dets)
+                        elif len(path) == 2 and path[0] == "analysis_vn":
+                            analysis_vn[path[1]] = value
+                            field = validate_analysis_field(path[1], value)
+                            if field is not None:
+                                published.add(path[1])
+                                stream.publish("analysis", {"key": path[1], "value": field})
+                    if annotate is not None and not announced and annotate.done():
+                        stream.publish("annotated", {"presigned_url": annotate.result()[1]})
+                        announced = True
+                STAGE_SECONDS.observe(time.perf_counter() - t_model, stage="model_stream")
+
+            if raw_dets is None:
+                # model never closed `detections` where the scanner could see it: parse the whole text
+                raw_dets, parsed_analysis = validate_diagnosis(*parse_detections("".join(chunks)))
+                analysis_vn = analysis_vn or parsed_analysis
+                annotate = asyncio.create_task(annotate_and_presign(raw_dets))
+                stream.publish("detections", raw_dets)
+            _, analysis_vn = validate_diagnosis(None, analysis_vn)
+            for name, value in analysis_vn.items():
+                if name not in published:
+                    stream.publish("analysis", {"key": name, "value": value})
+
+            file_key, url = await annotate
+            if not announced:
+                stream.publish("annotated", {"presigned_url": url})
+        finally:
+            if annotate is not None and not annotate.done():
+                annotate.cancel()
+
+        entry = {"file_key": file_key, "analysis_vn": analysis_vn, "detections": raw_dets}
+        if inspected["hashes"] is not None:
+            self.near_dups.add(key, inspected["hashes"], entry)
+        return entry
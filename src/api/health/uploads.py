@@ -0,0 +1,238 @@
+# health.uploads.py
+import hashlib
+import os
+import uuid
+from typing import AsyncIterator, Optional, Tuple
+
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from common import config
+from common.executor import run_io
+from common.utils import silent_remove
+
+DEFAULT_UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "file")
+
+# bytes needed to recognise every format in sniff_image
+SNIFF_BYTES = 32
+
+# extension (as returned by sniff_image) -> media type served by /api/health/public
+MEDIA_TYPES = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+    ".bmp": "image/bmp",
+    ".tiff": "image/tiff",
+    ".avif": "image/avif",
+    ".heic": "image/heic",
+}
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+class NotAnImage(ValueError):
+    pass
+
+
+def sniff_image(header: bytes) -> Optional[str]:
+    """
+    Identify an image from its first bytes; returns the file extension or None.
+    """
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return ".png"
+    if header.startswith(b"\xff\xd8\xff"):
+        return ".jpg"
+    if header[:6] in (b"GIF87a", b"GIF89a"):
+        return ".gif"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return ".webp"
+    if header[:2] == b"BM":
+        return ".bmp"
+    if header[:4] in (b"II*\x00", b"MM\x00*"):
+        return ".tiff"
+    if header[4:8] == b"ftyp":
+        brand = header[8:12]
+        if brand in (b"avif", b"avis"):
+            return ".avif"
+        if brand in (b"heic", b"heix", b"hevc", b"hevx", b"mif1", b"msf1"):
+            return ".heic"
+    return None
+
+
+async def iter_multipart_file(request, field: str = "file") -> AsyncIterator[bytes]:
+    """
+    Yield the bytes of one file field of a multipart request as they arrive, without spooling
+    the body first (Starlette's form parser reads everything before the handler runs).
+    """
+    _, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise ValueError("Expected a multipart/form-data body")
+
+    state = {"headers": {}, "field": b"", "value": b"", "is_target": False, "found": False, "done": False}
+    pending = []
+
+    def on_part_begin():
+        state["headers"] = {}
+
+    def on_header_field(data, start, end):
+        state["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state["value"] += data[start:end]
+
+    def on_header_end():
+        state["headers"][state["field"].lower()] = state["value"]
+        state["field"], state["value"] = b"", b""
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(state["headers"].get(b"content-disposition", b""))
+        name = disposition.get(b"name", b"").decode("latin-1")
+        state["is_target"] = not state["found"] and name == field and b"filename" in disposition
+        state["found"] = state["found"] or state["is_target"]
+
+    def on_part_data(data, start, end):
+        if state["is_target"]:
+            pending.append(data[start:end])
+
+    def on_part_end():
+        if state["is_target"]:
+            state["done"] = True
+            state["is_target"] = False
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    async for chunk in request.stream():
+        parser.write(chunk)
+        if pending:
+            data = b"".join(pending)
+            pending.clear()
+            yield data
+        if state["done"]:
+            # the rest of the body is other fields; no need to read it
+            return
+
+    if not state["found"]:
+        raise ValueError(f"Missing file field '{field}'")
+
+
+class UploadStore:
+    """
+    Local store for images posted to /api/health/upload. An upload id is the stored file name,
+    so /detect can read the bytes straight from disk instead of downloading its own public URL.
+    Files are named by their sha256, so re-uploading the same image stores it only once.
+    """
+
+    def __init__(self, directory: str = DEFAULT_UPLOAD_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, upload_id: str) -> str:
+        # ids are plain file names; anything else could escape the directory
+        if not upload_id or os.path.basename(upload_id) != upload_id or upload_id.startswith("."):
+            raise ValueError(f"Invalid upload id: {upload_id!r}")
+        return os.path.join(self.directory, upload_id)
+
+    def exists(self, upload_id: str) -> bool:
+        return os.path.isfile(self.path_for(upload_id))
+
+    def read(self, upload_id: str) -> bytes:
+        """
+        Read an upload in one syscall-sized copy from the page cache (the model client and Pillow
+        both need a `bytes` object, so mapping the file would not save the copy).
+        """
+        path = self.path_for(upload_id)
+        try:
+            with open(path, "rb", buffering=0) as f:
+                return f.read()
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Upload not found: {upload_id}")
+
+    def save(self, data: bytes, filename: Optional[str] = None) -> str:
+        ext = sniff_image(data[:SNIFF_BYTES])
+        if ext is None:
+            raise NotAnImage("File is not a supported image")
+        upload_id = f"{hashlib.sha256(data).hexdigest()}{ext}"
+        path = os.path.join(self.directory, upload_id)
+        if not os.path.exists(path):
+            tmp = os.path.join(self.directory, f".{uuid.uuid4().hex}.part")
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return upload_id
+
+    async def save_stream(self, chunks: AsyncIterator[bytes], max_bytes: int = config.UPLOAD_MAX_BYTES) -> Tuple[str, bool]:
+        """
+        Write an upload chunk by chunk: the header is sniffed before anything touches the disk,
+        the sha256 is computed on the fly and the size limit is enforced as data arrives.
+        Returns (upload_id, created); created is False when the same bytes were already stored.
+        """
+        digest = hashlib.sha256()
+        head = b""
+        ext = None
+        size = 0
+        tmp = os.path.join(self.directory, f".{uuid.uuid4().hex}.part")
+        f = None
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"File exceeds {max_bytes} bytes")
+                digest.update(chunk)
+
+                if ext is None:
+                    head += chunk
+                    if len(head) < SNIFF_BYTES:
+                        continue
+                    ext = sniff_image(head)
+                    if ext is None:
+                        raise NotAnImage("File is not a supported image")
+                    chunk, head = head, b""
+                    f = await run_io(open, tmp, "wb")
+
+                await run_io(f.write, chunk)
+
+            if ext is None:
+                # tiny file, shorter than the sniff window
+                ext = sniff_image(head)
+                if ext is None:
+                    raise NotAnImage("File is not a supported image")
+                f = await run_io(open, tmp, "wb")
+                await run_io(f.write, head)
+
+            await run_io(f.close)
+            upload_id = f"{digest.hexdigest()}{ext}"
+            created = await run_io(_publish, tmp, os.path.join(self.directory, upload_id))
+            return upload_id, created
+        except BaseException:
+            if f is not None:
+                await run_io(f.close)
+            await run_io(silent_remove, tmp)
+            raise
+
+    def content_type(self, upload_id: str) -> str:
+        return MEDIA_TYPES.get(os.path.splitext(upload_id)[1].lower(), "application/octet-stream")
+
+    def public_url(self, upload_id: str) -> str:
+        return f"/api/health/public/{upload_id}"
+
+
+def _publish(tmp: str, path: str) -> bool:
+    if os.path.exists(path):
+        os.remove(tmp)
+        return False
+    os.replace(tmp, path)
+    return True
+
+
+upload_store = UploadStore()
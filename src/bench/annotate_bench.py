@@ -0,0 +1,124 @@
+"""
+Micro-benchmark: legacy annotate_image (full-frame RGBA overlay + PNG bytes, decoded again by the
+storage stage) vs render_annotations (regional blending, in-memory image).
+
+    python bench/annotate_bench.py [--repeat 5]
+
+Run from `src/`.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from io import BytesIO
+from typing import List
+
+from PIL import Image, ImageDraw, ImageFont
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.utils import render_annotations, to_pixels  # noqa: E402
+
+SIZES = [(640, 480), (1600, 1200), (4032, 3024)]
+DETECTION_COUNTS = [0, 1, 5, 20]
+
+
+def legacy_annotate_image(image_bytes: bytes, detections: List[dict], target_width: int = 1200) -> bytes:
+    """
+    The implementation this renderer replaced, kept verbatim (minus comments) as the baseline.
+    """
+    base = Image.open(BytesIO(image_bytes)).convert("RGBA")
+    orig_W, orig_H = base.size
+    scale = target_width / orig_W
+    new_W = int(round(orig_W * scale))
+    new_H = int(round(orig_H * scale))
+    if (new_W, new_H) != (orig_W, orig_H):
+        base = base.resize((new_W, new_H), resample=Image.LANCZOS)
+
+    overlay = Image.new("RGBA", (new_W, new_H), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    try:
+        font = ImageFont.truetype("DejaVuSans-Bold.ttf", size=max(12, int(min(new_W, new_H) / 45)))
+    except Exception:
+        font = ImageFont.load_default()
+
+    thickness = max(1, int(round((new_W + new_H) / 900)))
+    for d in detections:
+        x1, y1, x2, y2 = to_pixels(d["box_2d"], new_W, new_H)
+        if x2 - x1 <= 1 or y2 - y1 <= 1:
+            continue
+        draw.rectangle([x1, y1, x2, y2], outline=(255, 0, 0, 220), width=thickness)
+        text = f"{d['label']} {d['confidence']:.2f}"
+        tb = draw.textbbox((0, 0), text, font=font)
+        tw, th = tb[2] - tb[0], tb[3] - tb[1]
+        pad = max(4, th // 3)
+        by0 = max(0, y1 - th - 2 * pad)
+        if by0 == 0:
+            by0 = y1 + pad
+        draw.rectangle([x1, by0, x1 + tw + 2 * pad, by0 + th + 2 * pad], fill=(0, 0, 0, 200))
+        draw.text((x1 + pad, by0 + pad), text, fill=(255, 255, 255, 255), font=font)
+
+    out = Image.alpha_composite(base, overlay).convert("RGB")
+    with BytesIO() as out_buf:
+        out.save(out_buf, format="PNG", quality=95)
+        return out_buf.getvalue()
+
+
+def make_photo(size) -> bytes:
+    # noise + gradient so the encoders and filters do realistic work
+    W, H = size
+    img = Image.effect_noise((W, H), 40).convert("RGB")
+    img = Image.blend(img, Image.linear_gradient("L").resize((W, H)).convert("RGB"), 0.5)
+    buf = BytesIO()
+    img.save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def make_detections(n: int, rng: random.Random) -> List[dict]:
+    dets = []
+    for _ in range(n):
+        y, x = rng.randint(0, 800), rng.randint(0, 800)
+        dets.append({
+            "label": "leaf_spot",
+            "confidence": rng.random(),
+            "box_2d": [y, x, y + rng.randint(50, 200), x + rng.randint(50, 200)],
+        })
+    return dets
+
+
+def best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    print(f"{'input':>11} {'dets':>5} {'legacy ms':>10} {'new ms':>8} {'speedup':>8}")
+    for size in SIZES:
+        photo = make_photo(size)
+        for n in DETECTION_COUNTS:
+            dets = make_detections(n, rng)
+
+            def legacy():
+                # the storage stage used to decode the PNG again
+                Image.open(BytesIO(legacy_annotate_image(photo, dets))).load()
+
+            def new():
+                render_annotations(photo, dets)
+
+            t_legacy = best_of(legacy, args.repeat)
+            t_new = best_of(new, args.repeat)
+            print(f"{size[0]:>5}x{size[1]:<5} {n:>5} {t_legacy:>10.1f} {t_new:>8.1f} {t_legacy / t_new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
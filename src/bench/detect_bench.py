@@ -0,0 +1,347 @@
+"""
+Offline benchmark of the detection pipeline: no Gemini quota, no MinIO.
+
+A deterministic fake model (fixed latency, canned detections derived from the image hash) is
+plugged into HealthService, and the real MinioService runs against a filesystem stand-in for the
+MinIO client (or, with --storage local, LocalStorage writes the objects itself), so annotation,
+rendition encoding and "uploads" do their real work. The sample
+images under api/health/file/ are replayed through the HTTP routes in-process.
+
+Scenarios:
+    single      POST /detect (image_url), one request at a time
+    upload      POST /detect/upload (multipart), one request at a time
+    concurrent  POST /detect (image_url) with --concurrency requests in flight
+
+For each scenario it reports p50/p95/p99 latency, requests per second and CPU seconds per stage
+(thread CPU time measured around preprocess, prescreen, annotate, rendition decode+resize, encode and put_object).
+The diagnosis cache is disabled so every request runs the full pipeline.
+
+    python bench/detect_bench.py -n 30 -c 8 --output bench.json
+    python bench/detect_bench.py --baseline bench.json --tolerance 0.2   # exit 1 on regression
+
+Run from `src/`.
+"""
+import argparse
+import asyncio
+import glob
+import hashlib
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_DIR = os.path.join(SRC_DIR, "api", "health", "file")
+SCENARIOS = ("single", "upload", "concurrent")
+LABELS = ("leaf_spot", "whiteflies", "rice_leaf_blast", "aphids", "powdery_mildew")
+
+
+class StageCpu:
+    """
+    Thread CPU seconds per stage, summed over every thread that ran the stage.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seconds: Dict[str, float] = defaultdict(float)
+
+    def wrap(self, stage: str, fn: Callable) -> Callable:
+        def wrapped(*args, **kwargs):
+            t0 = time.thread_time()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.thread_time() - t0
+                with self._lock:
+                    self.seconds[stage] += elapsed
+        return wrapped
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self.seconds)
+
+
+def build_fake_model(latency: float, max_detections: int):
+    from common.ai_model.ai_interface import AIModelInterface
+
+    class FakeModel(AIModelInterface):
+        """
+        Same image, same answer: detections are derived from the sha256 of the image bytes.
+        """
+
+        model = "fake"
+
+        def generate_json_response(self, image_bytes, prompt, mime_type="image/jpeg"):
+            time.sleep(latency)
+            return self._result(image_bytes)
+
+        async def agenerate_json_response(self, image_bytes, prompt, mime_type="image/jpeg"):
+            await asyncio.sleep(latency)
+            return self._result(image_bytes)
+
+        @staticmethod
+        def _result(image_bytes: bytes):
+            rng = random.Random(hashlib.sha256(image_bytes).digest())
+            detections = []
+            for _ in range(rng.randint(0, max_detections)):
+                y, x = rng.randint(0, 700), rng.randint(0, 700)
+                detections.append({
+                    "label": rng.choice(LABELS),
+                    "confidence": round(rng.uniform(0.3, 0.99), 2),
+                    "box_2d": [y, x, y + rng.randint(50, 300), x + rng.randint(50, 300)],
+                })
+            analysis = {"prediction": detections[0]["label"] if detections else "healthy", "severity_level": "Thấp"}
+            return detections, analysis
+
+    return FakeModel()
+
+
+class LocalObjectClient:
+    """
+    Filesystem stand-in for the `minio.Minio` calls MinioService makes.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def put_object(self, bucket_name, object_name, data, length, content_type=None):
+        path = os.path.join(self.directory, bucket_name, object_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data.read(length))
+
+    def presigned_get_object(self, bucket_name, object_name, expires=None, response_headers=None):
+        return "file://" + os.path.join(self.directory, bucket_name, object_name)
+
+
+def build_app(args, workdir: str, cpu: StageCpu):
+    os.environ.setdefault("GEMINI_API_KEY", "bench")
+    from fastapi import FastAPI
+    from api.health import providers
+    from api.health import router as router_module
+    from api.health import service as service_module
+    from api.health.service import HealthService
+    from common.cache import DiagnosisCache
+    from common.near_dup import NearDuplicateIndex
+    from provider.local_storage import LocalStorage
+    from provider.minIO import MinioService
+
+    if args.storage == "local":
+        storage = LocalStorage(os.path.join(workdir, "objects"))
+        storage.put_object = cpu.wrap("put_object", storage.put_object)
+    else:
+        storage = MinioService()
+        storage.client = LocalObjectClient(os.path.join(workdir, "objects"))
+        storage.client.put_object = cpu.wrap("put_object", storage.client.put_object)
+    storage.renditions._encode = cpu.wrap("rendition_encode", storage.renditions._encode)
+    storage.upload_resize_image = cpu.wrap("rendition_decode_resize", storage.upload_resize_image)
+    # decode + resize and the model encode are both counted as preprocess, as before they were split
+    service_module.load_model_image = cpu.wrap("preprocess", service_module.load_model_image)
+    service_module.encode_model_image = cpu.wrap("preprocess", service_module.encode_model_image)
+    service_module.screen_image = cpu.wrap("prescreen", service_module.screen_image)
+    service_module.render_annotations = cpu.wrap("annotate", service_module.render_annotations)
+
+    # keep benchmark uploads out of the repository's upload directory
+    router_module.upload_store.directory = os.path.join(workdir, "uploads")
+    os.makedirs(router_module.upload_store.directory, exist_ok=True)
+
+    samples = load_samples(args.samples)
+
+    def serve_image(request: httpx.Request) -> httpx.Response:
+        name = request.url.path.rsplit("/", 1)[-1]
+        return httpx.Response(200, content=samples[name], headers={"content-type": "application/octet-stream"})
+
+    # no cache tiers and no near-duplicate reuse: every request runs the whole pipeline
+    service = HealthService(
+        storage=storage, model=build_fake_model(args.model_latency, args.max_detections),
+        cache=DiagnosisCache([]), near_dups=NearDuplicateIndex(max_entries=0),
+    )
+    service._http = httpx.AsyncClient(transport=httpx.MockTransport(serve_image))
+    providers.start(service)
+
+    app = FastAPI()
+    app.include_router(router_module.router)
+    return app, samples
+
+
+def load_samples(limit: int) -> Dict[str, bytes]:
+    paths = sorted(p for p in glob.glob(os.path.join(SAMPLE_DIR, "*")) if p.lower().endswith((".png", ".jpg", ".jpeg", ".webp")))
+    if limit:
+        paths = paths[:limit]
+    if not paths:
+        raise SystemExit(f"no sample images in {SAMPLE_DIR}")
+    samples = {}
+    for path in paths:
+        with open(path, "rb") as f:
+            samples[os.path.basename(path)] = f.read()
+    return samples
+
+
+def summarize(latencies: List[float], errors: int, wall: float, cpu_before: Dict[str, float], cpu_after: Dict[str, float], process_cpu: float) -> Dict[str, Any]:
+    n = len(latencies)
+    latencies = sorted(latencies)
+    if n >= 2:
+        q = statistics.quantiles(latencies, n=100, method="inclusive")
+        p50, p95, p99 = q[49], q[94], q[98]
+    else:
+        p50 = p95 = p99 = latencies[0] if latencies else 0.0
+    stages = {stage: cpu_after[stage] - cpu_before.get(stage, 0.0) for stage in sorted(cpu_after)}
+    return {
+        "requests": n,
+        "errors": errors,
+        "wall_s": round(wall, 4),
+        "rps": round(n / wall, 3) if wall else 0.0,
+        "latency_s": {
+            "p50": round(p50, 4), "p95": round(p95, 4), "p99": round(p99, 4),
+            "mean": round(statistics.fmean(latencies), 4) if latencies else 0.0,
+            "max": round(latencies[-1], 4) if latencies else 0.0,
+        },
+        "cpu_s": {
+            "process": round(process_cpu, 4),
+            "per_request": round(process_cpu / n, 4) if n else 0.0,
+            "stages": {stage: round(seconds, 4) for stage, seconds in stages.items()},
+        },
+    }
+
+
+async def run_scenario(name: str, client: httpx.AsyncClient, samples: Dict[str, bytes], requests: int, concurrency: int, cpu: StageCpu) -> Dict[str, Any]:
+    names = list(samples)
+    latencies: List[float] = []
+    errors = 0
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> None:
+        nonlocal errors
+        sample = names[i % len(names)]
+        async with gate:
+            t0 = time.perf_counter()
+            if name == "upload":
+                r = await client.post("/api/health/detect/upload", files={"file": (sample, samples[sample], "application/octet-stream")})
+            else:
+                r = await client.post("/api/health/detect", json={"image_url": f"http://images/{sample}"})
+            latencies.append(time.perf_counter() - t0)
+            if r.status_code != 200:
+                errors += 1
+
+    cpu_before = cpu.snapshot()
+    process_before = time.process_time()
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    wall = time.perf_counter() - t0
+    return summarize(latencies, errors, wall, cpu_before, cpu.snapshot(), time.process_time() - process_before)
+
+
+async def run(args) -> Dict[str, Any]:
+    cpu = StageCpu()
+    with tempfile.TemporaryDirectory(prefix="detect-bench-") as workdir:
+        app, samples = build_app(args, workdir, cpu)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None) as client:
+            # warm-up: fonts, codecs and executor threads
+            await run_scenario("single", client, samples, min(2, len(samples)), 1, cpu)
+            results = {}
+            for name in args.scenarios:
+                concurrency = args.concurrency if name == "concurrent" else 1
+                results[name] = await run_scenario(name, client, samples, args.requests, concurrency, cpu)
+                results[name]["concurrency"] = concurrency
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "samples": len(samples),
+            "model_latency_s": args.model_latency,
+            "max_detections": args.max_detections,
+            "storage": args.storage,
+        },
+        "scenarios": results,
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Regressions larger than `tolerance` (fraction) on p50/p95 latency, throughput and stage CPU.
+    """
+    regressions = []
+    for name, current in report["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if base is None:
+            continue
+        checks = [
+            (f"{name}.latency_s.{q}", current["latency_s"][q], base["latency_s"][q], True) for q in ("p50", "p95")
+        ]
+        checks.append((f"{name}.rps", current["rps"], base["rps"], False))
+        for stage, seconds in current["cpu_s"]["stages"].items():
+            base_seconds = base["cpu_s"]["stages"].get(stage)
+            if base_seconds is not None:
+                checks.append((f"{name}.cpu_s.stages.{stage}", seconds / current["requests"], base_seconds / base["requests"], True))
+        for metric, value, base_value, lower_is_better in checks:
+            if not base_value:
+                continue
+            change = (value - base_value) / base_value
+            if (change > tolerance) if lower_is_better else (change < -tolerance):
+                regressions.append(f"{metric}: {base_value:.4f} -> {value:.4f} ({change:+.0%})")
+    return regressions
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SRC_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--requests", type=int, default=30, help="requests per scenario")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="in-flight requests for 'concurrent'")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--model-latency", type=float, default=0.05, help="fake model latency in seconds")
+    parser.add_argument("--max-detections", type=int, default=5)
+    parser.add_argument("--storage", choices=("minio", "local"), default="minio", help="MinioService on a stub client, or LocalStorage")
+    parser.add_argument("--samples", type=int, default=0, help="use only the first N sample images (0 = all)")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression vs --baseline")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    for name, r in report["scenarios"].items():
+        lat = r["latency_s"]
+        print(
+            f"{name:>10}: n={r['requests']} c={r['concurrency']} errors={r['errors']} rps={r['rps']:.1f} "
+            f"p50={lat['p50']:.3f}s p95={lat['p95']:.3f}s p99={lat['p99']:.3f}s cpu/req={r['cpu_s']['per_request']:.3f}s",
+            file=sys.stderr,
+        )
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Local stand-in for the Gemini generateContent API, for exercising GeminiModel / ModelPool
+without quota. Point the service at it with GEMINI_BASE_URL=http://127.0.0.1:8099.
+
+It also accepts countTokens and cachedContents (prompt caching, refused with a 400 below
+--min-cache-tokens like the real API) and reports usageMetadata with token counts estimated as
+~4 characters per token plus 258 per image, only good for comparing request shapes with each other. Per API key (x-goog-api-key) it enforces a requests-per-minute limit and answers
+429 with a RetryInfo detail beyond it; it also injects 503s and a slow tail:
+
+    python bench/fake_gemini_server.py --port 8099 --rpm 60 --error-rate 0.02 \\
+        --median-latency 0.4 --slow-rate 0.05 --slow-latency 4
+
+Run from `src/`.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Deque, Dict
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+CANNED = {
+    "detections": [{"label": "leaf_spot", "confidence": 0.82, "box_2d": [120, 250, 460, 620]}],
+    "analysis_vn": {
+        "prediction": "Lá bị đốm lá",
+        "severity_level": "Trung bình",
+        "possible_causes": [{"cause": "Độ ẩm cao", "confidence": 0.6, "evidence": "vết đốm nâu viền vàng"}],
+        "recommended_actions": [
+            {"name": "Cắt bỏ lá bệnh", "timing": "Ngay lập tức", "description": "Tiêu hủy xa vườn", "targetValue": 1, "numOfWeeks": 1}
+        ],
+        "chemical_recommendations": [],
+        "biological_recommendations": ["Trichoderma"],
+        "monitoring_plan": "Kiểm tra lại sau 7 ngày",
+        "preventive_measures": ["Tỉa thông thoáng"],
+        "additional_notes": "",
+    },
+}
+
+
+def build_app(
+    rpm: int = 0,
+    error_rate: float = 0.0,
+    median_latency: float = 0.4,
+    sigma: float = 0.3,
+    slow_rate: float = 0.0,
+    slow_latency: float = 4.0,
+    seed: int = 0,
+    min_cache_tokens: int = 1024,
+) -> FastAPI:
+    app = FastAPI()
+    rng = random.Random(seed)
+    windows: Dict[str, Deque[float]] = defaultdict(deque)
+    lock = threading.Lock()
+    app.state.stats = stats = defaultdict(int)
+    caches: Dict[str, int] = {}  # cached content name -> token estimate
+
+    def estimate_tokens(node) -> int:
+        if isinstance(node, dict):
+            if "inlineData" in node:
+                return 258
+            return sum(estimate_tokens(v) for k, v in node.items() if k != "text") + len(node.get("text", "")) // 4
+        if isinstance(node, list):
+            return sum(estimate_tokens(v) for v in node)
+        return 0
+
+    def latency() -> float:
+        if slow_rate and rng.random() < slow_rate:
+            return slow_latency
+        return median_latency * math.exp(rng.gauss(0, sigma))
+
+    def error(code: int, status: str, message: str, retry_delay: float = 0) -> JSONResponse:
+        body = {"error": {"code": code, "message": message, "status": status}}
+        if retry_delay:
+            body["error"]["details"] = [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": f"{retry_delay:.0f}s"}]
+        return JSONResponse(body, status_code=code)
+
+    def admit(key: str):
+        """
+        None when the call may proceed, else the error response.
+        """
+        now = time.monotonic()
+        with lock:
+            stats["requests"] += 1
+            if rpm:
+                window = windows[key]
+                while window and window[0] < now - 60:
+                    window.popleft()
+                if len(window) >= rpm:
+                    stats["429"] += 1
+                    return error(429, "RESOURCE_EXHAUSTED", "Quota exceeded", retry_delay=60 - (now - window[0]))
+                window.append(now)
+            if error_rate and rng.random() < error_rate:
+                stats["503"] += 1
+                return error(503, "UNAVAILABLE", "The model is overloaded. Please try again later.")
+        return None
+
+    def payload(model: str, text: str, usage: Dict[str, int], final: bool = True) -> dict:
+        body = {
+            "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}],
+            "modelVersion": model,
+        }
+        if final:
+            body["candidates"][0]["finishReason"] = "STOP"
+            body["usageMetadata"] = usage
+        return body
+
+    @app.post("/{version}/cachedContents")
+    async def create_cache(version: str, request: Request):
+        body = await request.json()
+        tokens = estimate_tokens({k: v for k, v in body.items() if k in ("systemInstruction", "contents")})
+        if tokens < min_cache_tokens:
+            stats["caches_refused"] += 1
+            return error(400, "INVALID_ARGUMENT", f"Cached content is too small. total_token_count={tokens}, min_total_token_count={min_cache_tokens}")
+        name = f"cachedContents/fake-{len(caches)}"
+        caches[name] = tokens
+        stats["caches_created"] += 1
+        return JSONResponse({"name": name, "model": body.get("model"), "usageMetadata": {"totalTokenCount": caches[name]}})
+
+    @app.post("/{version}/models/{target}")
+    async def generate(version: str, target: str, request: Request):
+        model, _, action = target.partition(":")
+        body = await request.json()
+        if action == "countTokens":
+            stats["count_tokens"] += 1
+            return JSONResponse({"totalTokens": estimate_tokens(body.get("contents", []))})
+        rejected = admit(request.headers.get("x-goog-api-key", ""))
+        if rejected is not None:
+            return rejected
+
+        cached = caches.get(body.get("cachedContent"), 0) if body.get("cachedContent") else 0
+        if body.get("cachedContent") and body["cachedContent"] not in caches:
+            return error(404, "NOT_FOUND", "CachedContent not found")
+        generation = body.get("generationConfig", {})
+        schema = generation.get("responseSchema") or generation.get("responseJsonSchema")
+        prompt_tokens = cached + estimate_tokens({k: v for k, v in body.items() if k in ("systemInstruction", "contents")})
+        prompt_tokens += len(json.dumps(schema, ensure_ascii=False)) // 4 if schema else 0
+        text = json.dumps(CANNED, ensure_ascii=False) if schema else json.dumps(CANNED, ensure_ascii=False, indent=2)
+        output_tokens = len(text) // 4
+        usage = {"promptTokenCount": prompt_tokens, "candidatesTokenCount": output_tokens, "totalTokenCount": prompt_tokens + output_tokens}
+        if cached:
+            usage["cachedContentTokenCount"] = cached
+        delay = latency()
+        if action == "generateContent":
+            await asyncio.sleep(delay)
+            stats["ok"] += 1
+            return JSONResponse(payload(model, text, usage))
+        if action == "streamGenerateContent":
+            pieces = [text[i:i + 64] for i in range(0, len(text), 64)]
+
+            async def events():
+                await asyncio.sleep(delay / 2)
+                for i, piece in enumerate(pieces):
+                    final = i == len(pieces) - 1
+                    yield f"data: {json.dumps(payload(model, piece, usage, final), ensure_ascii=False)}\r\n\r\n"
+                    await asyncio.sleep(delay / 2 / len(pieces))
+                stats["ok"] += 1
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+        return error(404, "NOT_FOUND", f"Unknown action {action}")
+
+    return app
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--rpm", type=int, default=0, help="requests per minute per API key (0 = unlimited)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered 503")
+    parser.add_argument("--median-latency", type=float, default=0.4)
+    parser.add_argument("--sigma", type=float, default=0.3, help="log-normal spread of the latency")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of calls taking --slow-latency")
+    parser.add_argument("--slow-latency", type=float, default=4.0)
+    parser.add_argument("--min-cache-tokens", type=int, default=1024, help="smallest cached content accepted")
+    args = parser.parse_args()
+    app = build_app(
+        args.rpm, args.error_rate, args.median_latency, args.sigma, args.slow_rate, args.slow_latency,
+        min_cache_tokens=args.min_cache_tokens,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+Remote image downloads (api/health/fetcher.py) against a local HTTP/1.1 server with keep-alive
+and ETags. Checks (exit status 1 if any fails) and measures:
+    reuse           N fetches of one sample: connections opened, latency, with the ETag cache
+                    off (full body every time) and on (304 after the first fetch); expects one
+                    pooled connection each, and N - 1 not_modified answers with the cache on
+    rejects         a text/html page, a 1 MB octet-stream that is not an image, a 30 MB body with
+                    and without Content-Length, and a 5 MB PNG whose header claims 30000x30000:
+                    status, time to reject and bytes the server managed to write before the
+                    client hung up (includes what the socket buffers absorbed); expects NotAnImage
+                    for the first two and UploadTooLarge for the others
+    baseline        the same oversized bodies read the old way (client.get, whole body)
+    timeout         a server dripping one byte every 0.2 s against a 1 s total deadline;
+                    expects TimeoutError
+
+    python bench/fetch_bench.py [--fetches 50]
+
+Run from `src/`.
+"""
+import argparse
+import asyncio
+import glob
+import hashlib
+import os
+import statistics
+import struct
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.health.fetcher import ImageFetcher, NotAnImage, UploadTooLarge  # noqa: E402
+from api.health.service import HealthService  # noqa: E402
+from common.metrics import FETCH_EVENTS  # noqa: E402
+
+SAMPLES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api", "health", "file")
+BIG_BYTES = 30 * 1024 * 1024
+CHUNK = 64 * 1024
+# path -> exception the fetcher must raise
+REJECTS = {
+    "/page": NotAnImage,
+    "/not-image": NotAnImage,
+    "/big": UploadTooLarge,
+    "/big-chunked": UploadTooLarge,
+    "/huge-dims": UploadTooLarge,
+}
+
+failures: List[str] = []
+
+
+def check(ok: bool, what: str) -> None:
+    if not ok:
+        failures.append(what)
+        print(f"  FAIL: {what}")
+
+
+def fetch_events(result: str) -> float:
+    return dict(FETCH_EVENTS._values).get((("result", result),), 0)
+
+
+def png_header(width: int, height: int, data_bytes: int) -> bytes:
+    """
+    A PNG claiming `width` x `height` (8-bit RGB): signature, IHDR and the header of an IDAT
+    chunk of `data_bytes`; the data itself is left to the caller.
+    """
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    chunk = b"IHDR" + ihdr
+    return (
+        b"\x89PNG\r\n\x1a\n" + struct.pack(">I", len(ihdr)) + chunk + struct.pack(">I", zlib.crc32(chunk))
+        + struct.pack(">I", data_bytes) + b"IDAT"
+    )
+
+
+class Server:
+    """
+    ThreadingHTTPServer on a free port; counts connections and the body bytes written per path.
+    """
+
+    def __init__(self, sample: bytes):
+        self.sample = sample
+        self.etag = '"' + hashlib.sha1(sample).hexdigest() + '"'
+        self.connections = 0
+        self.not_modified = 0
+        self.written: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with server.lock:
+                    server.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.route(self)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.base = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def route(self, h: BaseHTTPRequestHandler) -> None:
+        path = h.path.split("?")[0]
+        if path == "/sample":
+            if h.headers.get("If-None-Match") == self.etag:
+                with self.lock:
+                    self.not_modified += 1
+                h.send_response(304)
+                h.send_header("ETag", self.etag)
+                h.send_header("Content-Length", "0")
+                h.end_headers()
+                return
+            self.send(h, path, self.sample, "image/png", {"ETag": self.etag})
+        elif path == "/page":
+            self.send(h, path, b"<html>" + b"x" * BIG_BYTES + b"</html>", "text/html")
+        elif path == "/not-image":
+            self.send(h, path, os.urandom(1024 * 1024), "application/octet-stream")
+        elif path == "/big":
+            self.send(h, path, self.sample + b"\0" * BIG_BYTES, "image/png")
+        elif path == "/big-chunked":
+            self.send(h, path, self.sample + b"\0" * BIG_BYTES, "image/png", length=False)
+        elif path == "/huge-dims":
+            self.send(h, path, png_header(30000, 30000, BIG_BYTES // 6) + b"\0" * (BIG_BYTES // 6), "image/png")
+        elif path == "/slow":
+            self.send(h, path, self.sample, "image/png", drip=0.2)
+        else:
+            h.send_error(404)
+
+    def send(self, h, path, body: bytes, content_type: str, headers=None, length: bool = True, drip: float = 0) -> None:
+        h.send_response(200)
+        h.send_header("Content-Type", content_type)
+        for k, v in (headers or {}).items():
+            h.send_header(k, v)
+        if length:
+            h.send_header("Content-Length", str(len(body)))
+        else:
+            h.send_header("Transfer-Encoding", "chunked")
+        h.end_headers()
+        sent = 0
+        try:
+            step = 1 if drip else CHUNK
+            for i in range(0, len(body), step):
+                part = body[i:i + step]
+                h.wfile.write(b"%x\r\n%s\r\n" % (len(part), part) if not length else part)
+                sent += len(part)
+                if drip:
+                    h.wfile.flush()
+                    time.sleep(drip)
+            if not length:
+                h.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            h.close_connection = True
+        with self.lock:
+            self.written[path] = self.written.get(path, 0) + sent
+
+
+async def reuse(server: Server, fetches: int, cache_bytes: int) -> Dict[str, float]:
+    service = HealthService()
+    fetcher = ImageFetcher(service.http, cache_bytes=cache_bytes)
+    connections, answered_304, counted_304 = server.connections, server.not_modified, fetch_events("not_modified")
+    latencies: List[float] = []
+    for _ in range(fetches):
+        t0 = time.perf_counter()
+        body = await fetcher.fetch(f"{server.base}/sample")
+        latencies.append((time.perf_counter() - t0) * 1000)
+        check(body == server.sample, "fetched body differs from the served sample")
+    await service.aclose()
+    stats = {
+        "connections": server.connections - connections,
+        "not_modified": server.not_modified - answered_304,
+        "first_ms": round(latencies[0], 2),
+        "median_ms": round(statistics.median(latencies[1:]), 2),
+    }
+    expected_304 = fetches - 1 if cache_bytes else 0
+    check(stats["connections"] == 1, f"{stats['connections']} connections opened, expected 1 pooled connection")
+    check(stats["not_modified"] == expected_304, f"server answered {stats['not_modified']} 304s, expected {expected_304}")
+    check(fetch_events("not_modified") - counted_304 == expected_304, "image_fetch_total{result=not_modified} does not match")
+    return stats
+
+
+async def rejects(server: Server) -> None:
+    service = HealthService()
+    fetcher = service.fetcher
+    for path in REJECTS:
+        t0 = time.perf_counter()
+        error = None
+        try:
+            await fetcher.fetch(f"{server.base}{path}")
+            outcome = "accepted"
+        except Exception as e:
+            error, outcome = e, f"{type(e).__name__}: {e}"
+        ms = (time.perf_counter() - t0) * 1000
+        await asyncio.sleep(0.2)  # let the server notice the closed connection
+        print(f"  {path:13s} {ms:8.1f} ms  server wrote {server.written.get(path, 0) / 1e6:6.2f} MB  {outcome}")
+        expected = REJECTS[path]
+        check(type(error) is expected, f"{path}: expected {expected.__name__}, got {outcome}")
+    await service.aclose()
+
+
+async def baseline(server: Server) -> None:
+    async with httpx.AsyncClient() as client:
+        for path in ("/big", "/huge-dims"):
+            t0 = time.perf_counter()
+            r = await client.get(f"{server.base}{path}")
+            ms = (time.perf_counter() - t0) * 1000
+            print(f"  {path:13s} read {len(r.content) / 1e6:6.2f} MB in {ms:8.1f} ms")
+
+
+async def timeout(server: Server) -> None:
+    service = HealthService()
+    fetcher = ImageFetcher(service.http, timeout=1)
+    t0 = time.perf_counter()
+    error = None
+    try:
+        await fetcher.fetch(f"{server.base}/slow")
+        outcome = "accepted"
+    except Exception as e:
+        error, outcome = e, type(e).__name__
+    ms = (time.perf_counter() - t0) * 1000
+    print(f"  /slow         {outcome:14s} {ms:8.1f} ms")
+    check(isinstance(error, TimeoutError), f"/slow: expected TimeoutError, got {outcome}")
+    check(ms < 2000, f"/slow: gave up after {ms:.0f} ms, deadline is 1000 ms")
+    await service.aclose()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fetches", type=int, default=50)
+    args = parser.parse_args()
+
+    samples = sorted(glob.glob(os.path.join(SAMPLES_DIR, "*.png")))
+    with open(samples[0], "rb") as f:
+        server = Server(f.read())
+    print(f"sample {os.path.basename(samples[0])}: {len(server.sample) / 1e3:.0f} KB")
+
+    print("reuse")
+    print("  etag cache off", await reuse(server, args.fetches, cache_bytes=0))
+    print("  etag cache on ", await reuse(server, args.fetches, cache_bytes=64 * 1024 * 1024))
+    print("rejects")
+    await rejects(server)
+    print("baseline (client.get)")
+    await baseline(server)
+    print("timeout")
+    await timeout(server)
+    server.httpd.shutdown()
+
+    if failures:
+        print(f"{len(failures)} check(s) failed")
+        sys.exit(1)
+    print("all checks passed")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
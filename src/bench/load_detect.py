@@ -0,0 +1,129 @@
+"""
+Load test for POST /api/health/detect.
+
+    # against a running server
+    python bench/load_detect.py --base-url http://localhost:74 --image-url https://.../leaf.jpg -n 200 -c 64
+
+    # in-process, with a stub model (fixed latency) and stub storage, no network or quota needed
+    python bench/load_detect.py --stub -n 200 -c 64 --model-latency 2.0
+
+Run from `src/`.
+"""
+import argparse
+import asyncio
+import glob
+import os
+import statistics
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api", "health", "file")
+
+
+def build_stub_app(model_latency: float):
+    os.environ.setdefault("GEMINI_API_KEY", "stub")
+    from fastapi import FastAPI
+    from api.health import providers
+    from api.health import router as health_router_module
+    from api.health.service import HealthService
+    from common.ai_model.ai_interface import AIModelInterface
+    from common.near_dup import NearDuplicateIndex
+
+    class StubModel(AIModelInterface):
+        model = "stub"
+
+        def generate_json_response(self, image_bytes, prompt, mime_type="image/jpeg"):
+            time.sleep(model_latency)
+            return self._result()
+
+        async def agenerate_json_response(self, image_bytes, prompt, mime_type="image/jpeg"):
+            await asyncio.sleep(model_latency)
+            return self._result()
+
+        @staticmethod
+        def _result():
+            dets = [{"label": "leaf_spot", "confidence": 0.8, "box_2d": [120, 250, 460, 620]}]
+            return dets, {"prediction": "stub", "severity_level": "Thấp"}
+
+    class StubStorage:
+        def generate_file_key(self, name):
+            return f"{time.time_ns()}.{name}"
+
+        def upload_resize_image(self, file_key, data):
+            return file_key
+
+        def get_presigned_url(self, file_key, size="medium", expires_in=0):
+            return f"http://stub/{size}/{file_key}"
+
+    samples = [open(p, "rb").read() for p in sorted(glob.glob(os.path.join(SAMPLE_DIR, "*.png")))[:4]]
+    counter = iter(range(10**9))
+
+    def serve_image(request: httpx.Request) -> httpx.Response:
+        # trailing bytes after the PNG IEND chunk are ignored by decoders but defeat the cache
+        i = next(counter)
+        body = samples[i % len(samples)] + str(i).encode()
+        return httpx.Response(200, content=body, headers={"content-type": "image/png"})
+
+    # near-duplicate reuse off: the served images only differ by trailing bytes and would all match
+    service = HealthService(storage=StubStorage(), model=StubModel(), near_dups=NearDuplicateIndex(max_entries=0))
+    service._http = httpx.AsyncClient(transport=httpx.MockTransport(serve_image))
+    providers.start(service)
+
+    app = FastAPI()
+    app.include_router(health_router_module.router)
+    return app
+
+
+async def run(args) -> None:
+    if args.stub:
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=build_stub_app(args.model_latency)), base_url="http://bench", timeout=None)
+        image_url = "http://images/leaf.png"
+    else:
+        client = httpx.AsyncClient(base_url=args.base_url, timeout=None, limits=httpx.Limits(max_connections=args.concurrency))
+        image_url = args.image_url
+
+    gate = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    errors = 0
+
+    async def one():
+        nonlocal errors
+        async with gate:
+            t0 = time.perf_counter()
+            r = await client.post("/api/health/detect", json={"image_url": image_url})
+            latencies.append(time.perf_counter() - t0)
+            if r.status_code != 200:
+                errors += 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(args.requests)))
+    wall = time.perf_counter() - t0
+    await client.aclose()
+
+    latencies.sort()
+    q = statistics.quantiles(latencies, n=100)
+    print(f"requests={args.requests} concurrency={args.concurrency} errors={errors}")
+    print(f"wall={wall:.2f}s throughput={args.requests / wall:.1f} req/s")
+    print(f"p50={q[49]:.3f}s p95={q[94]:.3f}s p99={q[98]:.3f}s max={latencies[-1]:.3f}s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:74")
+    parser.add_argument("--image-url", default="")
+    parser.add_argument("--stub", action="store_true", help="in-process app with stub model and storage")
+    parser.add_argument("--model-latency", type=float, default=2.0)
+    parser.add_argument("-n", "--requests", type=int, default=200)
+    parser.add_argument("-c", "--concurrency", type=int, default=64)
+    args = parser.parse_args()
+    if not args.stub and not args.image_url:
+        parser.error("--image-url is required unless --stub is used")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+ModelPool against the local fake Gemini server (bench/fake_gemini_server.py), started in-process:
+one key without hedging vs --keys keys vs --keys keys with hedging, under the same per-key rate
+limit, error rate and slow tail. Prints a JSON report (latency quantiles, errors, server-side 429/503
+counts, hedges fired/won).
+
+    python bench/model_pool_bench.py -n 300 -c 16 --keys 3 --rpm 120 --slow-rate 0.05
+
+Run from `src/`.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+from typing import Any, Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "bench")
+
+import uvicorn  # noqa: E402
+
+from bench.fake_gemini_server import build_app  # noqa: E402
+from common.ai_model.implements.gemini import GeminiModel  # noqa: E402
+from common.ai_model.pool import ModelPool  # noqa: E402
+from common.metrics import MODEL_HEDGES  # noqa: E402
+
+
+def start_server(app, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def hedge_counts() -> Dict[str, float]:
+    return {dict(key)["outcome"]: value for key, value in MODEL_HEDGES._values.items()}
+
+
+async def run_scenario(pool: ModelPool, requests: int, concurrency: int, warmup: int) -> Dict[str, Any]:
+    gate = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(record: bool) -> None:
+        nonlocal errors
+        async with gate:
+            t0 = time.perf_counter()
+            try:
+                await pool.agenerate_json_response(b"\xff\xd8fake", "prompt", "image/jpeg")
+            except Exception:
+                if record:
+                    errors += 1
+                return
+            if record:
+                latencies.append(time.perf_counter() - t0)
+
+    # warm-up fills the latency window the hedge delay is computed from
+    await asyncio.gather(*(one(False) for _ in range(warmup)))
+    hedges_before = hedge_counts()
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(True) for _ in range(requests)))
+    wall = time.perf_counter() - t0
+    hedges = {k: v - hedges_before.get(k, 0) for k, v in hedge_counts().items()}
+
+    latencies.sort()
+    q = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) >= 2 else [latencies[0] if latencies else 0.0] * 99
+    return {
+        "requests": requests,
+        "errors": errors,
+        "rps": round(requests / wall, 2),
+        "latency_s": {"p50": round(q[49], 3), "p95": round(q[94], 3), "p99": round(q[98], 3), "max": round(latencies[-1], 3) if latencies else 0.0},
+        "hedges": hedges,
+    }
+
+
+async def run(args) -> Dict[str, Any]:
+    results = {}
+    scenarios = [("single_key", 1, False), ("pool", args.keys, False), ("pool_hedged", args.keys, True)]
+    for name, keys, hedge in scenarios:
+        # a fresh server per scenario so rate-limit windows do not carry over
+        app = build_app(args.rpm, args.error_rate, args.median_latency, args.sigma, args.slow_rate, args.slow_latency, seed=1)
+        port = free_port()
+        server = start_server(app, port)
+        try:
+            models = [GeminiModel("gemini-2.5-flash", api_key=f"key-{i}", base_url=f"http://127.0.0.1:{port}") for i in range(keys)]
+            pool = ModelPool(
+                models, rpm=args.rpm, burst=args.burst, max_attempts=args.attempts,
+                backoff_base=0.1, backoff_max=2.0, hedge=hedge, hedge_min_delay=args.hedge_min_delay, hedge_min_samples=20,
+            )
+            results[name] = await run_scenario(pool, args.requests, args.concurrency, warmup=args.warmup)
+            results[name]["keys"] = keys
+            results[name]["server"] = dict(app.state.stats)
+        finally:
+            server.should_exit = True
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--requests", type=int, default=200)
+    parser.add_argument("-c", "--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--keys", type=int, default=3)
+    parser.add_argument("--rpm", type=int, default=0, help="per-key limit enforced by the server and the pool")
+    parser.add_argument("--burst", type=int, default=5)
+    parser.add_argument("--attempts", type=int, default=3)
+    parser.add_argument("--error-rate", type=float, default=0.02)
+    parser.add_argument("--median-latency", type=float, default=0.3)
+    parser.add_argument("--sigma", type=float, default=0.3)
+    parser.add_argument("--slow-rate", type=float, default=0.03)
+    parser.add_argument("--slow-latency", type=float, default=3.0)
+    parser.add_argument("--hedge-min-delay", type=float, default=0.2)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Pre-screen cost and verdicts: screen_image on the sample uploads (api/health/file/) and on
+upscaled camera-sized copies, then on degraded variants (blurred, underexposed, overexposed,
+thumbnail, grey non-plant) that should be rejected. Prints a JSON report with per-image
+milliseconds and how many images each reason code caught.
+
+The pre-screen runs on the image load_model_image already decoded for the model, so its own
+cost is `prescreen`; `decode` (paid with or without the pre-screen) is reported for scale.
+
+    python bench/prescreen_bench.py [--repeat 5]
+
+Run from `src/`.
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+from collections import Counter, defaultdict
+from io import BytesIO
+from typing import Any, Callable, Dict, List
+
+from PIL import Image, ImageEnhance, ImageFilter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.ai_model.preprocess import load_model_image  # noqa: E402
+from common.ai_model.prescreen import screen_image  # noqa: E402
+
+SAMPLES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api", "health", "file")
+CAMERA_SIZE = (4032, 3024)
+
+
+def jpeg(img: Image.Image, quality: int = 90) -> bytes:
+    out = BytesIO()
+    img.convert("RGB").save(out, format="JPEG", quality=quality)
+    return out.getvalue()
+
+
+def screen_bytes(data: bytes) -> Dict[str, Any]:
+    return screen_image(*load_model_image(data))
+
+
+def degraded(img: Image.Image) -> Dict[str, bytes]:
+    W, H = img.size
+    return {
+        "blurred": jpeg(img.filter(ImageFilter.GaussianBlur(max(W, H) / 512 * 4))),
+        "underexposed": jpeg(ImageEnhance.Brightness(img).enhance(0.08)),
+        "overexposed": jpeg(ImageEnhance.Brightness(img).enhance(6.0)),
+        "thumbnail": jpeg(img.resize((max(1, W * 120 // max(W, H)), max(1, H * 120 // max(W, H))))),
+        "grey": jpeg(img.convert("L")),
+    }
+
+
+def time_ms(fn: Callable[..., Any], args: tuple, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def quantiles(values: List[float]) -> Dict[str, float]:
+    values = sorted(values)
+    q = statistics.quantiles(values, n=100, method="inclusive") if len(values) >= 2 else values * 99
+    return {"n": len(values), "p50": round(q[49], 2), "p95": round(q[94], 2), "max": round(values[-1], 2)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per image (best is kept)")
+    args = parser.parse_args()
+
+    samples = {}
+    for path in sorted(glob.glob(os.path.join(SAMPLES_DIR, "*"))):
+        with open(path, "rb") as f:
+            samples[os.path.basename(path)] = f.read()
+
+    timings: Dict[str, List[float]] = defaultdict(list)
+    false_rejects: List[Dict[str, Any]] = []
+    caught: Dict[str, Counter] = {}
+    for name, data in samples.items():
+        img = Image.open(BytesIO(data)).convert("RGB")
+        camera = jpeg(img.resize(CAMERA_SIZE if img.width >= img.height else CAMERA_SIZE[::-1], resample=Image.BILINEAR))
+        for kind, image_bytes in (("samples", data), ("camera_jpeg", camera)):
+            decoded = load_model_image(image_bytes)
+            timings[f"prescreen.{kind}"].append(time_ms(screen_image, decoded, args.repeat))
+            timings[f"decode.{kind}"].append(time_ms(load_model_image, (image_bytes,), args.repeat))
+
+        verdict = screen_bytes(data)
+        if not verdict["passed"]:
+            false_rejects.append({"image": name, "reasons": verdict["reasons"]})
+
+        for variant, variant_bytes in degraded(img).items():
+            codes = [r["code"] for r in screen_bytes(variant_bytes)["reasons"]]
+            caught.setdefault(variant, Counter())["rejected" if codes else "passed"] += 1
+            caught[variant].update(codes)
+
+    report = {
+        "ms_per_image": {k: quantiles(v) for k, v in sorted(timings.items())},
+        "samples": len(samples),
+        "false_rejects": false_rejects,
+        "degraded": {k: dict(v) for k, v in caught.items()},
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
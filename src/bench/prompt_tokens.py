@@ -0,0 +1,118 @@
+"""
+Tokens per diagnosis for each request shape:
+
+    legacy        long prompt describing the JSON in prose, sent inline, no response schema
+    schema        short prompt + declared response schema (api/health/schema.py), sent inline
+    schema_cached schema, with GEMINI prompt caching on: the prompt goes out as cached content
+                  only if count_tokens puts it at GEMINI_PROMPT_CACHE_MIN_TOKENS or more; the
+                  default SCHEMA_PROMPT is far below that, so this shape is sent exactly like
+                  `schema` and `prompt_cache` reports "skipped"
+
+For each shape: the prompt and the response schema measured with count_tokens, the per-call
+usage_metadata totals, and what became of the prompt cache. With --live the calls go to the real
+Gemini API (uses GEMINI_API_KEY, a few calls of quota) and every number is the API's own. Without
+it they go to bench/fake_gemini_server.py, whose counts are estimates (~4 chars/token) good only
+for comparing shapes with each other, never to quote.
+
+    python bench/prompt_tokens.py [--live] [--image api/health/file/<name>] [-n 3]
+
+Run from `src/`.
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import sys
+import time
+from typing import Any, Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "bench")
+
+from api.health.schema import model_response_schema  # noqa: E402
+from api.health.service import LEGACY_PROMPT, SCHEMA_PROMPT  # noqa: E402
+from common import config  # noqa: E402
+from common.ai_model.implements.gemini import GeminiModel  # noqa: E402
+from common.ai_model.preprocess import prepare_model_image  # noqa: E402
+from common.metrics import MODEL_TOKENS  # noqa: E402
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api", "health", "file")
+
+
+def token_totals() -> Dict[str, float]:
+    return {dict(key)["kind"]: value for key, value in MODEL_TOKENS._values.items()}
+
+
+async def counted(model: GeminiModel, text: str) -> int:
+    return (await model.client.aio.models.count_tokens(model=model.model, contents=text)).total_tokens
+
+
+async def measure(model: GeminiModel, prompt: str, image: bytes, mime: str, n: int, schema_tokens: int) -> Dict[str, Any]:
+    before = token_totals()
+    latencies = []
+    detections = 0
+    for _ in range(n):
+        t0 = time.perf_counter()
+        dets, _ = await model.agenerate_json_response(image, prompt, mime)
+        latencies.append(time.perf_counter() - t0)
+        detections += len(dets)
+    after = token_totals()
+    per_call = {kind: round((after.get(kind, 0) - before.get(kind, 0)) / n, 1) for kind in ("prompt", "cached", "output", "total")}
+    cache = "off"
+    if model.cache_prompt:
+        name = model._prompt_caches.get(model._cache_key(prompt), (None, 0))[0]
+        cache = name or f"skipped (below {config.GEMINI_PROMPT_CACHE_MIN_TOKENS} tokens, or refused)"
+    return {
+        "prompt_chars": len(prompt),
+        "count_tokens": {"prompt": await counted(model, prompt), "schema": schema_tokens if model.response_schema else 0},
+        "prompt_cache": cache,
+        "tokens_per_call": per_call,
+        "uncached_prompt_tokens": round(per_call["prompt"] - per_call["cached"], 1),
+        "latency_s": round(sum(latencies) / n, 3),
+        "detections": detections,
+    }
+
+
+async def run(args) -> Dict[str, Any]:
+    image_path = args.image or sorted(glob.glob(os.path.join(SAMPLE_DIR, "*.jpg")))[0]
+    with open(image_path, "rb") as f:
+        image, mime = prepare_model_image(f.read())
+
+    server = None
+    base_url = None
+    if not args.live:
+        from bench.fake_gemini_server import build_app
+        from bench.model_pool_bench import free_port, start_server
+
+        port = free_port()
+        server = start_server(build_app(median_latency=0.05), port)
+        base_url = f"http://127.0.0.1:{port}"
+
+    schema = model_response_schema()
+    shapes = {
+        "legacy": (GeminiModel(base_url=base_url), LEGACY_PROMPT),
+        "schema": (GeminiModel(base_url=base_url, response_schema=schema), SCHEMA_PROMPT),
+        "schema_cached": (GeminiModel(base_url=base_url, response_schema=schema, cache_prompt=True, cache_ttl=600), SCHEMA_PROMPT),
+    }
+    try:
+        # counted before any call: the SDK rewrites the schema dict it is given in place
+        schema_tokens = await counted(shapes["schema"][0], json.dumps(schema, ensure_ascii=False))
+        results = {name: await measure(model, prompt, image, mime, args.n, schema_tokens) for name, (model, prompt) in shapes.items()}
+    finally:
+        if server is not None:
+            server.should_exit = True
+    return {"live": args.live, "image": os.path.basename(image_path), "image_bytes": len(image), "shapes": results}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--live", action="store_true", help="call the real Gemini API")
+    parser.add_argument("--image")
+    parser.add_argument("-n", type=int, default=3, help="calls per shape")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
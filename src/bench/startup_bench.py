@@ -0,0 +1,143 @@
+"""
+Start-up cost of the API: how long `import main` takes in a fresh interpreter, and how long a
+freshly spawned uvicorn worker takes to answer its first requests.
+
+For each run a new `uvicorn main:app --workers 1` process is started against the local fake
+Gemini server (bench/fake_gemini_server.py, zero latency) and STORAGE_BACKEND=local, then:
+    listening       spawn -> first 200 from GET /metrics
+    first_detect    spawn -> first 200 from POST /api/health/detect/upload (a sample image)
+    detect          latency of that first detect request alone
+    second_detect   latency of the same request sent again (caches are off, so the whole
+                    pipeline runs again): detect - second_detect is the cold-start penalty
+With --ready, GET /api/health/ready is awaited before the detect request, the way a readiness
+probe holds traffic back until the pools are warm.
+
+    python bench/startup_bench.py [--runs 5] [--ready]
+
+Run from `src/`.
+"""
+import argparse
+import glob
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLES_DIR = os.path.join(SRC_DIR, "api", "health", "file")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def import_ms(env: Dict[str, str]) -> float:
+    code = "import time; t = time.perf_counter(); import main; print((time.perf_counter() - t) * 1000)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=SRC_DIR, env=env, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def wait_for(send, deadline: float) -> Optional[httpx.Response]:
+    while time.monotonic() < deadline:
+        try:
+            resp = send()
+            if resp.status_code == 200:
+                return resp
+        except httpx.TransportError:
+            pass
+        time.sleep(0.01)
+    return None
+
+
+def one_run(env: Dict[str, str], image: bytes, ready: bool) -> Dict[str, float]:
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    t0 = time.monotonic()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", "1", "--log-level", "warning"],
+        cwd=SRC_DIR, env=env,
+    )
+    try:
+        with httpx.Client(timeout=60) as client:
+            if wait_for(lambda: client.get(f"{base}/metrics"), t0 + 60) is None:
+                raise RuntimeError("server did not start")
+            listening = time.monotonic() - t0
+            if ready and wait_for(lambda: client.get(f"{base}/api/health/ready"), t0 + 60) is None:
+                raise RuntimeError("server did not become ready")
+            times = [time.monotonic()]
+            for _ in range(2):
+                resp = client.post(f"{base}/api/health/detect/upload", files={"file": ("leaf.png", image, "image/png")})
+                resp.raise_for_status()
+                times.append(time.monotonic())
+        return {
+            "listening_ms": listening * 1000,
+            "first_detect_ms": (times[1] - t0) * 1000,
+            "detect_ms": (times[1] - times[0]) * 1000,
+            "second_detect_ms": (times[2] - times[1]) * 1000,
+        }
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def summary(values: List[float]) -> Dict[str, float]:
+    return {"median": round(statistics.median(values), 1), "min": round(min(values), 1), "max": round(max(values), 1)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--ready", action="store_true", help="wait for /api/health/ready before the first detect")
+    args = parser.parse_args()
+
+    fake_port = free_port()
+    workdir = tempfile.mkdtemp(prefix="startup-bench-")
+    env = dict(
+        os.environ,
+        PYTHONPATH=SRC_DIR,
+        GEMINI_API_KEY=os.environ.get("GEMINI_API_KEY", "bench"),
+        GEMINI_BASE_URL=f"http://127.0.0.1:{fake_port}",
+        GEMINI_PROMPT_CACHE="0",
+        STORAGE_BACKEND="local",
+        STORAGE_DIR=os.path.join(workdir, "objects"),
+        DIAGNOSIS_CACHE_BACKEND="memory",
+        DIAGNOSIS_CACHE_MAX_ENTRIES="0",
+        NEAR_DUP_MAX_ENTRIES="0",
+    )
+    samples = set(os.listdir(SAMPLES_DIR))
+    fake = subprocess.Popen(
+        [sys.executable, os.path.join(SRC_DIR, "bench", "fake_gemini_server.py"), "--port", str(fake_port), "--median-latency", "0", "--sigma", "0"],
+        cwd=SRC_DIR, env=env,
+    )
+    try:
+        with httpx.Client() as client:
+            wait_for(lambda: client.get(f"http://127.0.0.1:{fake_port}/docs"), time.monotonic() + 30)
+        with open(sorted(glob.glob(os.path.join(SAMPLES_DIR, "*.png")))[0], "rb") as f:
+            image = f.read()
+
+        imports = [import_ms(env) for _ in range(args.runs)]
+        runs = [one_run(env, image, args.ready) for _ in range(args.runs)]
+    finally:
+        fake.terminate()
+        fake.wait()
+        # the upload route stores the sample next to the others under its sha256 name
+        for name in set(os.listdir(SAMPLES_DIR)) - samples:
+            os.remove(os.path.join(SAMPLES_DIR, name))
+
+    report = {"runs": args.runs, "ready_probe": args.ready, "import_main_ms": summary(imports)}
+    for key in ("listening_ms", "first_detect_ms", "detect_ms", "second_detect_ms"):
+        report[key] = summary([r[key] for r in runs])
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
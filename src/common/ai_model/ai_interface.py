@@ -1,7 +1,25 @@
+import json
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from common.executor import run_io
 
 class AIModelInterface(ABC):
     @abstractmethod
-    def generate_json_response(self, image_bytes: bytes, prompt) -> Tuple[List[dict], Dict[str, Any]]:
+    def generate_json_response(self, image_bytes: bytes, prompt, mime_type: str = "image/jpeg") -> Tuple[List[dict], Dict[str, Any]]:
         pass
+
+    async def agenerate_json_response(self, image_bytes: bytes, prompt, mime_type: str = "image/jpeg") -> Tuple[List[dict], Dict[str, Any]]:
+        """
+        Async variant used by the request path. Models with a native async client should
+        override this; the default runs the blocking call on the I/O executor.
+        """
+        return await run_io(self.generate_json_response, image_bytes, prompt, mime_type)
+
+    async def astream_json_response(self, image_bytes: bytes, prompt, mime_type: str = "image/jpeg") -> AsyncIterator[str]:
+        """
+        Yield the raw JSON text as the model produces it. The default yields the whole
+        response at once; streaming-capable models should override this.
+        """
+        detections, analysis = await self.agenerate_json_response(image_bytes, prompt, mime_type)
+        yield json.dumps({"detections": detections, "analysis_vn": analysis}, ensure_ascii=False)
@@ -1,37 +1,234 @@
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from common import config
 from common.ai_model.ai_interface import AIModelInterface
+from common.ai_model.pool import ModelPool, build_model_pool
 from common.utils import parse_detections
-import os 
+from common.metrics import timed, count_tokens
+import asyncio
+import hashlib
+import logging as log
+import os
+import threading
+import time
 from google import genai
-from google.genai import types
+from google.genai import errors, types
 
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# cached content that vanished before its TTL (deleted, or expired early) is answered with these
+CACHE_GONE_CODES = (403, 404)
+
+
 class GeminiModel(AIModelInterface):
-    def __init__(self, model_name: str = "gemini-2.5-flash"):
-        api_key = os.getenv("GEMINI_API_KEY")
+    def __init__(
+        self,
+        model_name: str = "gemini-2.5-flash",
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        response_schema: Any = None,
+        cache_prompt: bool = False,
+        cache_ttl: int = 3600,
+    ):
+        api_key = api_key or os.getenv("GEMINI_API_KEY")
         if not api_key:
             raise ValueError("GEMINI_API_KEY environment variable is not set.")
-        
-        self.client = genai.Client(api_key=api_key)
+
+        http_options = types.HttpOptions(timeout=config.MODEL_TIMEOUT_MS)
+        if base_url:
+            http_options.base_url = base_url
+        self.client = genai.Client(api_key=api_key, http_options=http_options)
         self.model = model_name
-    
-    def generate_json_response(self, image_bytes: bytes, PROMPT) -> Tuple[List[dict], Dict[str, Any]]:
-        image_part = types.Part.from_bytes(data=image_bytes, mime_type="image/jpeg")
-
-        resp = self.client.models.generate_content(
-            model=self.model,
-            contents=[PROMPT, image_part],
-            config=types.GenerateContentConfig(
-                response_mime_type="application/json",
-                thinking_config=types.ThinkingConfig(thinking_budget=0),
-                max_output_tokens=99999,
-            ),
+        self.response_schema = response_schema
+        self.cache_prompt = cache_prompt
+        self.cache_ttl = cache_ttl
+        # prompt hash -> (cached content name, or None if the prompt cannot be cached; refresh time)
+        self._prompt_caches: Dict[str, Tuple[Optional[str], float]] = {}
+        self._cache_lock = threading.Lock()
+        self._acache_lock: Optional[asyncio.Lock] = None
+
+    def _config(self, prompt: str, cached_content: Optional[str]) -> types.GenerateContentConfig:
+        return types.GenerateContentConfig(
+            # the static prompt is either inside the cached content or sent as system instruction
+            system_instruction=None if cached_content else prompt,
+            cached_content=cached_content,
+            response_mime_type="application/json",
+            response_schema=self.response_schema,
+            thinking_config=types.ThinkingConfig(thinking_budget=0),
+            max_output_tokens=config.MODEL_MAX_OUTPUT_TOKENS,
+        )
+
+    # prompt caching
+
+    def _cache_key(self, prompt: str) -> str:
+        return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+    def _cached_name(self, key: str) -> Tuple[bool, Optional[str]]:
+        """
+        (known, name): `known` is False when the cache must be (re)created.
+        """
+        entry = self._prompt_caches.get(key)
+        if entry is None or entry[1] < time.time():
+            return False, None
+        return True, entry[0]
+
+    def _cache_config(self, prompt: str) -> types.CreateCachedContentConfig:
+        return types.CreateCachedContentConfig(
+            system_instruction=prompt,
+            ttl=f"{self.cache_ttl}s",
+            display_name="diagnosis-prompt",
+        )
+
+    def _remember(self, key: str, name: Optional[str], exc: Optional[errors.APIError] = None) -> None:
+        refresh_at = time.time() + max(60, self.cache_ttl - 60)  # a minute before the server drops it
+        if name is None:
+            log.warning("prompt caching unavailable for %s, sending the prompt inline: %s", self.model, exc)
+            if exc is not None and exc.code == 400:
+                # e.g. the prompt is below the model's minimum cacheable size: that will not change
+                refresh_at = float("inf")
+        self._prompt_caches[key] = (name, refresh_at)
+
+    def _below_minimum(self, key: str, tokens: Optional[int]) -> bool:
+        """
+        True, and remembered for good, when the prompt is too short for cached content: the API
+        would answer caches.create with a 400. Only the prompt is counted, the response schema is
+        sent with each call and is not part of the cached content.
+        """
+        if tokens is None or tokens >= config.GEMINI_PROMPT_CACHE_MIN_TOKENS:
+            return False
+        log.info(
+            "prompt of %d tokens is below the %d %s caches, sending it inline",
+            tokens, config.GEMINI_PROMPT_CACHE_MIN_TOKENS, self.model,
         )
-        raw = resp.text
-        return parse_detections(raw)
+        self._prompt_caches[key] = (None, float("inf"))
+        return True
 
+    def _prompt_cache(self, prompt: str) -> Optional[str]:
+        if not self.cache_prompt:
+            return None
+        key = self._cache_key(prompt)
+        known, name = self._cached_name(key)
+        if known:
+            return name
+        with self._cache_lock:
+            known, name = self._cached_name(key)
+            if not known:
+                try:
+                    tokens = self.client.models.count_tokens(model=self.model, contents=prompt).total_tokens
+                except errors.APIError:
+                    tokens = None  # let caches.create decide
+                if self._below_minimum(key, tokens):
+                    return None
+                try:
+                    name = self.client.caches.create(model=self.model, config=self._cache_config(prompt)).name
+                    self._remember(key, name)
+                except errors.APIError as exc:
+                    name = None
+                    self._remember(key, None, exc)
+        return name
 
-geminiModel = GeminiModel()
+    async def _aprompt_cache(self, prompt: str) -> Optional[str]:
+        if not self.cache_prompt:
+            return None
+        key = self._cache_key(prompt)
+        known, name = self._cached_name(key)
+        if known:
+            return name
+        if self._acache_lock is None:
+            self._acache_lock = asyncio.Lock()
+        async with self._acache_lock:
+            known, name = self._cached_name(key)
+            if not known:
+                try:
+                    tokens = (await self.client.aio.models.count_tokens(model=self.model, contents=prompt)).total_tokens
+                except errors.APIError:
+                    tokens = None
+                if self._below_minimum(key, tokens):
+                    return None
+                try:
+                    cached = await self.client.aio.caches.create(model=self.model, config=self._cache_config(prompt))
+                    name = cached.name
+                    self._remember(key, name)
+                except errors.APIError as exc:
+                    name = None
+                    self._remember(key, None, exc)
+        return name
+
+    def _forget(self, prompt: str) -> None:
+        self._prompt_caches.pop(self._cache_key(prompt), None)
+
+    # calls
+
+    def generate_json_response(self, image_bytes: bytes, PROMPT, mime_type: str = "image/jpeg") -> Tuple[List[dict], Dict[str, Any]]:
+        image_part = types.Part.from_bytes(data=image_bytes, mime_type=mime_type)
+        cached = self._prompt_cache(PROMPT)
+        try:
+            resp = self.client.models.generate_content(model=self.model, contents=[image_part], config=self._config(PROMPT, cached))
+        except errors.APIError as exc:
+            if not cached or exc.code not in CACHE_GONE_CODES:
+                raise
+            self._forget(PROMPT)
+            resp = self.client.models.generate_content(model=self.model, contents=[image_part], config=self._config(PROMPT, None))
+        count_tokens(resp.usage_metadata)
+        with timed("parse"):
+            return parse_detections(resp.text)
+
+    async def agenerate_json_response(self, image_bytes: bytes, PROMPT, mime_type: str = "image/jpeg") -> Tuple[List[dict], Dict[str, Any]]:
+        image_part = types.Part.from_bytes(data=image_bytes, mime_type=mime_type)
+        cached = await self._aprompt_cache(PROMPT)
+        try:
+            resp = await self.client.aio.models.generate_content(model=self.model, contents=[image_part], config=self._config(PROMPT, cached))
+        except errors.APIError as exc:
+            if not cached or exc.code not in CACHE_GONE_CODES:
+                raise
+            self._forget(PROMPT)
+            resp = await self.client.aio.models.generate_content(model=self.model, contents=[image_part], config=self._config(PROMPT, None))
+        count_tokens(resp.usage_metadata)
+        with timed("parse"):
+            return parse_detections(resp.text)
+
+    async def astream_json_response(self, image_bytes: bytes, PROMPT, mime_type: str = "image/jpeg") -> AsyncIterator[str]:
+        image_part = types.Part.from_bytes(data=image_bytes, mime_type=mime_type)
+        cached = await self._aprompt_cache(PROMPT)
+
+        usage = None
+        try:
+            stream = await self.client.aio.models.generate_content_stream(model=self.model, contents=[image_part], config=self._config(PROMPT, cached))
+        except errors.APIError as exc:
+            if not cached or exc.code not in CACHE_GONE_CODES:
+                raise
+            self._forget(PROMPT)
+            stream = await self.client.aio.models.generate_content_stream(model=self.model, contents=[image_part], config=self._config(PROMPT, None))
+        async for chunk in stream:
+            if chunk.usage_metadata is not None and chunk.usage_metadata.total_token_count:
+                # the last chunk carries the totals for the whole response
+                usage = chunk.usage_metadata
+            if chunk.text:
+                yield chunk.text
+        count_tokens(usage)
+
+
+def api_keys() -> List[str]:
+    keys = [k.strip() for k in config.GEMINI_API_KEYS.split(",") if k.strip()]
+    if not keys:
+        key = os.getenv("GEMINI_API_KEY")
+        if not key:
+            raise ValueError("GEMINI_API_KEY environment variable is not set.")
+        keys = [key]
+    return keys
+
+
+def build_gemini_model(model_name: str = "gemini-2.5-flash", response_schema: Any = None) -> ModelPool:
+    """
+    One GeminiModel per key in GEMINI_API_KEYS (or GEMINI_API_KEY), behind a ModelPool.
+    Cached prompts are per key, since cached content belongs to the key's project.
+    """
+    base_url = config.GEMINI_BASE_URL or None
+    return build_model_pool([
+        GeminiModel(
+            model_name, api_key=key, base_url=base_url, response_schema=response_schema,
+            cache_prompt=bool(config.GEMINI_PROMPT_CACHE), cache_ttl=config.GEMINI_PROMPT_CACHE_TTL,
+        )
+        for key in api_keys()
+    ])
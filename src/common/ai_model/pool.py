@@ -0,0 +1,399 @@
+import asyncio
+import logging as log
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from common import config
+from common.ai_model.ai_interface import AIModelInterface
+from common.metrics import MODEL_CALLS, MODEL_HEDGES
+
+
+class ModelUnavailable(Exception):
+    """
+    Every client in the pool has an open circuit or was told by the server to back off for
+    longer than the pool's maximum backoff.
+    """
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """
+    429, 5xx and transport failures are worth retrying; anything else (bad request, unparsable
+    output) would fail the same way again.
+    """
+    code = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    if isinstance(code, int):
+        return code == 429 or 500 <= code < 600
+    return isinstance(exc, (httpx.TransportError, asyncio.TimeoutError))
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    """
+    Server-requested delay in seconds: a Retry-After header or Google's RetryInfo detail.
+    """
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if headers is not None:
+        try:
+            return float(headers.get("retry-after"))
+        except (TypeError, ValueError):
+            pass
+    details = getattr(exc, "details", None)
+    if isinstance(details, dict):
+        for item in details.get("error", {}).get("details", []) or []:
+            delay = item.get("retryDelay") if isinstance(item, dict) else None
+            if isinstance(delay, str) and delay.endswith("s"):
+                try:
+                    return float(delay[:-1])
+                except ValueError:
+                    pass
+    return None
+
+
+class TokenBucket:
+    """
+    `rate` requests per second with bursts of up to `burst`. `reserve()` takes a token, possibly
+    one that only becomes available later, and returns how long the caller must wait for it.
+    A rate of 0 means unlimited.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        now = time.monotonic()
+        with self._lock:
+            blocked = max(0.0, self.blocked_until - now)
+            if self.rate <= 0:
+                return blocked
+            self._refill(now)
+            return max(blocked, (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0)
+
+    def reserve(self) -> float:
+        now = time.monotonic()
+        with self._lock:
+            blocked = max(0.0, self.blocked_until - now)
+            if self.rate <= 0:
+                return blocked
+            self._refill(now)
+            self.tokens -= 1
+            return max(blocked, -self.tokens / self.rate if self.tokens < 0 else 0.0)
+
+    def blocked_for(self) -> float:
+        return max(0.0, self.blocked_until - time.monotonic())
+
+    def pause(self, seconds: float) -> None:
+        """
+        Hold every request for `seconds`, e.g. after the server answered 429.
+        """
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive retryable failures; after `reset_timeout` seconds one
+    trial call is let through (half-open) and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failures: int = 5, reset_timeout: float = 30.0):
+        self.threshold = failures
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open":
+                return time.monotonic() >= self.opened_at + self.reset_timeout
+            return not self._trial
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "open" and time.monotonic() >= self.opened_at + self.reset_timeout:
+                self.state = "half_open"
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._trial = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.threshold:
+                if self.state != "open":
+                    log.warning("model circuit opened after %d failures", self.failures)
+                self.state = "open"
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+    def release(self) -> None:
+        """
+        The call ended without telling anything about the client's health (cancelled, bad input).
+        """
+        with self._lock:
+            self._trial = False
+
+
+class PoolMember:
+    def __init__(self, name: str, model: AIModelInterface, bucket: TokenBucket, breaker: CircuitBreaker):
+        self.name = name
+        self.model = model
+        self.bucket = bucket
+        self.breaker = breaker
+        self.in_flight = 0
+
+
+class ModelPool(AIModelInterface):
+    """
+    Spreads calls over several model clients (typically one per API key), each with its own
+    token bucket and circuit breaker. A call goes to the least-loaded client that can send now,
+    is retried with jittered exponential backoff on 429/5xx (on another client when possible) and,
+    with `hedge`, a second request is fired on another client once the first has been running
+    longer than the recent p95 latency; the first to finish wins and the other is cancelled.
+    """
+
+    def __init__(
+        self,
+        models: List[AIModelInterface],
+        rpm: int = 0,
+        burst: int = 5,
+        max_attempts: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        breaker_failures: int = 5,
+        breaker_reset: float = 30.0,
+        hedge: bool = False,
+        hedge_min_delay: float = 1.0,
+        hedge_min_samples: int = 20,
+    ):
+        if not models:
+            raise ValueError("ModelPool needs at least one model")
+        self.members = [
+            PoolMember(f"client{i}", model, TokenBucket(rpm / 60, burst), CircuitBreaker(breaker_failures, breaker_reset))
+            for i, model in enumerate(models)
+        ]
+        self.model = getattr(models[0], "model", "pool")
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.latencies: deque = deque(maxlen=256)
+        self._lock = threading.Lock()
+
+    # dispatch
+
+    def _pick(self, tried: List[PoolMember]) -> PoolMember:
+        while True:
+            # a client the server asked to back off for minutes is skipped, not waited for
+            open_members = [m for m in self.members if m.breaker.available() and m.bucket.blocked_for() <= self.backoff_max]
+            if not open_members:
+                raise ModelUnavailable("No model client available (open circuits or rate limited)")
+            # prefer clients not tried yet for this call, then those that can send now, then the least busy
+            fresh = [m for m in open_members if m not in tried] or open_members
+            member = min(fresh, key=lambda m: (m.bucket.wait_time() > 0, m.in_flight, m.bucket.wait_time()))
+            if member.breaker.allow():
+                return member
+
+    def _begin(self, member: PoolMember, tried: List[PoolMember]) -> None:
+        with self._lock:
+            member.in_flight += 1
+        tried.append(member)
+
+    def _end(self, member: PoolMember, started: float, exc: Optional[BaseException]) -> None:
+        with self._lock:
+            member.in_flight -= 1
+        if exc is None:
+            member.breaker.record_success()
+            self.latencies.append(time.monotonic() - started)
+            outcome = "ok"
+        elif isinstance(exc, (asyncio.CancelledError, GeneratorExit)):
+            member.breaker.release()
+            outcome = "cancelled"
+        elif is_retryable(exc):
+            member.breaker.record_failure()
+            delay = retry_after(exc)
+            if delay:
+                member.bucket.pause(delay)
+            outcome = "retryable"
+        else:
+            member.breaker.release()
+            outcome = "error"
+        MODEL_CALLS.inc(client=member.name, outcome=outcome)
+
+    def _backoff(self, attempt: int) -> float:
+        # full jitter: spreads the retries of concurrent callers instead of synchronising them
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def hedge_delay(self) -> Optional[float]:
+        if not self.hedge or len(self.members) < 2 or len(self.latencies) < self.hedge_min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        return max(self.hedge_min_delay, p95)
+
+    # calls
+
+    async def _call(self, call: Callable[[AIModelInterface], Awaitable[Any]], tried: List[PoolMember]) -> Any:
+        for attempt in range(self.max_attempts):
+            member = self._pick(tried)
+            wait = member.bucket.reserve()
+            if wait:
+                await asyncio.sleep(wait)
+            self._begin(member, tried)
+            started = time.monotonic()
+            try:
+                result = await call(member.model)
+            except BaseException as exc:
+                self._end(member, started, exc)
+                if not isinstance(exc, Exception) or not is_retryable(exc) or attempt == self.max_attempts - 1:
+                    raise
+                log.warning("model call on %s failed (%s), retrying", member.name, exc)
+                await asyncio.sleep(self._backoff(attempt))
+            else:
+                self._end(member, started, None)
+                return result
+
+    async def _hedged(self, call: Callable[[AIModelInterface], Awaitable[Any]]) -> Any:
+        tried: List[PoolMember] = []
+        delay = self.hedge_delay()
+        if delay is None:
+            return await self._call(call, tried)
+
+        first = asyncio.create_task(self._call(call, tried))
+        tasks = [first]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return first.result()
+            # only hedge when another client can take the request right away
+            if not any(m not in tried and m.breaker.available() and m.bucket.wait_time() == 0 for m in self.members):
+                return await first
+            MODEL_HEDGES.inc(outcome="fired")
+            tasks.append(asyncio.create_task(self._call(call, list(tried))))
+
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            MODEL_HEDGES.inc(outcome="won")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def generate_json_response(self, image_bytes: bytes, prompt, mime_type: str = "image/jpeg") -> Tuple[List[dict], Dict[str, Any]]:
+        # blocking variant: same dispatch and retries, no hedging
+        tried: List[PoolMember] = []
+        for attempt in range(self.max_attempts):
+            member = self._pick(tried)
+            wait = member.bucket.reserve()
+            if wait:
+                time.sleep(wait)
+            self._begin(member, tried)
+            started = time.monotonic()
+            try:
+                result = member.model.generate_json_response(image_bytes, prompt, mime_type)
+            except Exception as exc:
+                self._end(member, started, exc)
+                if not is_retryable(exc) or attempt == self.max_attempts - 1:
+                    raise
+                time.sleep(self._backoff(attempt))
+            else:
+                self._end(member, started, None)
+                return result
+
+    async def agenerate_json_response(self, image_bytes: bytes, prompt, mime_type: str = "image/jpeg") -> Tuple[List[dict], Dict[str, Any]]:
+        return await self._hedged(lambda model: model.agenerate_json_response(image_bytes, prompt, mime_type))
+
+    async def astream_json_response(self, image_bytes: bytes, prompt, mime_type: str = "image/jpeg") -> AsyncIterator[str]:
+        """
+        Retries (and dispatch) only happen before the first chunk: once text has been handed to
+        the caller, a failure is raised as is. Streams are not hedged.
+        """
+        tried: List[PoolMember] = []
+        for attempt in range(self.max_attempts):
+            member = self._pick(tried)
+            wait = member.bucket.reserve()
+            if wait:
+                await asyncio.sleep(wait)
+            self._begin(member, tried)
+            started = time.monotonic()
+            stream = member.model.astream_json_response(image_bytes, prompt, mime_type)
+            try:
+                first = await stream.__anext__()
+            except StopAsyncIteration:
+                self._end(member, started, None)
+                return
+            except BaseException as exc:
+                self._end(member, started, exc)
+                if not isinstance(exc, Exception) or not is_retryable(exc) or attempt == self.max_attempts - 1:
+                    raise
+                log.warning("model stream on %s failed (%s), retrying", member.name, exc)
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+
+            try:
+                yield first
+                async for chunk in stream:
+                    yield chunk
+            except BaseException as exc:
+                self._end(member, started, exc)
+                raise
+            else:
+                self._end(member, started, None)
+            finally:
+                await stream.aclose()
+            return
+
+
+def build_model_pool(models: List[AIModelInterface]) -> ModelPool:
+    """
+    Pool configured from the MODEL_* settings.
+    """
+    return ModelPool(
+        models,
+        rpm=config.MODEL_RPM_PER_KEY,
+        burst=config.MODEL_BURST,
+        max_attempts=config.MODEL_MAX_ATTEMPTS,
+        backoff_base=config.MODEL_BACKOFF_BASE_MS / 1000,
+        backoff_max=config.MODEL_BACKOFF_MAX_MS / 1000,
+        breaker_failures=config.MODEL_BREAKER_FAILURES,
+        breaker_reset=config.MODEL_BREAKER_RESET_MS / 1000,
+        hedge=bool(config.MODEL_HEDGE),
+        hedge_min_delay=config.MODEL_HEDGE_MIN_DELAY_MS / 1000,
+        hedge_min_samples=config.MODEL_HEDGE_MIN_SAMPLES,
+    )
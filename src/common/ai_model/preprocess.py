@@ -0,0 +1,85 @@
+from io import BytesIO
+from typing import Tuple
+
+from PIL import Image, ImageOps
+
+from common import config
+
+MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+    "PNG": "image/png",
+}
+
+
+def load_model_image(image_bytes: bytes, max_edge: int = config.MODEL_IMAGE_MAX_EDGE) -> Tuple[Image.Image, Tuple[int, int]]:
+    """
+    Decode an upload for the model: EXIF orientation applied, downsampled so the longest edge is
+    <= max_edge. Returns (image, original (width, height)). Palette and greyscale images become
+    RGB; transparency is kept until `encode_model_image` knows the output format.
+    """
+    img = Image.open(BytesIO(image_bytes))
+    original_size = img.size
+    # JPEG only: let libjpeg decode at 1/2, 1/4 or 1/8 scale when the image is much larger
+    img.draft("RGB", (max_edge, max_edge))
+    img = ImageOps.exif_transpose(img)
+
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img = img.convert("RGBA")
+    elif img.mode != "RGB":
+        img = img.convert("RGB")
+
+    W, H = img.size
+    scale = max_edge / max(W, H)
+    if scale < 1:
+        img = img.resize((max(1, round(W * scale)), max(1, round(H * scale))), resample=Image.BILINEAR, reducing_gap=2.0)
+    return img, original_size
+
+
+def encode_model_image(img: Image.Image, fmt: str = config.MODEL_IMAGE_FORMAT, quality: int = config.MODEL_IMAGE_QUALITY) -> Tuple[bytes, str]:
+    """
+    Encode a `load_model_image` result for the request. Returns (bytes, mime_type).
+    """
+    fmt = fmt.upper()
+    if fmt not in MIME_TYPES:
+        raise ValueError(f"Unsupported model image format: {fmt}")
+    if fmt == "JPEG":
+        img = flatten(img)
+
+    out = BytesIO()
+    # no exif/icc arguments: metadata is not carried over
+    if fmt == "PNG":
+        img.save(out, format=fmt, optimize=False)
+    else:
+        img.save(out, format=fmt, quality=quality)
+    return out.getvalue(), MIME_TYPES[fmt]
+
+
+def flatten(img: Image.Image) -> Image.Image:
+    """
+    RGB copy of an RGBA image composited on white; RGB images are returned as is.
+    """
+    if img.mode != "RGBA":
+        return img
+    out = Image.new("RGB", img.size, (255, 255, 255))
+    out.paste(img, mask=img.getchannel("A"))
+    return out
+
+
+def prepare_model_image(
+    image_bytes: bytes,
+    max_edge: int = config.MODEL_IMAGE_MAX_EDGE,
+    fmt: str = config.MODEL_IMAGE_FORMAT,
+    quality: int = config.MODEL_IMAGE_QUALITY,
+) -> Tuple[bytes, str]:
+    """
+    Normalize an upload before it is sent to the model: apply EXIF orientation, drop metadata,
+    downsample so the longest edge is <= max_edge and re-encode. Returns (bytes, mime_type).
+
+    Boxes come back normalized 0..1000, which is invariant to uniform scaling, so they stay valid
+    for the original image as long as `annotate_image` applies the same EXIF orientation.
+    """
+    if fmt.upper() not in MIME_TYPES:
+        raise ValueError(f"Unsupported model image format: {fmt}")
+    img, _ = load_model_image(image_bytes, max_edge)
+    return encode_model_image(img, fmt, quality)
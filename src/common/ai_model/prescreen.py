@@ -0,0 +1,73 @@
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+from common import config
+from common.ai_model.preprocess import flatten
+
+# the working copy's long edge is at most this; blur is judged at this scale
+SCREEN_EDGE = 512
+# a pixel counts as vegetation when its excess-green index 2g - r - b (chromatic coordinates) is
+# above this: green and yellowing leaf tissue pass, grey, skin and soil tones do not
+EXG_VEGETATION = 0.05
+# pixels darker than this (R+G+B) have too little signal for the colour test and are ignored
+EXG_MIN_SUM = 60
+
+
+def _working_copy(img: Image.Image) -> Image.Image:
+    """
+    RGB copy whose long edge is <= SCREEN_EDGE. An integer box `reduce` is several times
+    cheaper than a resample and is all the checks need.
+    """
+    factor = -(-max(img.size) // SCREEN_EDGE)
+    if factor > 1:
+        img = img.reduce(factor)
+    return flatten(img)
+
+
+def image_stats(img: Image.Image, original_size: Tuple[int, int]) -> Dict[str, float]:
+    """
+    Cheap quality measurements of an upload, taken on the image `load_model_image` decoded:
+    - min_edge: shorter side of the original image, in pixels
+    - sharpness: variance of the 4-neighbour Laplacian of the luma (low = blurred)
+    - dark / bright: share of pixels with luma <= 16 / >= 240
+    - green: share of pixels that look like vegetation (excess-green index)
+    """
+    small = _working_copy(img)
+    luma = np.asarray(small.convert("L"), dtype=np.int32)
+    r, g, b = (np.asarray(band, dtype=np.int16) for band in small.split())
+
+    lap = luma[:-2, 1:-1] + luma[2:, 1:-1] + luma[1:-1, :-2] + luma[1:-1, 2:] - 4 * luma[1:-1, 1:-1]
+    hist = np.bincount(luma.ravel(), minlength=256) / luma.size
+
+    # exg = (2G - R - B) / (R + G + B), compared without the division (int16 cannot overflow here)
+    total = r + g + b
+    vegetation = (total > EXG_MIN_SUM) & (2 * g - r - b > EXG_VEGETATION * total)
+    return {
+        "min_edge": float(min(original_size)),
+        "sharpness": float(lap.var()) if lap.size else 0.0,
+        "dark": float(hist[:17].sum()),
+        "bright": float(hist[240:].sum()),
+        "green": float(np.count_nonzero(vegetation) / luma.size),
+    }
+
+
+def screen_image(img: Image.Image, original_size: Tuple[int, int]) -> Dict[str, Any]:
+    """
+    {"passed": bool, "reasons": [{code, value, threshold}], "stats": image_stats(...)}.
+    Reason codes: too_small, blurry, too_dark, too_bright, no_plant. A threshold of 0 disables its check.
+    """
+    stats = image_stats(img, original_size)
+    reasons: List[Dict[str, Any]] = []
+
+    def check(code: str, failed: bool, value: float, threshold: float) -> None:
+        if threshold and failed:
+            reasons.append({"code": code, "value": round(value, 3), "threshold": threshold})
+
+    check("too_small", stats["min_edge"] < config.PRESCREEN_MIN_EDGE, stats["min_edge"], config.PRESCREEN_MIN_EDGE)
+    check("blurry", stats["sharpness"] < config.PRESCREEN_MIN_SHARPNESS, stats["sharpness"], config.PRESCREEN_MIN_SHARPNESS)
+    check("too_dark", stats["dark"] > config.PRESCREEN_MAX_DARK, stats["dark"], config.PRESCREEN_MAX_DARK)
+    check("too_bright", stats["bright"] > config.PRESCREEN_MAX_BRIGHT, stats["bright"], config.PRESCREEN_MAX_BRIGHT)
+    check("no_plant", stats["green"] < config.PRESCREEN_MIN_GREEN, stats["green"], config.PRESCREEN_MIN_GREEN)
+    return {"passed": not reasons, "reasons": reasons, "stats": {k: round(v, 3) for k, v in stats.items()}}
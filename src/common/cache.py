@@ -0,0 +1,255 @@
+import asyncio
+import hashlib
+import json
+import logging as log
+import os
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from common import config
+from common.executor import run_io
+from common.metrics import CACHE_EVENTS
+from common.utils import silent_remove
+
+
+def make_cache_key(image_bytes: bytes, model_name: str, prompt: str) -> str:
+    """
+    Content address of a diagnosis: sha256(image) + model name + sha256(prompt).
+    """
+    image_hash = hashlib.sha256(image_bytes).hexdigest()
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+    model = model_name.replace("/", "_")
+    return f"{image_hash}-{model}-{prompt_hash}"
+
+
+class MemoryTier:
+    """
+    In-process LRU with per-entry TTL.
+    """
+
+    blocking = False
+
+    def __init__(self, max_entries: int = 1024, ttl: int = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._data[key] = (time.time() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+
+class DiskTier:
+    """
+    One JSON file per key under `directory`; expiry is based on the file mtime.
+    """
+
+    blocking = True
+
+    def __init__(self, directory: str, max_entries: int = 50_000, ttl: int = 3600):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        try:
+            if os.path.getmtime(path) + self.ttl < time.time():
+                os.remove(path)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        path = self._path(key)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+        # size eviction is amortized: scan the directory every 256 writes (sets run on several
+        # executor threads, so exactly one of them gets each 256th count)
+        with self._writes_lock:
+            self._writes += 1
+            sweep = self._writes % 256 == 0
+        if sweep:
+            self._evict()
+
+    def _evict(self) -> None:
+        try:
+            entries = [e for e in os.scandir(self.directory) if e.name.endswith(".json")]
+        except OSError:
+            return
+        now = time.time()
+        alive = []
+        for e in entries:
+            mtime = e.stat().st_mtime
+            if mtime + self.ttl < now:
+                silent_remove(e.path)
+            else:
+                alive.append((mtime, e.path))
+        overflow = len(alive) - self.max_entries
+        if overflow > 0:
+            alive.sort()
+            for _, path in alive[:overflow]:
+                silent_remove(path)
+
+
+class MinioTier:
+    """
+    Stores entries as JSON objects under `cache/` in the MinIO bucket.
+    """
+
+    blocking = True
+
+    def __init__(self, minio, prefix: str = "cache", ttl: int = 3600):
+        self.minio = minio
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def _object_name(self, key: str) -> str:
+        return f"{self.prefix}/{key}.json"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        resp = None
+        try:
+            resp = self.minio.client.get_object(self.minio.bucket_name, self._object_name(key))
+            value = json.loads(resp.read())
+        except Exception:
+            return None
+        finally:
+            if resp is not None:
+                resp.close()
+                resp.release_conn()
+        if value.get("created_at", 0) + self.ttl < time.time():
+            return None
+        return value
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        self.minio.client.put_object(
+            self.minio.bucket_name,
+            self._object_name(key),
+            BytesIO(data),
+            length=len(data),
+            content_type="application/json",
+        )
+
+
+class DiagnosisCache:
+    """
+    Tiered cache (memory first, then an optional persistent tier) with single-flight:
+    concurrent misses on the same key await one computation instead of each calling the model.
+    Blocking tiers are accessed through the I/O executor.
+    """
+
+    def __init__(self, tiers: List[Any]):
+        self.tiers = tiers
+        self._flights: Dict[str, asyncio.Task] = {}
+
+    async def _tier_call(self, tier, method: str, *args):
+        fn = getattr(tier, method)
+        if tier.blocking:
+            return await run_io(fn, *args)
+        return fn(*args)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        for i, tier in enumerate(self.tiers):
+            try:
+                value = await self._tier_call(tier, "get", key)
+            except Exception as e:
+                log.warning("cache tier %s get failed: %s", type(tier).__name__, e)
+                continue
+            if value is not None:
+                # promote to the faster tiers
+                for faster in self.tiers[:i]:
+                    await self._tier_call(faster, "set", key, value)
+                return value
+        return None
+
+    async def set(self, key: str, value: Dict[str, Any]) -> None:
+        for tier in self.tiers:
+            try:
+                await self._tier_call(tier, "set", key, value)
+            except Exception as e:
+                log.warning("cache tier %s set failed: %s", type(tier).__name__, e)
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """
+        The cached value for `key`, or the result of `compute()`, stored. The lookup and the
+        computation run in a task owned by the cache that every caller awaits through a shield:
+        a caller that is cancelled (client gone, batch or job runner stopping) leaves the flight
+        running for the others, and its result is still cached.
+        """
+        flight = self._flights.get(key)
+        if flight is not None:
+            CACHE_EVENTS.inc(result="coalesced")
+        else:
+            flight = asyncio.create_task(self._compute(key, compute))
+            self._flights[key] = flight
+            flight.add_done_callback(lambda done: self._landed(key, done))
+        return await asyncio.shield(flight)
+
+    def _landed(self, key: str, flight: asyncio.Task) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        # retrieved here so a failure nobody is left to await is not logged as "never retrieved"
+        if not flight.cancelled():
+            flight.exception()
+
+    async def _compute(self, key: str, compute: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        value = await self.get(key)
+        CACHE_EVENTS.inc(result="miss" if value is None else "hit")
+        if value is None:
+            value = await compute()
+            value.setdefault("created_at", time.time())
+            await self.set(key, value)
+        return value
+
+
+def build_diagnosis_cache(minio=None) -> DiagnosisCache:
+    """
+    Build the cache described by the DIAGNOSIS_CACHE_* settings.
+    """
+    ttl = config.DIAGNOSIS_CACHE_TTL
+    tiers: List[Any] = [MemoryTier(max_entries=config.DIAGNOSIS_CACHE_MAX_ENTRIES, ttl=ttl)]
+
+    backend = config.DIAGNOSIS_CACHE_BACKEND.lower()
+    if backend == "disk":
+        tiers.append(DiskTier(config.DIAGNOSIS_CACHE_DIR, max_entries=config.DIAGNOSIS_CACHE_DISK_MAX_ENTRIES, ttl=ttl))
+    elif backend == "minio":
+        if getattr(minio, "client", None) is None:
+            raise ValueError("DIAGNOSIS_CACHE_BACKEND=minio requires STORAGE_BACKEND=minio")
+        tiers.append(MinioTier(minio, ttl=ttl))
+    elif backend != "memory":
+        raise ValueError(f"Unknown DIAGNOSIS_CACHE_BACKEND: {config.DIAGNOSIS_CACHE_BACKEND}")
+
+    return DiagnosisCache(tiers)
+
@@ -0,0 +1,141 @@
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    return int(value)
+
+
+def env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    return float(value)
+
+
+def env_str(name: str, default: str) -> str:
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    return value.strip()
+
+
+# diagnosis cache
+DIAGNOSIS_CACHE_BACKEND = env_str("DIAGNOSIS_CACHE_BACKEND", "memory")  # memory | disk | minio
+DIAGNOSIS_CACHE_MAX_ENTRIES = env_int("DIAGNOSIS_CACHE_MAX_ENTRIES", 1024)
+DIAGNOSIS_CACHE_TTL = env_int("DIAGNOSIS_CACHE_TTL", 7 * 24 * 3600)
+DIAGNOSIS_CACHE_DIR = env_str("DIAGNOSIS_CACHE_DIR", os.path.join(".cache", "diagnosis"))
+DIAGNOSIS_CACHE_DISK_MAX_ENTRIES = env_int("DIAGNOSIS_CACHE_DISK_MAX_ENTRIES", 50_000)
+
+# near-duplicate reuse (see common/near_dup.py), per worker and in memory
+NEAR_DUP_MAX_ENTRIES = env_int("NEAR_DUP_MAX_ENTRIES", 2048)  # 0 disables
+NEAR_DUP_TTL = env_int("NEAR_DUP_TTL", 15 * 60)
+NEAR_DUP_DISTANCE = env_int("NEAR_DUP_DISTANCE", 8)  # max pHash Hamming distance, of 64 bits
+NEAR_DUP_DHASH_DISTANCE = env_int("NEAR_DUP_DHASH_DISTANCE", 8)  # max dHash Hamming distance, of 64 bits
+NEAR_DUP_REANNOTATE = env_int("NEAR_DUP_REANNOTATE", 0)  # 1 = draw the reused boxes on the new photo, 0 = reuse the annotated image
+
+# server (main.py)
+HOST = env_str("HOST", "0.0.0.0")
+PORT = env_int("PORT", 74)
+WORKERS = env_int("WORKERS", 2)  # uvicorn worker processes; 0 = one per CPU
+LIMIT_CONCURRENCY = env_int("LIMIT_CONCURRENCY", 0)  # open connections per worker before 503; 0 = unlimited
+WARM_ON_START = env_int("WARM_ON_START", 1)  # build clients and warm pools in the background at start-up (see /ready)
+
+# concurrency (per uvicorn worker)
+DETECT_CONCURRENCY = env_int("DETECT_CONCURRENCY", 32)  # in-flight detections
+CPU_WORKERS = env_int("CPU_WORKERS", os.cpu_count() or 2)  # annotate / encode pool
+IO_WORKERS = env_int("IO_WORKERS", 16)  # blocking storage calls
+HTTP_CONNECT_TIMEOUT = env_int("HTTP_CONNECT_TIMEOUT", 5)
+HTTP_READ_TIMEOUT = env_int("HTTP_READ_TIMEOUT", 20)
+ENCODE_WORKERS = env_int("ENCODE_WORKERS", os.cpu_count() or 2)  # rendition encodes
+UPLOAD_WORKERS = env_int("UPLOAD_WORKERS", 8)  # concurrent put_object calls
+
+# annotated image storage (see provider/storage.py)
+STORAGE_BACKEND = env_str("STORAGE_BACKEND", "minio")  # minio | local
+STORAGE_DIR = env_str("STORAGE_DIR", os.path.join(".cache", "objects"))  # STORAGE_BACKEND=local
+STORAGE_URL_SECRET = env_str("STORAGE_URL_SECRET", "")  # signs local URLs; empty = unsigned (keys are still unguessable)
+STORAGE_PUT_ATTEMPTS = env_int("STORAGE_PUT_ATTEMPTS", 3)
+STORAGE_PUT_BACKOFF_MS = env_int("STORAGE_PUT_BACKOFF_MS", 200)
+MINIO_POOL_SIZE = env_int("MINIO_POOL_SIZE", UPLOAD_WORKERS + IO_WORKERS)  # keep-alive connections
+MINIO_READ_TIMEOUT = env_int("MINIO_READ_TIMEOUT", 60)
+
+# rendition profiles, JSON override e.g.
+# {"small": {"width": 200, "format": "WEBP", "quality": 70}, "large": {"width": 1600, "format": "AVIF", "speed": 8}}
+RENDITION_PROFILES = env_str("RENDITION_PROFILES", "")
+
+# batch detection
+BATCH_MAX_ITEMS = env_int("BATCH_MAX_ITEMS", 100)
+BATCH_CONCURRENCY = env_int("BATCH_CONCURRENCY", 8)  # default per-batch limit, also the upper bound
+
+# image sent to the model
+MODEL_IMAGE_MAX_EDGE = env_int("MODEL_IMAGE_MAX_EDGE", 1536)
+MODEL_IMAGE_FORMAT = env_str("MODEL_IMAGE_FORMAT", "JPEG")  # JPEG | WEBP | PNG
+MODEL_IMAGE_QUALITY = env_int("MODEL_IMAGE_QUALITY", 85)
+
+# pre-screen before the model call (see common/ai_model/prescreen.py); 0 disables a check
+PRESCREEN = env_int("PRESCREEN", 1)  # 0 = send every image to the model
+PRESCREEN_MIN_EDGE = env_int("PRESCREEN_MIN_EDGE", 160)  # shorter side, pixels
+PRESCREEN_MIN_SHARPNESS = env_float("PRESCREEN_MIN_SHARPNESS", 15.0)  # Laplacian variance at 512 px
+PRESCREEN_MAX_DARK = env_float("PRESCREEN_MAX_DARK", 0.7)  # share of near-black pixels
+PRESCREEN_MAX_BRIGHT = env_float("PRESCREEN_MAX_BRIGHT", 0.7)  # share of blown-out pixels
+PRESCREEN_MIN_GREEN = env_float("PRESCREEN_MIN_GREEN", 0.0)  # share of vegetation-coloured pixels; off: brown or diseased close-ups fall below any useful value
+
+# uploads
+UPLOAD_MAX_BYTES = env_int("UPLOAD_MAX_BYTES", 20 * 1024 * 1024)
+UPLOAD_CHUNK_SIZE = env_int("UPLOAD_CHUNK_SIZE", 256 * 1024)
+
+# remote images fetched by /detect (see api/health/fetcher.py); connect/read timeouts are HTTP_*_TIMEOUT
+FETCH_MAX_BYTES = env_int("FETCH_MAX_BYTES", UPLOAD_MAX_BYTES)
+FETCH_MAX_PIXELS = env_int("FETCH_MAX_PIXELS", 64_000_000)  # width * height from the image header; 0 disables
+FETCH_TOTAL_TIMEOUT = env_float("FETCH_TOTAL_TIMEOUT", 60)  # whole download, seconds; 0 disables
+FETCH_MAX_CONNECTIONS = env_int("FETCH_MAX_CONNECTIONS", 64)
+FETCH_KEEPALIVE_CONNECTIONS = env_int("FETCH_KEEPALIVE_CONNECTIONS", 32)
+FETCH_KEEPALIVE_EXPIRY = env_float("FETCH_KEEPALIVE_EXPIRY", 30)
+FETCH_CACHE_BYTES = env_int("FETCH_CACHE_BYTES", 64 * 1024 * 1024)  # bodies kept for ETag revalidation; 0 disables
+
+# job queue
+JOB_BACKEND = env_str("JOB_BACKEND", "memory")  # memory | sqlite (shared by all workers on the host)
+JOB_DB_PATH = env_str("JOB_DB_PATH", os.path.join(".cache", "jobs.sqlite3"))
+JOB_WORKERS = env_int("JOB_WORKERS", 4)  # job runners per uvicorn worker
+JOB_QUEUE_CAPACITY = env_int("JOB_QUEUE_CAPACITY", 100)  # queued + running, 429 beyond
+JOB_RESULT_TTL = env_int("JOB_RESULT_TTL", 24 * 3600)
+JOB_LEASE_SECONDS = env_int("JOB_LEASE_SECONDS", 60)  # a running job not renewed for this long is re-queued
+JOB_MAX_ATTEMPTS = env_int("JOB_MAX_ATTEMPTS", 3)  # claims per job before an expired lease fails it
+
+# diagnosis history (see api/health/history.py), shared by all workers on the host
+HISTORY = env_int("HISTORY", 1)  # 0 = do not record diagnoses (the /history routes answer 404)
+HISTORY_DB_PATH = env_str("HISTORY_DB_PATH", os.path.join(".cache", "history.sqlite3"))
+HISTORY_PAGE_SIZE = env_int("HISTORY_PAGE_SIZE", 20)
+HISTORY_MAX_PAGE_SIZE = env_int("HISTORY_MAX_PAGE_SIZE", 100)
+
+# observability
+PROFILE_SLOW_REQUESTS_MS = env_int("PROFILE_SLOW_REQUESTS_MS", 0)  # 0 disables the sampling profiler
+PROFILE_SAMPLE_INTERVAL_MS = env_int("PROFILE_SAMPLE_INTERVAL_MS", 5)
+
+# model client pool (see common/ai_model/pool.py)
+GEMINI_API_KEYS = env_str("GEMINI_API_KEYS", "")  # comma-separated; falls back to GEMINI_API_KEY
+GEMINI_BASE_URL = env_str("GEMINI_BASE_URL", "")  # e.g. a local fake server (bench/fake_gemini_server.py)
+MODEL_TIMEOUT_MS = env_int("MODEL_TIMEOUT_MS", 120_000)
+MODEL_RPM_PER_KEY = env_int("MODEL_RPM_PER_KEY", 0)  # requests per minute per key, 0 = unlimited
+MODEL_BURST = env_int("MODEL_BURST", 5)
+MODEL_MAX_ATTEMPTS = env_int("MODEL_MAX_ATTEMPTS", 3)  # first call + retries on 429/5xx
+MODEL_BACKOFF_BASE_MS = env_int("MODEL_BACKOFF_BASE_MS", 500)
+MODEL_BACKOFF_MAX_MS = env_int("MODEL_BACKOFF_MAX_MS", 8_000)
+MODEL_BREAKER_FAILURES = env_int("MODEL_BREAKER_FAILURES", 5)  # consecutive failures that open a client's circuit
+MODEL_BREAKER_RESET_MS = env_int("MODEL_BREAKER_RESET_MS", 30_000)
+MODEL_HEDGE = env_int("MODEL_HEDGE", 0)  # 1 = fire a second request after the p95 latency
+MODEL_HEDGE_MIN_DELAY_MS = env_int("MODEL_HEDGE_MIN_DELAY_MS", 1_000)
+MODEL_HEDGE_MIN_SAMPLES = env_int("MODEL_HEDGE_MIN_SAMPLES", 20)  # latencies needed before hedging starts
+
+# model request shape
+MODEL_RESPONSE_SCHEMA = env_int("MODEL_RESPONSE_SCHEMA", 1)  # 1 = constrain output with the schema in api/health/schema.py
+MODEL_MAX_OUTPUT_TOKENS = env_int("MODEL_MAX_OUTPUT_TOKENS", 8192)
+GEMINI_PROMPT_CACHE = env_int("GEMINI_PROMPT_CACHE", 1)  # 1 = send the static prompt as cached content, once it is long enough
+GEMINI_PROMPT_CACHE_TTL = env_int("GEMINI_PROMPT_CACHE_TTL", 3600)
+GEMINI_PROMPT_CACHE_MIN_TOKENS = env_int("GEMINI_PROMPT_CACHE_MIN_TOKENS", 1024)  # smallest prompt the model caches (gemini-2.5-flash: 1024)
@@ -0,0 +1,30 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable
+
+from common import config
+
+# Pillow releases the GIL while resampling and encoding, so threads are enough for the CPU stages.
+# Calls run inside a copy of the caller's context so per-request metrics follow the work.
+cpu_executor = ThreadPoolExecutor(max_workers=config.CPU_WORKERS, thread_name_prefix="cpu")
+io_executor = ThreadPoolExecutor(max_workers=config.IO_WORKERS, thread_name_prefix="io")
+
+
+async def run_cpu(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Run CPU-bound work (image decode/annotate/encode) off the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(cpu_executor, partial(ctx.run, fn, *args, **kwargs))
+
+
+async def run_io(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Run a blocking I/O call (MinIO client, filesystem) off the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(io_executor, partial(ctx.run, fn, *args, **kwargs))
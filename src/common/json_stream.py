@@ -0,0 +1,206 @@
+import json
+import re
+from typing import Any, Iterable, List, Optional, Tuple
+
+WHITESPACE = " \t\r\n"
+
+
+class _Frame:
+    __slots__ = ("kind", "path", "state", "key", "value_start")
+
+    def __init__(self, kind: str, path: Tuple[str, ...]):
+        self.kind = kind  # "{" or "["
+        self.path = path
+        self.state = "key" if kind == "{" else "value"
+        self.key: Optional[str] = None
+        self.value_start: Optional[int] = None
+
+
+class IncrementalJsonParser:
+    """
+    Incremental scanner for one streamed JSON object. `feed()` returns (path, value) for every
+    member that became complete in that chunk: all members of the root object, plus the members of
+    the objects listed in `expand` (e.g. ("analysis_vn", "prediction")), as soon as each one closes.
+
+    Text before the root `{` (e.g. a ``` fence) and after its closing `}` is ignored.
+    """
+
+    def __init__(self, expand: Iterable[str] = ("analysis_vn",)):
+        self.expand = {(key,) for key in expand}
+        self.text = ""
+        self.pos = 0
+        self.stack: List[_Frame] = []
+        self.started = False
+        self.finished = False
+        self.in_string = False
+        self.escape = False
+        self.string_start = 0
+        self.string_is_key = False
+        self.prim_start: Optional[int] = None
+
+    def feed(self, chunk: str) -> List[Tuple[Tuple[str, ...], Any]]:
+        self.text += chunk
+        out: List[Tuple[Tuple[str, ...], Any]] = []
+        text = self.text
+        i = self.pos
+        n = len(text)
+
+        while i < n and not self.finished:
+            c = text[i]
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+                    if self.string_is_key:
+                        top = self.stack[-1]
+                        top.key = json.loads(text[self.string_start:i + 1])
+                        top.state = "colon"
+                    else:
+                        self._value_end(i + 1, out)
+                i += 1
+                continue
+
+            if not self.started:
+                if c == "{":
+                    self.started = True
+                    self.stack.append(_Frame("{", ()))
+                i += 1
+                continue
+
+            if self.prim_start is not None and (c in WHITESPACE or c in ",}]"):
+                self._value_end(i, out)
+                self.prim_start = None
+
+            top = self.stack[-1]
+            if c in WHITESPACE:
+                pass
+            elif c == '"':
+                self.in_string = True
+                self.string_start = i
+                self.string_is_key = top.kind == "{" and top.state == "key"
+                if not self.string_is_key:
+                    self._value_begin(i)
+            elif c in "{[":
+                self._value_begin(i)
+                if top.kind == "{":
+                    path = top.path + (top.key,)
+                else:
+                    path = top.path + ("[]",)
+                self.stack.append(_Frame(c, path))
+            elif c in "}]":
+                self.stack.pop()
+                if not self.stack:
+                    self.finished = True
+                else:
+                    self._value_end(i + 1, out)
+            elif c == ":":
+                top.state = "value"
+            elif c == ",":
+                top.state = "key" if top.kind == "{" else "value"
+            elif self.prim_start is None:
+                # number, true, false, null
+                self.prim_start = i
+                self._value_begin(i)
+            i += 1
+
+        self.pos = i
+        return out
+
+    def _value_begin(self, i: int) -> None:
+        top = self.stack[-1]
+        if top.kind == "{":
+            top.value_start = i
+
+    def _value_end(self, end: int, out: List[Tuple[Tuple[str, ...], Any]]) -> None:
+        top = self.stack[-1]
+        if top.kind != "{" or top.value_start is None:
+            return
+        if top.path == () or top.path in self.expand:
+            try:
+                out.append((top.path + (top.key,), json.loads(self.text[top.value_start:end])))
+            except ValueError:
+                pass
+        top.value_start = None
+        top.state = "comma"
+
+
+_PARTIAL_UNICODE_ESCAPE = re.compile(r"\\u[0-9a-fA-F]{0,3}$")
+
+
+def repair_json(text: str) -> Optional[str]:
+    """
+    Best-effort completion of a truncated or wrapped JSON document: text before the first
+    `{`/`[` and after the matching close is dropped; if the document is cut short, an unfinished
+    string value is closed, a dangling key, colon, comma or partial literal is dropped and the
+    open containers are closed. Returns None if no container starts in `text`.
+    """
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        return None
+    start = min(starts)
+    stack: List[str] = []
+    expect_key = False
+    in_string = escape = string_is_key = False
+    prim_start: Optional[int] = None
+    # end of the last complete value (or opened container) and the open containers at that point
+    safe_end, safe_stack = start, ()
+
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                in_string = False
+                if not string_is_key:
+                    safe_end, safe_stack = i + 1, tuple(stack)
+            continue
+
+        if prim_start is not None and (c in WHITESPACE or c in ",}]"):
+            safe_end, safe_stack = i, tuple(stack)
+            prim_start = None
+
+        if c == '"':
+            in_string = True
+            string_is_key = expect_key
+        elif c in "{[":
+            stack.append(c)
+            expect_key = c == "{"
+            safe_end, safe_stack = i + 1, tuple(stack)
+        elif c in "}]":
+            if not stack:
+                break
+            stack.pop()
+            if not stack:
+                return text[start:i + 1]
+            safe_end, safe_stack = i + 1, tuple(stack)
+            expect_key = False
+        elif c == ",":
+            expect_key = stack[-1] == "{"
+        elif c == ":":
+            expect_key = False
+        elif c not in WHITESPACE and prim_start is None:
+            prim_start = i
+
+    def close(body: str, open_stack) -> str:
+        return body + "".join("}" if b == "{" else "]" for b in reversed(open_stack))
+
+    if in_string and not string_is_key:
+        # keep the partial string value: close it where it was cut
+        body = text[start:-1] if escape else _PARTIAL_UNICODE_ESCAPE.sub("", text[start:])
+        candidate = close(body + '"', stack)
+        try:
+            json.loads(candidate)
+            return candidate
+        except ValueError:
+            pass
+    # a number at the cut may itself be cut ("1000" -> "10"): only complete literals are kept
+    if prim_start is not None and text[prim_start:] in ("true", "false", "null"):
+        safe_end, safe_stack = len(text), tuple(stack)
+    return close(text[start:safe_end].rstrip(), safe_stack)
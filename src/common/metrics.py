@@ -0,0 +1,264 @@
+import bisect
+import contextvars
+import logging as log
+import sys
+import threading
+import time
+import traceback
+from collections import Counter as _Tally
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from common import config
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# innermost frames of threads that are blocked waiting for work; left out of profiles
+IDLE_LEAVES = {"wait", "select", "poll", "_worker", "accept"}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(key: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    items = key + extra
+    if not items:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in items)
+    return "{" + body + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_fmt_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        # per label set: [bucket counts..., +Inf count], sum
+        self._values: Dict[LabelKey, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[i] += 1
+            total[0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_fmt_labels(key, (('le', repr(bound)),))} {cumulative}")
+                cumulative += counts[-1]
+                lines.append(f"{self.name}_bucket{_fmt_labels(key, (('le', '+Inf'),))} {cumulative}")
+                lines.append(f"{self.name}_sum{_fmt_labels(key)} {total[0]}")
+                lines.append(f"{self.name}_count{_fmt_labels(key)} {cumulative}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("diagnosis_stage_seconds", "Wall time per pipeline stage")
+STAGE_ERRORS = Counter("diagnosis_stage_errors_total", "Exceptions raised per pipeline stage")
+STAGE_BYTES = Counter("diagnosis_bytes_total", "Bytes read (in) or produced (out) per stage")
+MODEL_TOKENS = Counter("model_tokens_total", "Model token usage by kind (prompt, output, cached, total)")
+RENDITION_SECONDS = Histogram("rendition_seconds", "Rendition encode/upload time per size variant")
+HTTP_SECONDS = Histogram("http_request_duration_seconds", "Request latency by route and status")
+CACHE_EVENTS = Counter("diagnosis_cache_total", "Diagnosis cache lookups by result")
+MODEL_CALLS = Counter("model_calls_total", "Model calls per pool client by outcome (ok, retryable, error, cancelled)")
+MODEL_HEDGES = Counter("model_hedges_total", "Hedged model calls by outcome (fired, won)")
+PRESCREEN_EVENTS = Counter("prescreen_total", "Pre-screen verdicts: passed, or one count per rejection reason")
+NEAR_DUP_EVENTS = Counter("near_duplicate_total", "Near-duplicate index lookups (hit, miss) and removals (expired, evicted)")
+NEAR_DUP_DISTANCE = Histogram("near_duplicate_distance", "pHash Hamming distance of near-duplicate hits", buckets=(0, 1, 2, 3, 4, 6, 8, 12, 16))
+FETCH_EVENTS = Counter("image_fetch_total", "Remote image fetches by result (fetched, not_modified, too_large, not_an_image, timeout)")
+
+REGISTRY = [STAGE_SECONDS, STAGE_ERRORS, STAGE_BYTES, MODEL_TOKENS, MODEL_CALLS, MODEL_HEDGES, RENDITION_SECONDS, HTTP_SECONDS, CACHE_EVENTS,
+            PRESCREEN_EVENTS, NEAR_DUP_EVENTS, NEAR_DUP_DISTANCE, FETCH_EVENTS]
+
+# per-request stage durations (seconds), filled by `timed` and read for the Server-Timing header
+_request_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("request_timings", default=None)
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """
+    Time a pipeline stage: feeds the stage histogram, the error counter on exceptions and the
+    Server-Timing entries of the current request. Safe in executor threads (see common.executor).
+    """
+    t0 = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - t0
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+@contextmanager
+def stage_timings() -> Iterator[Dict[str, float]]:
+    """
+    Collect the stages timed inside the block (seconds, summed per stage) into a dict of their
+    own, e.g. one item of a batch; they still count towards the request's Server-Timing.
+    """
+    outer = _request_timings.get()
+    timings: Dict[str, float] = {}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+        if outer is not None:
+            for stage, seconds in timings.items():
+                outer[stage] = outer.get(stage, 0.0) + seconds
+
+
+def count_bytes(stage: str, direction: str, n: int) -> None:
+    STAGE_BYTES.inc(n, stage=stage, direction=direction)
+
+
+def count_tokens(usage) -> None:
+    """
+    Record a google-genai `usage_metadata` (any object with *_token_count attributes).
+    """
+    if usage is None:
+        return
+    for kind, attr in (
+        ("prompt", "prompt_token_count"),
+        ("output", "candidates_token_count"),
+        ("cached", "cached_content_token_count"),
+        ("total", "total_token_count"),
+    ):
+        value = getattr(usage, attr, None)
+        if value:
+            MODEL_TOKENS.inc(value, kind=kind)
+
+
+def server_timing(timings: Dict[str, float]) -> str:
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+
+
+class SlowRequestProfiler:
+    """
+    Opt-in sampling profiler: while a request runs, a background thread samples every thread's
+    stack every `interval` seconds. If the request ends up slower than `threshold` seconds, the
+    most frequent stacks are logged. Samples include whatever else the process was doing.
+    """
+
+    def __init__(self, threshold: float, interval: float = 0.005, top: int = 15):
+        self.threshold = threshold
+        self.interval = interval
+        self.top = top
+
+    @contextmanager
+    def profile(self, name: str) -> Iterator[None]:
+        samples: _Tally = _Tally()
+        stop = threading.Event()
+
+        def sample():
+            sampler = threading.get_ident()
+            while not stop.wait(self.interval):
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == sampler:
+                        continue
+                    if frame.f_code.co_name in IDLE_LEAVES:
+                        continue
+                    stack = traceback.extract_stack(frame, limit=12)
+                    collapsed = ";".join(f"{f.name}({f.filename.rsplit('/', 1)[-1]}:{f.lineno})" for f in stack)
+                    samples[(names.get(ident, str(ident)), collapsed)] += 1
+
+        thread = threading.Thread(target=sample, name="slow-request-profiler", daemon=True)
+        t0 = time.perf_counter()
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+            elapsed = time.perf_counter() - t0
+            if elapsed >= self.threshold and samples:
+                lines = [f"{n:5d} [{thread_name}] {stack}" for (thread_name, stack), n in samples.most_common(self.top)]
+                log.warning("slow request %s took %.2fs; top stacks:\n%s", name, elapsed, "\n".join(lines))
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: collects per-request stage timings, adds a Server-Timing header, records
+    request latency and optionally runs the slow-request profiler (PROFILE_SLOW_REQUESTS_MS).
+    """
+
+    def __init__(self, app):
+        self.app = app
+        threshold_ms = config.PROFILE_SLOW_REQUESTS_MS
+        self.profiler = SlowRequestProfiler(threshold_ms / 1000, config.PROFILE_SAMPLE_INTERVAL_MS / 1000) if threshold_ms > 0 else None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        timings: Dict[str, float] = {}
+        token = _request_timings.set(timings)
+        t0 = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                total = dict(timings, total=time.perf_counter() - t0)
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing(total).encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            if self.profiler is not None:
+                with self.profiler.profile(f"{scope['method']} {scope['path']}"):
+                    await self.app(scope, receive, send_with_timing)
+            else:
+                await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_SECONDS.observe(time.perf_counter() - t0, route=path, method=scope["method"], status=status["code"])
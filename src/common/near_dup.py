@@ -0,0 +1,188 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from common.metrics import NEAR_DUP_DISTANCE, NEAR_DUP_EVENTS
+
+HASH_SIZE = 8  # 8x8 = 64-bit hashes
+PHASH_SAMPLE = 32  # pHash takes the low 8x8 frequencies of a 32x32 DCT
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    """
+    Orthonormal DCT-II basis: `D @ x` is the DCT of a column vector x.
+    """
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    d = np.sqrt(2.0 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    d[0] /= np.sqrt(2.0)
+    return d
+
+
+_DCT = _dct_matrix(PHASH_SAMPLE)
+
+
+def _pack(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def image_hashes(img: Image.Image) -> Tuple[int, int]:
+    """
+    (pHash, dHash) of an image, both 64-bit ints compared by Hamming distance.
+    Takes the image `load_model_image` decoded: EXIF orientation is already applied, so two shots
+    with different orientation flags but the same pixels on screen hash the same.
+    """
+    img = img.convert("L")
+
+    small = np.asarray(img.resize((PHASH_SAMPLE, PHASH_SAMPLE), resample=Image.BILINEAR, reducing_gap=2.0), dtype=np.float64)
+    low = (_DCT @ small @ _DCT.T)[:HASH_SIZE, :HASH_SIZE]
+    # the DC term is the mean brightness: left out of the median so exposure shifts do not flip bits
+    phash = _pack(low > np.median(low.ravel()[1:]))
+
+    grad = np.asarray(img.resize((HASH_SIZE + 1, HASH_SIZE), resample=Image.BILINEAR), dtype=np.int16)
+    dhash = _pack(grad[:, 1:] > grad[:, :-1])
+    return phash, dhash
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over 64-bit hashes under Hamming distance. Removal only tombstones
+    the node (the tree shape depends on it); `NearDuplicateIndex` rebuilds when they pile up.
+    """
+
+    def __init__(self):
+        # node: [hash, key or None when removed, {distance: child}]
+        self._root: Optional[list] = None
+
+    def add(self, h: int, key: str) -> None:
+        if self._root is None:
+            self._root = [h, key, {}]
+            return
+        node = self._root
+        while True:
+            d = hamming(h, node[0])
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [h, key, {}]
+                return
+            node = child
+
+    def remove(self, h: int, key: str) -> None:
+        node = self._root
+        while node is not None:
+            d = hamming(h, node[0])
+            if d == 0 and node[1] == key:
+                node[1] = None
+                return
+            node = node[2].get(d)
+
+    def search(self, h: int, radius: int) -> List[Tuple[int, str]]:
+        """
+        (distance, key) of every live node within `radius` of `h`.
+        """
+        found: List[Tuple[int, str]] = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            d = hamming(h, node[0])
+            if d <= radius and node[1] is not None:
+                found.append((d, node[1]))
+            # triangle inequality: only subtrees at distance d-radius..d+radius can hold matches
+            for child_d, child in node[2].items():
+                if d - radius <= child_d <= d + radius:
+                    stack.append(child)
+        return found
+
+
+class NearDuplicateIndex:
+    """
+    Recent diagnoses keyed by perceptual hash, so a reshoot of the same leaf a few seconds later
+    (a few pixels off, re-encoded) reuses the earlier result instead of calling the model again.
+
+    A match needs the pHash within `max_distance` *and* the dHash within `max_dhash_distance`;
+    the two fail on different kinds of images, so requiring both keeps false matches rare.
+    Bounded to `max_entries`, oldest first, and entries expire after `ttl` seconds.
+    """
+
+    def __init__(self, max_entries: int = 2048, ttl: int = 900, max_distance: int = 8, max_dhash_distance: int = 8):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.max_dhash_distance = max_dhash_distance
+        # key -> (added_at, phash, dhash, value), in insertion order = age order
+        self._entries: "OrderedDict[str, Tuple[float, int, int, Dict[str, Any]]]" = OrderedDict()
+        self._tree = BKTree()
+        self._removed = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, hashes: Tuple[int, int]) -> Optional[Dict[str, Any]]:
+        """
+        Value stored for the closest live near-duplicate, or None.
+        """
+        if not self.enabled:
+            return None
+        phash, dhash = hashes
+        with self._lock:
+            self._expire(time.time())
+            best: Optional[Tuple[int, int, str]] = None
+            for d, key in self._tree.search(phash, self.max_distance):
+                dd = hamming(dhash, self._entries[key][2])
+                if dd <= self.max_dhash_distance and (best is None or (d, dd) < best[:2]):
+                    best = (d, dd, key)
+            if best is None:
+                NEAR_DUP_EVENTS.inc(result="miss")
+                return None
+            NEAR_DUP_EVENTS.inc(result="hit")
+            NEAR_DUP_DISTANCE.observe(best[0])
+            return self._entries[best[2]][3]
+
+    def add(self, key: str, hashes: Tuple[int, int], value: Dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+        phash, dhash = hashes
+        now = time.time()
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (now, phash, dhash, value)
+            self._tree.add(phash, key)
+            self._expire(now)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                NEAR_DUP_EVENTS.inc(result="evicted")
+            if self._removed > max(64, len(self._entries)):
+                self._rebuild()
+
+    def _expire(self, now: float) -> None:
+        while self._entries:
+            key, (added_at, *_) = next(iter(self._entries.items()))
+            if added_at + self.ttl >= now:
+                break
+            self._drop(key)
+            NEAR_DUP_EVENTS.inc(result="expired")
+
+    def _drop(self, key: str) -> None:
+        _, phash, _, _ = self._entries.pop(key)
+        self._tree.remove(phash, key)
+        self._removed += 1
+
+    def _rebuild(self) -> None:
+        self._tree = BKTree()
+        for key, (_, phash, _, _) in self._entries.items():
+            self._tree.add(phash, key)
+        self._removed = 0
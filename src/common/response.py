@@ -0,0 +1,33 @@
+import os
+from typing import Optional
+
+from fastapi import HTTPException, Request
+from fastapi.responses import FileResponse, Response
+
+# files behind content-addressed or never-reused names
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def file_response(request: Request, path: str, media_type: str, cache_control: Optional[str] = IMMUTABLE) -> Response:
+    """
+    Serve a file with its real media type, an ETag and Range support (Starlette's FileResponse,
+    which also hands the path to the server for sendfile when it offers `http.response.pathsend`),
+    answering 304 when the client already holds the current version.
+    """
+    try:
+        stat_result = os.stat(path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+    headers = {"cache-control": cache_control} if cache_control else None
+    response = FileResponse(path, media_type=media_type, stat_result=stat_result, headers=headers)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        etag = response.headers["etag"]
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if "*" in tags or etag in tags:
+            not_modified = {"etag": etag}
+            if cache_control:
+                not_modified["cache-control"] = cache_control
+            return Response(status_code=304, headers=not_modified)
+    return response
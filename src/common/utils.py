@@ -1,23 +1,44 @@
 import json
 import os
+from functools import lru_cache
 from io import BytesIO
 from typing import Any, Dict, List, Optional, Tuple
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw, ImageFont, ImageOps
 
-def parse_detections(text: str)-> Tuple[List[dict], Dict[str, Any]]:
+from common.json_stream import repair_json
+
+def parse_detections(text: str) -> Tuple[List[dict], Dict[str, Any]]:
     """
-    Forgiving parser: attempt strict JSON first; else extract first [...] block and parse.
-    Returns a list of dicts (possibly empty).
+    Forgiving parser: strict JSON first; otherwise the first JSON object/array in `text`,
+    completed if it was cut short (see repair_json). Never fails: unusable text gives ([], {}).
+    Shape and types are checked later (api.health.schema.validate_diagnosis).
     """
+    obj = None
     try:
         obj = json.loads(text)
-        if isinstance(obj, dict):
-            detections = obj.get("detections", []) or []
-            analysis = obj.get("analysis_vn", {}) or {}
-            return detections, analysis
-        if isinstance(obj, list):
-            return obj, {}
-    except Exception:
+    except (TypeError, ValueError):
+        repaired = repair_json(text or "")
+        if repaired is not None:
+            try:
+                obj = json.loads(repaired)
+            except ValueError:
+                obj = None
+    if isinstance(obj, dict):
+        detections = obj.get("detections") or []
+        analysis = obj.get("analysis_vn") or {}
+        return (detections if isinstance(detections, list) else []), (analysis if isinstance(analysis, dict) else {})
+    if isinstance(obj, list):
+        return obj, {}
+    return [], {}
+
+
+def silent_remove(path: str) -> None:
+    """
+    Remove a file if it is still there.
+    """
+    try:
+        os.remove(path)
+    except OSError:
         pass
 
 
@@ -33,46 +54,72 @@ def to_pixels(box: List[float], W: int, H: int) -> Tuple[int, int, int, int]:
     return x1, y1, x2, y2
 
 
-def annotate_image(image_bytes: bytes, detections: List[dict], target_width: int = 1200) -> bytes:
+@lru_cache(maxsize=32)
+def load_font(size: int):
     """
-    Rescale image so width == target_width (preserve aspect ratio),
-    draw detections, and return PNG bytes of the annotated (scaled) image.
+    Fonts are loaded from disk once per size and shared between requests.
     """
-    # load image
-    base = Image.open(BytesIO(image_bytes)).convert("RGBA")
-    orig_W, orig_H = base.size
+    try:
+        return ImageFont.truetype("DejaVuSans-Bold.ttf", size=size)
+    except Exception:
+        return ImageFont.load_default()
+
+
+def _blend_rect(img: Image.Image, box: Tuple[int, int, int, int], color: Tuple[int, int, int], alpha: int) -> None:
+    """
+    Alpha-blend a solid rectangle into `img` in place, touching only the pixels inside `box`
+    (inclusive corners, clipped to the image).
+    """
+    W, H = img.size
+    x0, y0 = max(0, box[0]), max(0, box[1])
+    x1, y1 = min(W, box[2] + 1), min(H, box[3] + 1)
+    if x1 <= x0 or y1 <= y0:
+        return
+    region = img.crop((x0, y0, x1, y1))
+    solid = Image.new(img.mode, region.size, color)
+    img.paste(Image.blend(region, solid, alpha / 255.0), (x0, y0))
+
+
+def render_annotations(image_bytes: bytes, detections: List[dict], target_width: int = 1200) -> Image.Image:
+    """
+    Rescale image so width == target_width (preserve aspect ratio) and draw detections.
+    Returns the RGB image itself so the storage stage can encode it without a PNG round trip.
+    """
+    base = Image.open(BytesIO(image_bytes))
 
-    # compute scale to reach target_width
-    if orig_W == 0:
-        raise ValueError("Image width is zero")
-    scale = target_width / orig_W
     # guard: avoid absurdly large sizes
-    max_width = 4000
-    if target_width > max_width:
-        target_width = max_width
-        scale = target_width / orig_W
+    target_width = min(target_width, 4000)
+    if base.size[0] == 0:
+        raise ValueError("Image width is zero")
+    # JPEG only: decode at 1/2..1/8 scale when the target is much smaller (before EXIF rotation,
+    # so ask for enough pixels on both edges)
+    base.draft("RGB", (target_width, target_width))
+    # apply EXIF orientation like prepare_model_image so boxes share its frame
+    base = ImageOps.exif_transpose(base)
+    if base.mode != "RGB":
+        base = base.convert("RGB")
+    orig_W, orig_H = base.size
 
-    new_W = int(round(orig_W * scale))
-    new_H = int(round(orig_H * scale))
+    new_W = target_width
+    new_H = int(round(orig_H * target_width / orig_W))
 
-    # resize using LANCZOS for quality
     if (new_W, new_H) != (orig_W, orig_H):
-        base = base.resize((new_W, new_H), resample=Image.LANCZOS)
+        if new_W < orig_W:
+            # reducing_gap box-reduces first, then a bicubic pass: close to LANCZOS, much cheaper
+            base = base.resize((new_W, new_H), resample=Image.BICUBIC, reducing_gap=2.0)
+        else:
+            # upscaling adds no detail, bilinear is enough for a preview
+            base = base.resize((new_W, new_H), resample=Image.BILINEAR)
 
-    overlay = Image.new("RGBA", (new_W, new_H), (0, 0, 0, 0))
-    draw = ImageDraw.Draw(overlay)
+    draw = ImageDraw.Draw(base)
 
     # font size depends on scaled image size
-    try:
-        font_size = max(12, int(min(new_W, new_H) / 45))
-        font = ImageFont.truetype("DejaVuSans-Bold.ttf", size=font_size)
-    except Exception:
-        font = ImageFont.load_default()
+    font = load_font(max(12, int(min(new_W, new_H) / 45)))
 
     thickness = max(1, int(round((new_W + new_H) / 900)))
-    color_box = (255, 0, 0, 220)
-    color_text = (255, 255, 255, 255)
-    color_bg = (0, 0, 0, 200)
+    color_box, alpha_box = (255, 0, 0), 220
+    color_text = (255, 255, 255)
+    color_bg, alpha_bg = (0, 0, 0), 200
 
     for d in detections:
         box = d.get("box_2d") or d.get("bbox") or d.get("box")
@@ -80,17 +127,16 @@ def annotate_image(image_bytes: bytes, detections: List[dict], target_width: int
             continue
 
         # convert normalized box -> pixels on the scaled image
-        # reuse your to_pixels but pass new_W, new_H
         x1, y1, x2, y2 = to_pixels(box, new_W, new_H)
         if x2 - x1 <= 1 or y2 - y1 <= 1:
             continue
 
-        # draw rectangle (use width param if available)
-        try:
-            draw.rectangle([x1, y1, x2, y2], outline=color_box, width=thickness)
-        except TypeError:
-            for t in range(thickness):
-                draw.rectangle([x1 - t, y1 - t, x2 + t, y2 + t], outline=color_box)
+        # translucent outline as four strips (sides skip the corners so nothing blends twice)
+        t = min(thickness, (x2 - x1 + 1) // 2, (y2 - y1 + 1) // 2)
+        _blend_rect(base, (x1, y1, x2, y1 + t - 1), color_box, alpha_box)
+        _blend_rect(base, (x1, y2 - t + 1, x2, y2), color_box, alpha_box)
+        _blend_rect(base, (x1, y1 + t, x1 + t - 1, y2 - t), color_box, alpha_box)
+        _blend_rect(base, (x2 - t + 1, y1 + t, x2, y2 - t), color_box, alpha_box)
 
         # label + confidence formatting
         label = str(d.get("label") or "unknown")
@@ -109,10 +155,7 @@ def annotate_image(image_bytes: bytes, detections: List[dict], target_width: int
             tb = draw.textbbox((0, 0), text, font=font)
             tw, th = tb[2] - tb[0], tb[3] - tb[1]
         except Exception:
-            try:
-                tw, th = font.getsize(text)
-            except Exception:
-                tw, th = (len(text) * 6, 12)
+            tw, th = (len(text) * 6, 12)
 
         pad = max(4, th // 3)
         bx0 = x1
@@ -122,12 +165,18 @@ def annotate_image(image_bytes: bytes, detections: List[dict], target_width: int
         bx1 = bx0 + tw + 2 * pad
         by1 = by0 + th + 2 * pad
 
-        # draw label background and text
-        draw.rectangle([bx0, by0, bx1, by1], fill=color_bg)
+        # label background is blended locally, text is opaque and drawn directly
+        _blend_rect(base, (bx0, by0, bx1, by1), color_bg, alpha_bg)
         draw.text((bx0 + pad, by0 + pad), text, fill=color_text, font=font)
 
-    # composite overlay onto base and return PNG bytes
-    out = Image.alpha_composite(base, overlay).convert("RGB")
+    return base
+
+
+def annotate_image(image_bytes: bytes, detections: List[dict], target_width: int = 1200) -> bytes:
+    """
+    Same as render_annotations, returned as PNG bytes.
+    """
+    out = render_annotations(image_bytes, detections, target_width)
     with BytesIO() as out_buf:
-        out.save(out_buf, format="PNG", quality=95)
+        out.save(out_buf, format="PNG")
         return out_buf.getvalue()
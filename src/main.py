@@ -1,17 +1,48 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from api.health import providers
 from api.health.router import router as health_router
+from common import config, metrics
 import uvicorn
-import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # runs in every uvicorn worker: clients are per process and never built at import
+    providers.start()
+    warmup = asyncio.create_task(providers.warm_in_background()) if config.WARM_ON_START else None
+    yield
+    if warmup is not None:
+        warmup.cancel()
+    await providers.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware)
 
 app.include_router(health_router)
 
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics_endpoint():
+    # per process: with several uvicorn workers each scrape sees one worker
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 
 if __name__ == "__main__":
-    port = int(os.getenv("PORT", 74))
-    uvicorn.run("main:app", host="0.0.0.0", port=port, log_level="info", workers=2)
+    uvicorn.run(
+        "main:app",
+        host=config.HOST,
+        port=config.PORT,
+        log_level="info",
+        workers=config.WORKERS or os.cpu_count() or 1,
+        limit_concurrency=config.LIMIT_CONCURRENCY or None,
+    )
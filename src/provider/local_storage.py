@@ -0,0 +1,90 @@
+import hashlib
+import hmac
+import os
+import time
+import uuid
+from typing import Optional
+
+from common import config
+from provider.storage import StorageInterface
+
+
+class LocalStorage(StorageInterface):
+    """
+    Annotated images on the local filesystem, for nodes without MinIO; served by
+    /api/health/public/{size}/{file_key}.
+
+    `{size}/{file_key}` lives at `{directory}/{size}/{h[:2]}/{h[2:4]}/{file_key}` (h = sha1 of the
+    key), so no directory grows past a few thousand entries. Objects are written to a temporary
+    file next to their final path and renamed into place: readers never see a partial file.
+    File keys carry a random token so URLs cannot be enumerated; with STORAGE_URL_SECRET set they
+    are also signed and expire like MinIO presigned URLs.
+    """
+
+    def __init__(self, directory: str, url_prefix: str = "/api/health/public", secret: str = config.STORAGE_URL_SECRET):
+        super().__init__()
+        self.directory = directory
+        self.url_prefix = url_prefix.rstrip("/")
+        self.secret = secret.encode("utf-8") if secret else None
+        self._dirs = set()
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, object_name: str) -> str:
+        """
+        Filesystem path of `{size}/{file_key}`; ValueError for anything else.
+        """
+        size, _, file_key = object_name.partition("/")
+        # keys are plain file names; anything else could escape the directory
+        if size not in self.renditions.profiles or not file_key or os.path.basename(file_key) != file_key or file_key.startswith("."):
+            raise ValueError(f"Invalid object name: {object_name!r}")
+        h = hashlib.sha1(file_key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, size, h[:2], h[2:4], file_key)
+
+    def content_type(self, object_name: str) -> str:
+        return self.renditions.content_type(object_name.partition("/")[0])
+
+    def check(self) -> None:
+        if not os.access(self.directory, os.W_OK):
+            raise RuntimeError(f"Storage directory {self.directory} is not writable")
+
+    def put_object(self, object_name: str, data: bytes, content_type: str) -> None:
+        path = self.path_for(object_name)
+        directory = os.path.dirname(path)
+        if directory not in self._dirs:
+            os.makedirs(directory, exist_ok=True)
+            self._dirs.add(directory)
+        tmp = os.path.join(directory, f".{uuid.uuid4().hex}.part")
+        try:
+            with open(tmp, "wb", buffering=0) as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+    def _signature(self, object_name: str, expires: int) -> str:
+        return hmac.new(self.secret, f"{object_name}\n{expires}".encode("utf-8"), hashlib.sha256).hexdigest()[:32]
+
+    def get_presigned_url(self, file_key: Optional[str], size: str = "medium", expires_in: int = 60 * 60 * 24) -> str:
+        if not file_key:
+            raise ValueError("File key is required")
+        object_name = f"{size}/{file_key}"
+        self.path_for(object_name)
+        url = f"{self.url_prefix}/{object_name}"
+        if self.secret is None:
+            return url
+        expires = int(time.time()) + expires_in
+        return f"{url}?expires={expires}&signature={self._signature(object_name, expires)}"
+
+    def verify(self, object_name: str, expires: Optional[str], signature: Optional[str]) -> bool:
+        """
+        Whether a request for `object_name` carries a valid, unexpired signature (always True unsigned).
+        """
+        if self.secret is None:
+            return True
+        if not expires or not expires.isdigit() or not signature or int(expires) < time.time():
+            return False
+        return hmac.compare_digest(signature, self._signature(object_name, int(expires)))
@@ -1,72 +1,87 @@
 import os
+import random
 from minio import Minio
-from minio.error import S3Error
+from minio.error import S3Error, ServerError
 from dotenv import load_dotenv
 from io import BytesIO
 import logging as log
-from typing import Optional, List, Union
+from typing import Optional
 from datetime import timedelta
 import time
-from PIL import Image
+
+import certifi
+import urllib3
+
+from common import config
+from provider.storage import StorageInterface
 
 load_dotenv()
 
-class MinioService:
+# S3 error codes worth another attempt; anything else (AccessDenied, NoSuchBucket, ...) will not change
+RETRYABLE_S3_CODES = {"SlowDown", "InternalError", "ServiceUnavailable", "RequestTimeout", "OperationAborted"}
+
+
+def is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, S3Error):
+        return exc.code in RETRYABLE_S3_CODES or (exc.response is not None and exc.response.status >= 500)
+    return isinstance(exc, (ServerError, urllib3.exceptions.HTTPError, ConnectionError, TimeoutError))
+
+
+class MinioService(StorageInterface):
     def __init__(self, bucket_name="smartfarm"):
+        super().__init__()
         self.endpoint = os.getenv("MINIO_ENDPOINT", "localhost")
         self.port = int(os.getenv("MINIO_PORT", 9000))
         self.use_ssl = os.getenv("MINIO_USE_SSL", "false").lower() == "true"
         self.access_key = os.getenv("MINIO_ACCESS_KEY", "minioadmin")
         self.secret_key = os.getenv("MINIO_SECRET_KEY", "minioadmin")
         self.bucket_name = bucket_name
-        
+
         self.client = Minio(
             f"{self.endpoint}:{self.port}",
             access_key=self.access_key,
             secret_key=self.secret_key,
-            secure=self.use_ssl
+            secure=self.use_ssl,
+            http_client=self._http_client(),
         )
-        
-        print(f"Connected to MinIO at {self.endpoint}:{self.port}, SSL: {self.use_ssl}")
-        
-    def upload_resize_image(self, file_name: str, file_stream: bytes):
-        sizes = {
-            "small": 200,
-            "medium": 800,
-            "large": 1600,
-        }
 
-        try:
-            original = Image.open(BytesIO(file_stream))
-            upload_errors = []
+        log.info("MinIO storage at %s:%s, SSL: %s", self.endpoint, self.port, self.use_ssl)
 
-            for size_label, width in sizes.items():
-                img = original.copy()
-                img.thumbnail((width, width * 10_000))  # keep aspect ratio, very tall max height
-                buffer = BytesIO()
-                img.save(buffer, format="AVIF")  # requires Pillow compiled with AVIF support
-                avif_bytes = buffer.getvalue()
+    def _http_client(self) -> urllib3.PoolManager:
+        """
+        One keep-alive pool sized for every thread that can talk to MinIO at once (the default
+        holds 10 connections and discards the rest after each burst). urllib3 only retries
+        connection setup; failed requests are retried by put_object with backoff.
+        """
+        return urllib3.PoolManager(
+            maxsize=config.MINIO_POOL_SIZE,
+            timeout=urllib3.Timeout(connect=config.HTTP_CONNECT_TIMEOUT, read=config.MINIO_READ_TIMEOUT),
+            cert_reqs="CERT_REQUIRED",
+            ca_certs=os.environ.get("SSL_CERT_FILE") or certifi.where(),
+            retries=urllib3.Retry(total=2, connect=2, read=0, redirect=0, status=0, other=0),
+        )
 
-                try:
-                    self.client.put_object(
-                        self.bucket_name,
-                        f"{size_label}/{file_name}",
-                        BytesIO(avif_bytes),
-                        length=len(avif_bytes),
-                        content_type="image/avif",
-                    )
-                except S3Error as e:
-                    log.error("Error uploading %s size for %s: %s", size_label, file_name, e)
-                    upload_errors.append((size_label, str(e)))
+    def check(self) -> None:
+        # also opens the first keep-alive connection of the pool
+        if not self.client.bucket_exists(self.bucket_name):
+            raise RuntimeError(f"MinIO bucket {self.bucket_name} does not exist")
 
-            if upload_errors:
-                raise Exception(f"Some uploads failed: {upload_errors}")
+    def put_object(self, object_name: str, data: bytes, content_type: str) -> None:
+        """
+        put_object with up to STORAGE_PUT_ATTEMPTS tries on throttling, 5xx and connection errors.
+        """
+        for attempt in range(1, config.STORAGE_PUT_ATTEMPTS + 1):
+            try:
+                self.client.put_object(self.bucket_name, object_name, BytesIO(data), length=len(data), content_type=content_type)
+                return
+            except Exception as e:
+                if attempt == config.STORAGE_PUT_ATTEMPTS or not is_retryable(e):
+                    raise
+                # full jitter, like the model pool
+                delay = random.uniform(0, config.STORAGE_PUT_BACKOFF_MS / 1000 * 2 ** (attempt - 1))
+                log.warning("put_object %s failed (%s), retry %d in %.2fs", object_name, e, attempt, delay)
+                time.sleep(delay)
 
-            return file_name
-        except Exception as e:
-            log.error("upload_resize_image error: %s", e)
-            raise
-    
     def get_presigned_url(
         self,
         file_key: Optional[str],
@@ -83,20 +98,9 @@ class MinioService:
                 expires=timedelta(seconds=expires_in),
                 response_headers={
                     "response-content-disposition": f'inline; filename="{size}/{file_key}"',
-                    "response-content-type": "image/avif",
+                    "response-content-type": self.renditions.content_type(size),
                 },
             )
         except S3Error as e:
             log.error("get_presigned_url error: %s", e)
             raise
-        
-    def generate_file_key(self, original_name: str) -> str:
-        ts = int(time.time() * 1000)
-        # safe replacement of spaces
-        safe = original_name.replace(" ", "_")
-        return f"{ts}.{safe}"
-    
-            
-            
-minio_service = MinioService()
-
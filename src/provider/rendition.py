@@ -0,0 +1,131 @@
+import json
+import logging as log
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from io import BytesIO
+from typing import Any, Dict, Iterator, List, Tuple, Union
+
+from PIL import Image
+
+from common import config
+
+CONTENT_TYPES = {
+    "AVIF": "image/avif",
+    "WEBP": "image/webp",
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+}
+
+# speed 8 encodes ~2.5x faster than Pillow's default 6 for ~10% larger files; max_threads=1
+# because the variants are already encoded in parallel
+DEFAULT_PROFILES: Dict[str, Dict[str, Any]] = {
+    "small": {"width": 200, "format": "AVIF", "quality": 75, "speed": 8, "max_threads": 1},
+    "medium": {"width": 800, "format": "AVIF", "quality": 75, "speed": 8, "max_threads": 1},
+    "large": {"width": 1600, "format": "AVIF", "quality": 75, "speed": 8, "max_threads": 1},
+}
+
+# Pillow releases the GIL inside its encoders, so a thread pool gives real parallelism
+encode_executor = ThreadPoolExecutor(max_workers=config.ENCODE_WORKERS, thread_name_prefix="encode")
+
+
+def load_profiles(raw: str = config.RENDITION_PROFILES) -> Dict[str, Dict[str, Any]]:
+    """
+    Default profiles, with per-size overrides from a JSON string (RENDITION_PROFILES).
+    """
+    profiles = {label: dict(p) for label, p in DEFAULT_PROFILES.items()}
+    if raw:
+        for label, override in json.loads(raw).items():
+            profiles.setdefault(label, {}).update(override)
+    for label, p in profiles.items():
+        p["format"] = p.get("format", "AVIF").upper()
+        if "width" not in p:
+            raise ValueError(f"Rendition profile '{label}' has no width")
+        if p["format"] not in CONTENT_TYPES:
+            raise ValueError(f"Rendition profile '{label}' has unsupported format {p['format']}")
+    return profiles
+
+
+class Rendition:
+    def __init__(self, label: str, data: bytes, content_type: str, size: Tuple[int, int], timings: Dict[str, float]):
+        self.label = label
+        self.data = data
+        self.content_type = content_type
+        self.size = size
+        self.timings = timings
+
+
+class RenditionEngine:
+    """
+    Build all size variants of one image: decode once, downsample in cascade (largest first,
+    each step resizing the previous, already smaller, image) and encode the variants in parallel.
+    """
+
+    def __init__(self, profiles: Dict[str, Dict[str, Any]] = None, executor: ThreadPoolExecutor = encode_executor):
+        self.profiles = profiles if profiles is not None else load_profiles()
+        self.executor = executor
+
+    def content_type(self, label: str) -> str:
+        return CONTENT_TYPES[self.profiles[label]["format"]]
+
+    def render(self, source: Union[bytes, Image.Image]) -> Iterator[Rendition]:
+        """
+        Yield renditions in completion order, so callers can start uploading the first
+        finished variant while the others are still encoding.
+        """
+        t0 = time.perf_counter()
+        if isinstance(source, Image.Image):
+            image = source
+        else:
+            image = Image.open(BytesIO(source))
+            image.load()
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGB")
+        decode_ms = (time.perf_counter() - t0) * 1000
+
+        futures: List[Future] = []
+        current = image
+        for label, profile in sorted(self.profiles.items(), key=lambda kv: kv[1]["width"], reverse=True):
+            t0 = time.perf_counter()
+            current = _downsample(current, profile["width"])
+            resize_ms = (time.perf_counter() - t0) * 1000
+            timings = {"decode_ms": decode_ms, "resize_ms": resize_ms}
+            futures.append(self.executor.submit(self._encode, label, current, profile, timings))
+
+        for done in as_completed(futures):
+            yield done.result()
+
+    def _encode(self, label: str, image: Image.Image, profile: Dict[str, Any], timings: Dict[str, float]) -> Rendition:
+        fmt = profile["format"]
+        options = {k: v for k, v in profile.items() if k not in ("width", "format")}
+        if fmt == "JPEG" and image.mode == "RGBA":
+            image = image.convert("RGB")
+
+        t0 = time.perf_counter()
+        buffer = BytesIO()
+        image.save(buffer, format=fmt, **options)
+        timings["encode_ms"] = (time.perf_counter() - t0) * 1000
+        data = buffer.getvalue()
+        timings["bytes"] = len(data)
+        return Rendition(label, data, CONTENT_TYPES[fmt], image.size, timings)
+
+
+def _downsample(image: Image.Image, width: int) -> Image.Image:
+    """
+    Same result as `thumbnail((width, width * 10_000))` without copying first: never upscales,
+    keeps aspect ratio. `reducing_gap` lets Pillow box-reduce before the final filter pass.
+    """
+    W, H = image.size
+    if W <= width:
+        return image
+    height = max(1, round(H * width / W))
+    return image.resize((width, height), resample=Image.LANCZOS, reducing_gap=2.0)
+
+
+def log_timings(file_name: str, timings: Dict[str, Dict[str, float]]) -> None:
+    parts = []
+    for label, t in timings.items():
+        parts.append(
+            f"{label}: resize={t.get('resize_ms', 0):.1f}ms encode={t.get('encode_ms', 0):.1f}ms "
+            f"upload={t.get('upload_ms', 0):.1f}ms bytes={int(t.get('bytes', 0))}"
+        )
+    log.info("renditions %s | %s", file_name, " | ".join(parts))
@@ -0,0 +1,99 @@
+import logging as log
+import secrets
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Union
+
+from PIL import Image
+
+from common import config
+from common.metrics import RENDITION_SECONDS, STAGE_ERRORS, count_bytes
+from provider.rendition import Rendition, RenditionEngine, log_timings
+
+
+class StorageInterface(ABC):
+    """
+    Where annotated images go. Objects are stored per rendition as `{size}/{file_key}`;
+    implementations provide the object write and the URL a client downloads it from.
+    """
+
+    def __init__(self, renditions: RenditionEngine = None):
+        self.renditions = renditions or RenditionEngine()
+        self._upload_pool = ThreadPoolExecutor(max_workers=config.UPLOAD_WORKERS, thread_name_prefix="storage-upload")
+
+    @abstractmethod
+    def put_object(self, object_name: str, data: bytes, content_type: str) -> None:
+        pass
+
+    @abstractmethod
+    def get_presigned_url(self, file_key: str, size: str = "medium", expires_in: int = 60 * 60 * 24) -> str:
+        pass
+
+    def check(self) -> None:
+        """
+        Raise if the backend cannot take objects (called by the readiness probe).
+        """
+
+    def generate_file_key(self, original_name: str) -> str:
+        ts = int(time.time() * 1000)
+        # safe replacement of spaces
+        safe = original_name.replace(" ", "_")
+        # random part: keys of diagnoses finishing in the same millisecond must not collide
+        return f"{ts}.{secrets.token_hex(8)}.{safe}"
+
+    def upload_resize_image(self, file_name: str, file_stream: Union[bytes, Image.Image]) -> Dict[str, Dict[str, float]]:
+        """
+        Upload every rendition (see RenditionEngine) as `{size}/{file_name}`.
+        Each variant is uploaded as soon as its encode finishes; returns per-variant timings.
+        """
+        def upload(rendition: Rendition) -> Rendition:
+            t0 = time.perf_counter()
+            self.put_object(f"{rendition.label}/{file_name}", rendition.data, rendition.content_type)
+            rendition.timings["upload_ms"] = (time.perf_counter() - t0) * 1000
+            return rendition
+
+        try:
+            uploads = {}
+            for rendition in self.renditions.render(file_stream):
+                uploads[rendition.label] = self._upload_pool.submit(upload, rendition)
+
+            upload_errors = []
+            timings = {}
+            for size_label, future in uploads.items():
+                try:
+                    timings[size_label] = future.result().timings
+                except Exception as e:
+                    log.error("Error uploading %s size for %s: %s", size_label, file_name, e)
+                    STAGE_ERRORS.inc(stage="put_object")
+                    upload_errors.append((size_label, str(e)))
+
+            for size_label, t in timings.items():
+                RENDITION_SECONDS.observe(t["encode_ms"] / 1000, size=size_label, step="encode")
+                RENDITION_SECONDS.observe(t["upload_ms"] / 1000, size=size_label, step="upload")
+                count_bytes("upload", "out", int(t["bytes"]))
+
+            if upload_errors:
+                raise Exception(f"Some uploads failed: {upload_errors}")
+
+            log_timings(file_name, timings)
+            return timings
+        except Exception as e:
+            log.error("upload_resize_image error: %s", e)
+            raise
+
+
+def build_storage() -> StorageInterface:
+    """
+    The storage described by STORAGE_BACKEND.
+    """
+    backend = config.STORAGE_BACKEND.lower()
+    if backend == "minio":
+        from provider.minIO import MinioService
+
+        return MinioService()
+    if backend == "local":
+        from provider.local_storage import LocalStorage
+
+        return LocalStorage(config.STORAGE_DIR)
+    raise ValueError(f"Unknown STORAGE_BACKEND: {config.STORAGE_BACKEND}")
@@ -0,0 +1,13 @@
+"""
+Test setup: modules import the way they do when the app runs from `src/` (`from common...`),
+and the model key the service checks at build time is set to a dummy.
+
+    python -m pytest -q
+
+Run from the repository root. Nothing here reaches the network: servers are local.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+os.environ.setdefault("GEMINI_API_KEY", "test")
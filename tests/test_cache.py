@@ -0,0 +1,156 @@
+"""
+common/cache.py: single-flight in DiagnosisCache.get_or_compute and the tiers behind it.
+"""
+import asyncio
+import threading
+
+from common.cache import DiagnosisCache, DiskTier, MemoryTier
+
+
+class Compute:
+    """
+    A model call stand-in: counts calls and holds every call until `release` is set.
+    """
+
+    def __init__(self, fail: bool = False):
+        self.calls = 0
+        self.fail = fail
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if self.fail:
+            raise RuntimeError("model failed")
+        return {"analysis_vn": {"prediction": "leaf spot"}, "call": self.calls}
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_concurrent_misses_share_one_computation():
+    async def run():
+        cache = DiagnosisCache([MemoryTier()])
+        compute = Compute()
+        waiters = [asyncio.create_task(cache.get_or_compute("k", compute)) for _ in range(10)]
+        await settle()
+        compute.release.set()
+        results = await asyncio.gather(*waiters)
+        return compute.calls, results, cache._flights
+
+    calls, results, flights = asyncio.run(run())
+    assert calls == 1
+    assert all(r is results[0] for r in results)
+    assert "created_at" in results[0]
+    assert flights == {}
+
+
+def test_a_stored_value_is_served_without_computing():
+    async def run():
+        cache = DiagnosisCache([MemoryTier()])
+        compute = Compute()
+        compute.release.set()
+        first = await cache.get_or_compute("k", compute)
+        second = await cache.get_or_compute("k", compute)
+        other = await cache.get_or_compute("other", compute)
+        return compute.calls, first, second, other
+
+    calls, first, second, other = asyncio.run(run())
+    assert calls == 2  # "k" once, "other" once
+    assert second == first
+    assert other["call"] == 2
+
+
+def test_a_failure_reaches_every_waiter_and_is_not_cached():
+    async def run():
+        cache = DiagnosisCache([MemoryTier()])
+        failing = Compute(fail=True)
+        waiters = [asyncio.create_task(cache.get_or_compute("k", failing)) for _ in range(3)]
+        await settle()
+        failing.release.set()
+        outcomes = await asyncio.gather(*waiters, return_exceptions=True)
+        retry = Compute()
+        retry.release.set()
+        return outcomes, await cache.get_or_compute("k", retry), retry.calls
+
+    outcomes, value, retry_calls = asyncio.run(run())
+    assert [type(o) for o in outcomes] == [RuntimeError] * 3
+    assert retry_calls == 1
+    assert value["call"] == 1
+
+
+def test_a_cancelled_caller_leaves_the_flight_to_the_others():
+    async def run():
+        cache = DiagnosisCache([MemoryTier()])
+        compute = Compute()
+        leader = asyncio.create_task(cache.get_or_compute("k", compute))
+        await settle()
+        follower = asyncio.create_task(cache.get_or_compute("k", compute))
+        await settle()
+        leader.cancel()
+        await settle()
+        compute.release.set()
+        value = await follower
+        return leader.cancelled(), value, compute.calls
+
+    leader_cancelled, value, calls = asyncio.run(run())
+    assert leader_cancelled
+    assert value["call"] == 1
+    assert calls == 1
+
+
+def test_a_flight_whose_callers_all_left_still_stores_its_result():
+    async def run():
+        cache = DiagnosisCache([MemoryTier()])
+        compute = Compute()
+        caller = asyncio.create_task(cache.get_or_compute("k", compute))
+        await settle()
+        caller.cancel()
+        await settle()
+        compute.release.set()
+        await settle()
+        return await cache.get("k"), compute.calls
+
+    stored, calls = asyncio.run(run())
+    assert stored is not None and stored["call"] == 1
+    assert calls == 1
+
+
+def test_disk_hits_are_promoted_to_memory(tmp_path):
+    async def run():
+        disk = DiskTier(str(tmp_path))
+        disk.set("k", {"analysis_vn": {}, "created_at": 1.0})
+        memory = MemoryTier()
+        cache = DiagnosisCache([memory, disk])
+        compute = Compute()
+        value = await cache.get_or_compute("k", compute)
+        return value, memory.get("k"), compute.calls
+
+    value, promoted, calls = asyncio.run(run())
+    assert calls == 0
+    assert value == promoted == {"analysis_vn": {}, "created_at": 1.0}
+
+
+def test_disk_writes_from_many_threads_are_all_counted(tmp_path):
+    disk = DiskTier(str(tmp_path), max_entries=10_000)
+    threads = [
+        threading.Thread(target=lambda n=n: [disk.set(f"{n}-{i}", {"i": i}) for i in range(100)])
+        for n in range(8)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert disk._writes == 800
+
+
+def test_disk_eviction_runs_every_256_writes(tmp_path):
+    disk = DiskTier(str(tmp_path), max_entries=100)
+    for i in range(255):
+        disk.set(f"{i:04d}", {"i": i})
+    assert len(list(tmp_path.glob("*.json"))) == 255
+    disk.set("0255", {"i": 255})
+    assert len(list(tmp_path.glob("*.json"))) == 100
+    assert (tmp_path / "0255.json").exists()
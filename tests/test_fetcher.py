@@ -0,0 +1,291 @@
+"""
+api/health/fetcher.py against a local HTTP/1.1 server: what is refused and how early, the
+ETag revalidation, and the connect / read / total deadlines.
+"""
+import asyncio
+import hashlib
+import socket
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from typing import Dict
+
+import httpx
+import pytest
+from PIL import Image
+
+from api.health.fetcher import ImageFetcher
+from api.health.router import _fetch_error
+from api.health.uploads import NotAnImage, UploadTooLarge
+
+MAX_BYTES = 256 * 1024
+BIG = b"\0" * (32 * 1024 * 1024)  # well past what the loopback socket buffers absorb (a few MB)
+
+
+def sample_png() -> bytes:
+    out = BytesIO()
+    Image.new("RGB", (64, 48), (40, 140, 40)).save(out, "PNG")
+    return out.getvalue()
+
+
+def png_header(width: int, height: int, data_bytes: int) -> bytes:
+    """
+    Signature, IHDR claiming `width` x `height` and the header of an IDAT chunk of `data_bytes`.
+    """
+    ihdr = b"IHDR" + struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n" + struct.pack(">I", 13) + ihdr + struct.pack(">I", zlib.crc32(ihdr))
+        + struct.pack(">I", data_bytes) + b"IDAT"
+    )
+
+
+class Server:
+    """
+    ThreadingHTTPServer on a free port. Counts connections, 304s and the body bytes each path
+    managed to write before the client hung up.
+    """
+
+    def __init__(self):
+        self.sample = sample_png()
+        self.etag = '"' + hashlib.sha1(self.sample).hexdigest() + '"'
+        self.connections = 0
+        self.not_modified = 0
+        self.written: Dict[str, int] = {}
+        self.done: Dict[str, threading.Event] = {}
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with server.lock:
+                    server.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.route(self)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.base = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def route(self, h: BaseHTTPRequestHandler) -> None:
+        path = h.path
+        if path == "/sample":
+            if h.headers.get("If-None-Match") == self.etag:
+                with self.lock:
+                    self.not_modified += 1
+                h.send_response(304)
+                h.send_header("ETag", self.etag)
+                h.send_header("Content-Length", "0")
+                h.end_headers()
+                return
+            self.send(h, path, self.sample, "image/png", {"ETag": self.etag})
+        elif path == "/untagged":
+            self.send(h, path, self.sample, "image/png")
+        elif path == "/page":
+            self.send(h, path, b"<html>" + BIG + b"</html>", "text/html; charset=utf-8")
+        elif path == "/octet-stream":
+            self.send(h, path, self.sample, "application/octet-stream")
+        elif path == "/not-image":
+            self.send(h, path, b"\x01" * (MAX_BYTES // 2), "application/octet-stream")
+        elif path == "/short-text":
+            self.send(h, path, b"hello", "application/octet-stream")
+        elif path == "/big":
+            self.send(h, path, self.sample + BIG, "image/png")
+        elif path == "/big-chunked":
+            self.send(h, path, self.sample + BIG, "image/png", length=False)
+        elif path == "/huge-dims":
+            self.send(h, path, png_header(30000, 30000, MAX_BYTES) + b"\0" * (MAX_BYTES // 2), "image/png")
+        elif path == "/stall":
+            h.send_response(200)
+            h.send_header("Content-Type", "image/png")
+            h.send_header("Content-Length", str(len(self.sample)))
+            h.end_headers()
+            h.wfile.write(self.sample[:100])
+            h.wfile.flush()
+            time.sleep(2)
+            h.close_connection = True
+        elif path == "/drip":
+            self.send(h, path, self.sample + b"\0" * 1024, "image/png", drip=0.02)  # ~1.3 s in all
+        else:
+            h.send_error(404)
+
+    def send(self, h, path, body: bytes, content_type: str, headers=None, length: bool = True, drip: float = 0) -> None:
+        done = self.done.setdefault(path, threading.Event())
+        h.send_response(200)
+        h.send_header("Content-Type", content_type)
+        for k, v in (headers or {}).items():
+            h.send_header(k, v)
+        if length:
+            h.send_header("Content-Length", str(len(body)))
+        else:
+            h.send_header("Transfer-Encoding", "chunked")
+        h.end_headers()
+        sent = 0
+        try:
+            step = 16 if drip else 64 * 1024
+            for i in range(0, len(body), step):
+                part = body[i:i + step]
+                h.wfile.write(b"%x\r\n%s\r\n" % (len(part), part) if not length else part)
+                sent += len(part)
+                if drip:
+                    h.wfile.flush()
+                    time.sleep(drip)
+            if not length:
+                h.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            h.close_connection = True
+        with self.lock:
+            self.written[path] = sent
+        done.set()
+
+    def bytes_written(self, path: str) -> int:
+        """
+        Body bytes the handler for `path` wrote, once it has given up on the closed connection.
+        """
+        assert self.done[path].wait(10), f"{path} is still being served"
+        return self.written[path]
+
+
+@pytest.fixture(scope="module")
+def server():
+    server = Server()
+    yield server
+    server.httpd.shutdown()
+    server.httpd.server_close()
+
+
+def fetch(url: str, client_timeout: httpx.Timeout = httpx.Timeout(5), **kwargs) -> bytes:
+    """
+    One fetch with a fresh client; `kwargs` go to ImageFetcher (max_bytes defaults to MAX_BYTES).
+    """
+    async def run() -> bytes:
+        async with httpx.AsyncClient(timeout=client_timeout) as client:
+            return await ImageFetcher(client, **{"max_bytes": MAX_BYTES, **kwargs}).fetch(url)
+
+    return asyncio.run(run())
+
+
+def test_fetches_an_image(server):
+    assert fetch(f"{server.base}/sample") == server.sample
+
+
+def test_generic_binary_content_type_is_sniffed(server):
+    assert fetch(f"{server.base}/octet-stream") == server.sample
+
+
+def test_refuses_a_non_image_content_type_before_the_body(server):
+    with pytest.raises(NotAnImage, match="text/html"):
+        fetch(f"{server.base}/page")
+    assert server.bytes_written("/page") < len(BIG) // 2
+
+
+def test_refuses_a_declared_content_length_over_the_limit(server):
+    with pytest.raises(UploadTooLarge):
+        fetch(f"{server.base}/big")
+    assert server.bytes_written("/big") < len(BIG) // 2
+
+
+def test_stops_reading_a_chunked_body_at_the_limit(server):
+    with pytest.raises(UploadTooLarge, match=str(MAX_BYTES)):
+        fetch(f"{server.base}/big-chunked")
+    assert server.bytes_written("/big-chunked") < len(BIG) // 2
+
+
+def test_refuses_a_body_that_does_not_sniff_as_an_image(server):
+    with pytest.raises(NotAnImage, match="supported image"):
+        fetch(f"{server.base}/not-image")
+    with pytest.raises(NotAnImage):
+        fetch(f"{server.base}/short-text")  # ends before SNIFF_BYTES
+
+
+def test_refuses_header_dimensions_over_the_pixel_limit(server):
+    with pytest.raises(UploadTooLarge, match="pixels"):
+        fetch(f"{server.base}/huge-dims", max_bytes=4 * MAX_BYTES)
+    # no pixel limit: the header is not checked, the (small) body is read whole
+    assert len(fetch(f"{server.base}/huge-dims", max_bytes=4 * MAX_BYTES, max_pixels=0)) > MAX_BYTES // 2
+
+
+def test_revalidates_with_the_etag_and_reuses_the_body(server):
+    async def run():
+        async with httpx.AsyncClient(timeout=5) as client:
+            fetcher = ImageFetcher(client, max_bytes=MAX_BYTES)
+            return [await fetcher.fetch(f"{server.base}/sample") for _ in range(3)]
+
+    connections, not_modified = server.connections, server.not_modified
+    bodies = asyncio.run(run())
+    assert bodies == [server.sample] * 3
+    assert server.not_modified - not_modified == 2
+    assert server.connections - connections == 1  # the 304s come back on the pooled connection
+
+
+def test_does_not_keep_bodies_without_validators_or_with_the_cache_off(server):
+    async def run(url, cache_bytes):
+        async with httpx.AsyncClient(timeout=5) as client:
+            fetcher = ImageFetcher(client, max_bytes=MAX_BYTES, cache_bytes=cache_bytes)
+            for _ in range(2):
+                await fetcher.fetch(url)
+            return len(fetcher._cache)
+
+    not_modified = server.not_modified
+    assert asyncio.run(run(f"{server.base}/untagged", 1 << 20)) == 0
+    assert asyncio.run(run(f"{server.base}/sample", 0)) == 0
+    assert server.not_modified == not_modified
+
+
+def test_connect_timeout():
+    # a listener whose backlog is full: the kernel drops further SYNs, connect() hangs
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(0)
+    port = listener.getsockname()[1]
+    filler = []
+    for _ in range(8):
+        s = socket.socket()
+        s.setblocking(False)
+        try:
+            s.connect(("127.0.0.1", port))
+        except BlockingIOError:
+            pass
+        filler.append(s)
+    try:
+        t0 = time.perf_counter()
+        with pytest.raises(httpx.ConnectTimeout) as exc:
+            fetch(f"http://127.0.0.1:{port}/", client_timeout=httpx.Timeout(5, connect=0.2))
+        assert time.perf_counter() - t0 < 2
+        assert _fetch_error(exc.value).status_code == 504
+    finally:
+        for s in filler + [listener]:
+            s.close()
+
+
+def test_read_timeout(server):
+    t0 = time.perf_counter()
+    with pytest.raises(httpx.ReadTimeout) as exc:
+        fetch(f"{server.base}/stall", client_timeout=httpx.Timeout(5, read=0.2))
+    assert time.perf_counter() - t0 < 1.5
+    assert _fetch_error(exc.value).status_code == 504
+
+
+def test_total_deadline_covers_a_slow_trickle(server):
+    # every read returns within the read timeout, only the total deadline stops it
+    t0 = time.perf_counter()
+    with pytest.raises(TimeoutError) as exc:
+        fetch(f"{server.base}/drip", timeout=0.5)
+    assert time.perf_counter() - t0 < 1.5
+    assert _fetch_error(exc.value).status_code == 504
+
+
+def test_fetch_errors_map_to_statuses():
+    assert _fetch_error(UploadTooLarge("x")).status_code == 413
+    assert _fetch_error(NotAnImage("x")).status_code == 415
+    assert _fetch_error(httpx.ConnectError("refused")).status_code == 502
@@ -0,0 +1,128 @@
+"""
+api/health/history.py: keyset pagination of a user's / field's diagnoses, the dedup of
+resubmitted photos, and the label / severity counts.
+"""
+import threading
+
+import pytest
+
+from api.health.history import SqliteHistoryStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SqliteHistoryStore(str(tmp_path / "history.db"))
+
+
+def record(n: int, user_id="u1", field_id="f1", created_at=None, labels=("leaf_spot",), severity="Cao", **extra):
+    return {
+        "user_id": user_id, "field_id": field_id, "created_at": created_at if created_at is not None else 1000.0 + n,
+        "image_hash": f"hash-{n}", "file_key": f"key-{n}", "model": "gemini-2.5-flash",
+        "detections": [{"label": label, "box_2d": [0, 0, 1, 1]} for label in labels],
+        "analysis_vn": {"prediction": f"p{n}", "severity_level": severity}, "timings": {"model": 1.0},
+        **extra,
+    }
+
+
+def pages(store, limit, **owner):
+    items, cursor, seen = [], None, 0
+    while True:
+        page, cursor = store.list(limit=limit, cursor=cursor, **owner)
+        assert len(page) <= limit
+        items.extend(page)
+        seen += 1
+        if cursor is None:
+            return items, seen
+
+
+def test_pages_cover_every_diagnosis_once_newest_first(store):
+    # timestamps collide in threes: the cursor must break ties on insertion order
+    ids = [store.add(record(n, created_at=1000.0 + n // 3)) for n in range(25)]
+    items, page_count = pages(store, limit=7, user_id="u1")
+    assert [item["diagnosis_id"] for item in items] == ids[::-1]
+    assert page_count == 4
+    assert items[0]["prediction"] == "p24"
+    assert items[0]["labels"] == ["leaf_spot"]
+
+
+def test_an_exact_last_page_has_no_cursor(store):
+    for n in range(6):
+        store.add(record(n))
+    page, cursor = store.list(user_id="u1", limit=3)
+    page, cursor = store.list(user_id="u1", limit=3, cursor=cursor)
+    assert len(page) == 3
+    assert cursor is None
+
+
+def test_newer_diagnoses_do_not_shift_the_following_pages(store):
+    ids = [store.add(record(n)) for n in range(6)]
+    first, cursor = store.list(user_id="u1", limit=3)
+    store.add(record(99, created_at=5000.0))
+    second, _ = store.list(user_id="u1", limit=3, cursor=cursor)
+    assert [item["diagnosis_id"] for item in first + second] == ids[::-1]
+
+
+def test_lists_only_the_requested_owner(store):
+    store.add(record(1, user_id="u1", field_id="f1"))
+    store.add(record(2, user_id="u1", field_id="f2"))
+    store.add(record(3, user_id="u2", field_id="f1"))
+    assert [i["prediction"] for i in store.list(user_id="u1")[0]] == ["p2", "p1"]
+    assert [i["prediction"] for i in store.list(field_id="f1")[0]] == ["p3", "p1"]
+    assert [i["prediction"] for i in store.list(user_id="u1", field_id="f1")[0]] == ["p1"]
+    with pytest.raises(ValueError):
+        store.list()
+    with pytest.raises(ValueError):
+        store.list(user_id="u1", cursor="not-a-cursor")
+
+
+def test_a_resubmitted_photo_is_recorded_once(store):
+    first = store.add(record(1))
+    assert store.add(record(1, created_at=2000.0)) == first
+    assert store.add(record(1, user_id=None, field_id=None)) == store.add(record(1, user_id=None, field_id=None))
+    # another owner, or a new annotated object (not served from the cache): a new diagnosis
+    assert store.add(record(1, user_id="u2")) != first
+    assert store.add(record(1, file_key="key-other")) != first
+    assert len(store.list(user_id="u1")[0]) == 2
+    assert store.aggregate("label", 0, 10_000, user_id="u1")["total"] == 2
+
+
+def test_concurrent_resubmissions_keep_one_row(store):
+    ids = []
+    lock = threading.Lock()
+
+    def add():
+        diagnosis_id = store.add(record(1))
+        with lock:
+            ids.append(diagnosis_id)
+
+    threads = [threading.Thread(target=add) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(set(ids)) == 1
+    assert len(store.list(user_id="u1")[0]) == 1
+
+
+def test_get_returns_the_full_record(store):
+    diagnosis_id = store.add(record(1))
+    got = store.get(diagnosis_id)
+    assert got["analysis_vn"] == {"prediction": "p1", "severity_level": "Cao"}
+    assert got["detections"][0]["label"] == "leaf_spot"
+    assert got["timings"] == {"model": 1.0}
+    assert store.get("missing") is None
+
+
+def test_counts_per_label_and_severity(store):
+    store.add(record(1, labels=("rust", "leaf_spot"), severity="Cao"))
+    store.add(record(2, labels=("rust",), severity="Thấp"))
+    store.add(record(3, labels=(), severity=""))
+    store.add(record(4, labels=("rust",), user_id="u2"))
+    store.add(record(5, labels=("rust",), created_at=9000.0))
+
+    by_label = store.aggregate("label", 1000.0, 2000.0, user_id="u1")
+    assert by_label == {"total": 3, "counts": [("rust", 2), ("leaf_spot", 1)]}
+    by_severity = store.aggregate("severity", 1000.0, 2000.0)
+    assert by_severity == {"total": 4, "counts": [("Cao", 2), (None, 1), ("Thấp", 1)]}
+    with pytest.raises(ValueError):
+        store.aggregate("model", 0, 1)
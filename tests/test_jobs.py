@@ -0,0 +1,209 @@
+"""
+api/health/jobs.py: job leases in both stores (claim, renew, reclaim after expiry, the owner
+check on update, release, max attempts) and the runner dropping a job whose lease it lost.
+"""
+import asyncio
+import sqlite3
+import time
+
+import pytest
+
+from api.health.jobs import LEASE_EXPIRED, JobRunner, MemoryJobStore, QueueFull, SqliteJobStore
+
+LEASE = 0.2
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    def make(**kwargs):
+        kwargs.setdefault("lease", LEASE)
+        if request.param == "memory":
+            return MemoryJobStore(**kwargs)
+        return SqliteJobStore(str(tmp_path / "jobs.db"), **kwargs)
+
+    return make
+
+
+def expire():
+    time.sleep(LEASE * 1.5)
+
+
+def test_claims_in_submission_order(make_store):
+    store = make_store()
+    first, second = store.submit({"n": 1}), store.submit({"n": 2})
+    assert store.claim("a") == (first, {"n": 1})
+    assert store.claim("b") == (second, {"n": 2})
+    assert store.claim("a") is None
+    assert store.get(first)["status"] == "running"
+
+
+def test_only_the_lease_holder_updates(make_store):
+    store = make_store()
+    job_id = store.submit({})
+    store.claim("a")
+    assert not store.update(job_id, "b", stage="downloaded")
+    assert store.get(job_id)["stage"] is None
+    assert store.update(job_id, "a", stage="downloaded")
+    assert store.update(job_id, "a", status="done", result={"analysis_vn": {}})
+    # finished: nobody updates it any more
+    assert not store.update(job_id, "a", status="failed", error="late")
+    assert store.get(job_id)["status"] == "done"
+    assert store.get(job_id)["result"] == {"analysis_vn": {}}
+
+
+def test_an_expired_lease_is_reclaimed_by_another_worker(make_store):
+    store = make_store()
+    job_id = store.submit({"n": 1})
+    store.claim("a")
+    expire()
+    assert store.claim("b") == (job_id, {"n": 1})
+    assert store.renew([job_id], "a") == []
+    assert not store.update(job_id, "a", status="done", result={})
+    assert store.update(job_id, "b", status="done", result={})
+
+
+def test_renewing_keeps_the_lease(make_store):
+    store = make_store()
+    job_id = store.submit({})
+    store.claim("a")
+    for _ in range(3):
+        time.sleep(LEASE / 2)
+        assert store.renew([job_id], "a") == [job_id]
+    assert store.claim("b") is None
+
+
+def test_a_job_abandoned_max_attempts_times_fails(make_store):
+    store = make_store(max_attempts=2)
+    job_id = store.submit({})
+    for _ in range(2):
+        assert store.claim("a")[0] == job_id
+        expire()
+    assert store.claim("b") is None
+    job = store.get(job_id)
+    assert job["status"] == "failed"
+    assert job["error"] == LEASE_EXPIRED
+
+
+def test_release_requeues_only_the_owners_jobs(make_store):
+    store = make_store()
+    job_id = store.submit({})
+    store.claim("a")
+    store.release([job_id], "b")
+    assert store.get(job_id)["status"] == "running"
+    store.release([job_id], "a")
+    assert store.get(job_id)["status"] == "queued"
+    assert store.claim("b")[0] == job_id
+
+
+def test_capacity_counts_active_jobs(make_store):
+    store = make_store(capacity=2)
+    store.submit({})
+    store.submit({})
+    with pytest.raises(QueueFull):
+        store.submit({})
+
+
+def test_sqlite_stores_on_one_file_share_the_queue(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    one, two = SqliteJobStore(path, lease=LEASE), SqliteJobStore(path, lease=LEASE)
+    job_id = one.submit({"n": 1})
+    assert two.claim("b") == (job_id, {"n": 1})
+    assert one.claim("a") is None
+
+
+def test_sqlite_migrates_and_reclaims_jobs_left_running_before_leases(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE jobs (id TEXT PRIMARY KEY, status TEXT NOT NULL, stage TEXT, payload TEXT NOT NULL,"
+        " result TEXT, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+    )
+    old = time.time() - 3600
+    conn.execute("INSERT INTO jobs VALUES ('stuck', 'running', 'downloaded', '{}', NULL, NULL, ?, ?)", (old, old))
+    conn.commit()
+    conn.close()
+
+    store = SqliteJobStore(path, lease=LEASE)
+    assert store.claim("a") == ("stuck", {})
+
+
+class Service:
+    """
+    HealthService stand-in: detect_item reports two stages, then waits for `release`.
+    """
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.started = asyncio.Event()
+        self.cancelled = False
+
+    async def detect_item(self, payload, progress):
+        await progress("downloaded")
+        self.started.set()
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        await progress("analyzed")
+        return "https://example/annotated.png", {"prediction": payload["n"]}, None
+
+
+async def wait_for(predicate, timeout: float = 3.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def test_runner_records_stages_and_the_result():
+    async def run():
+        store, service = MemoryJobStore(lease=LEASE), Service()
+        runner = JobRunner(store, service, workers=1, poll_interval=0.05, lease=LEASE)
+        runner.start()
+        job_id = await runner.submit({"n": 7})
+        await service.started.wait()
+        stage = (await runner.get(job_id))["stage"]
+        service.release.set()
+        await wait_for(lambda: store.get(job_id)["status"] == "done")
+        await runner.stop()
+        return stage, store.get(job_id)
+
+    stage, job = asyncio.run(run())
+    assert stage == "downloaded"
+    assert job["stage"] == "analyzed"
+    assert job["result"]["analysis_vn"] == {"prediction": 7}
+
+
+def test_runner_drops_a_job_whose_lease_was_taken():
+    async def run():
+        store, service = MemoryJobStore(lease=LEASE), Service()
+        runner = JobRunner(store, service, workers=1, poll_interval=0.05, lease=LEASE)
+        runner.start()
+        job_id = await runner.submit({"n": 1})
+        await service.started.wait()
+        # another worker reclaimed it (as after a missed renewal)
+        store._jobs[job_id]["worker"] = "other"
+        await wait_for(lambda: service.cancelled and not runner._running)
+        await runner.stop()  # before the new owner's lease runs out and the job is reclaimed
+        return store.get(job_id)
+
+    job = asyncio.run(run())
+    assert job["status"] == "running"
+    assert job["worker"] == "other"
+    assert job["result"] is None
+
+
+def test_runner_stop_puts_running_jobs_back_in_the_queue(tmp_path):
+    async def run():
+        store, service = SqliteJobStore(str(tmp_path / "jobs.db"), lease=LEASE), Service()
+        runner = JobRunner(store, service, workers=1, poll_interval=0.05, lease=LEASE)
+        runner.start()
+        job_id = await runner.submit({"n": 1})
+        await service.started.wait()
+        await runner.stop()
+        return store.get(job_id), service.cancelled
+
+    job, cancelled = asyncio.run(run())
+    assert cancelled
+    assert job["status"] == "queued"
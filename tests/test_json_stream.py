@@ -0,0 +1,121 @@
+"""
+common/json_stream.py: members reported by IncrementalJsonParser as a streamed response arrives,
+and repair_json completing responses that were cut short.
+"""
+import json
+
+import pytest
+
+from common.json_stream import IncrementalJsonParser, repair_json
+from common.utils import parse_detections
+
+RESPONSE = {
+    "detections": [
+        {"label": "leaf_spot", "confidence": 0.82, "box_2d": [120, 250, 460, 620]},
+        {"label": "rust {x}", "confidence": 1, "box_2d": [1, 2, 3, 4]},
+    ],
+    "analysis_vn": {
+        "prediction": "Cây bị \"đốm lá\" }{ ][",
+        "severity_level": "Trung bình",
+        "possible_causes": [{"cause": "Nấm", "confidence": 0.7, "evidence": "vết nâu\\vàng"}],
+        "recommended_actions": [],
+        "monitoring_plan": "Kiểm tra\nmỗi 3 ngày",
+        "targetValue": -12.5e-1,
+        "done": True,
+        "missing": None,
+    },
+}
+TEXT = json.dumps(RESPONSE, ensure_ascii=False, indent=1)
+EXPECTED = [
+    (("detections",), RESPONSE["detections"]),
+    *((("analysis_vn", key), value) for key, value in RESPONSE["analysis_vn"].items()),
+    (("analysis_vn",), RESPONSE["analysis_vn"]),
+]
+
+
+def feed_all(chunks, expand=("analysis_vn",)):
+    parser = IncrementalJsonParser(expand=expand)
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    return parser, events
+
+
+def test_reports_root_and_expanded_members_in_order():
+    parser, events = feed_all([TEXT])
+    assert events == EXPECTED
+    assert parser.finished
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64])
+def test_chunk_boundaries_do_not_matter(size):
+    _, events = feed_all(TEXT[i:i + size] for i in range(0, len(TEXT), size))
+    assert events == EXPECTED
+
+
+def test_a_member_is_reported_as_soon_as_it_closes():
+    cut = TEXT.index('"severity_level"')
+    parser = IncrementalJsonParser()
+    early = parser.feed(TEXT[:cut])
+    assert [path for path, _ in early] == [("detections",), ("analysis_vn", "prediction")]
+    assert not parser.finished
+
+
+def test_a_number_waits_for_its_delimiter():
+    parser = IncrementalJsonParser()
+    assert parser.feed('{"a": {"b": 1}, "n": 12') == [(("a",), {"b": 1})]
+    assert parser.feed("34") == []
+    assert parser.feed("}") == [(("n",), 1234)]
+
+
+def test_text_around_the_object_is_ignored():
+    parser, events = feed_all(["```json\n", TEXT, "\n```\n{\"extra\": 1}"])
+    assert events == EXPECTED
+
+
+def test_only_the_listed_objects_are_expanded():
+    _, events = feed_all([TEXT], expand=())
+    assert [path for path, _ in events] == [("detections",), ("analysis_vn",)]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"a": 1}', '{"a": 1}'),
+    ('Here it is:\n```json\n{"a": [1, 2]}\n``` done', '{"a": [1, 2]}'),
+    ('[{"a": 1}] trailing', '[{"a": 1}]'),
+    ('{"a": "open str', '{"a": "open str"}'),
+    ('{"a": "esc \\', '{"a": "esc "}'),
+    ('{"a": "uni \\u00', '{"a": "uni "}'),
+    ('{"a": 1, "b', '{"a": 1}'),
+    ('{"a": 1, "b":', '{"a": 1}'),
+    ('{"a": 1,', '{"a": 1}'),
+    ('{"a": 10, "b": 10', '{"a": 10}'),  # "10" may be the start of "1000"
+    ('{"a": tr', '{}'),
+    ('{"a": true', '{"a": true}'),
+    ('{"a": [1, 2, {"b": [3', '{"a": [1, 2, {"b": []}]}'),
+    ('{"d": [{"l": "x", "c": 0.5}, {"l": "y"', '{"d": [{"l": "x", "c": 0.5}, {"l": "y"}]}'),
+])
+def test_repair_json(text, expected):
+    repaired = repair_json(text)
+    assert repaired == expected
+    json.loads(repaired)
+
+
+def test_repair_json_without_a_container():
+    assert repair_json("no json here") is None
+    assert repair_json("") is None
+
+
+@pytest.mark.parametrize("cut", range(0, len(TEXT), 5))
+def test_every_truncation_repairs_to_valid_json(cut):
+    repaired = repair_json(TEXT[:cut])
+    if repaired is not None:
+        assert isinstance(json.loads(repaired), dict)
+
+
+def test_parse_detections_keeps_what_arrived_before_the_cut():
+    cut = TEXT.index('"severity_level"') + len('"severity_level": "Tru')
+    detections, analysis = parse_detections("```json\n" + TEXT[:cut])
+    assert detections == RESPONSE["detections"]
+    assert analysis["prediction"] == RESPONSE["analysis_vn"]["prediction"]
+    assert analysis["severity_level"] == "Tru"
+    assert parse_detections("not json") == ([], {})